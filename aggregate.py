@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+'''
+This module contracts the coauthor network by categorical author attributes,
+such as country, affiliation, or research area.  Each aggregated network has
+one vertex per category and one weighted edge per pair of categories with
+at least one coauthor pair between them.  Coauthor pairs within a single
+category are counted as self-loops and stored in the vertex property
+`n_loops`, rather than as edges.
+
+Authors can belong to several categories at once:  `areas` is a list, and
+`collapse_duplicates` stores lists of countries and affiliations for authors
+with more than one SID.  A coauthor pair between multi-valued authors counts
+once for each combination of their categories.
+
+All of the requested aggregations are computed from a single pass over the
+edge list of the network, using numpy to group the edges.
+'''
+
+import ast
+
+net_infile = 'coauth_net.gt'
+# Attributes to aggregate, and the files to write the aggregated networks to
+aggregate_outfiles = {'country': 'country_net.graphml',
+						'affiliation': 'affiliation_net.graphml',
+						'areas': 'areas_net.graphml'}
+
+
+def _categories(value):
+	'''
+	Normalize the value of a vertex attribute into a list of categories
+
+	:param value: A string, a list of strings, or the string representation of
+		a list of strings (as written by `collapse_duplicates`)
+	:return: List of category strings; missing values become `['']`
+	'''
+	if value is None:
+		return([''])
+	if isinstance(value, str):
+		if not value.startswith('['):
+			return([value])
+		try:
+			value = ast.literal_eval(value)
+		except (ValueError, SyntaxError):
+			return([value])
+	# Drop repeated categories, keeping the order
+	cats = list(dict.fromkeys(str(item) for item in value))
+	if cats == []:
+		return([''])
+	return(cats)
+
+
+def _incidence(net, attribute):
+	'''
+	Build the vertex-category incidence lists for `attribute`
+
+	:param net: The coauthor network
+	:param attribute: Name of the vertex property to aggregate by
+	:return: Tuple `(offsets, codes, names)`.  The categories of vertex `i` are
+		`codes[offsets[i]:offsets[i+1]]`, and `names[c]` is the name of
+		category code `c`.
+	'''
+	import numpy as np
+	prop = net.vp[attribute]
+	index = {}
+	counts = np.zeros(net.num_vertices(), dtype = np.int64)
+	codes = []
+	for v in net.vertices():
+		cats = _categories(prop[v])
+		counts[int(v)] = len(cats)
+		codes += [index.setdefault(cat, len(index)) for cat in cats]
+	offsets = np.zeros(len(counts) + 1, dtype = np.int64)
+	np.cumsum(counts, out = offsets[1:])
+	names = sorted(index, key = index.get)
+	return(offsets, np.array(codes, dtype = np.int64), names)
+
+
+def _contract(edges, offsets, codes, names, fractional = False):
+	'''
+	Contract an edge list onto the categories given by an incidence list
+
+	:param edges: Array of shape `(m, 2)` of vertex indices
+	:param offsets, codes, names: Incidence lists, from `_incidence`
+	:param fractional: If True, an edge between authors with `j` and `k`
+		categories contributes `1/(j*k)` to each combination, so that the
+		total weight equals the number of coauthor pairs
+	:return: Dict with the category `names`, the number of authors `size`
+		in each category, self-loop weights `n_loops`, and the contracted
+		edge list `pairs` with `weights`
+	'''
+	import numpy as np
+	n_cats = len(names)
+	src = edges[:, 0]
+	tgt = edges[:, 1]
+	n_src = offsets[src + 1] - offsets[src]
+	n_tgt = offsets[tgt + 1] - offsets[tgt]
+	# Expand each edge into every combination of its endpoints' categories
+	reps = n_src * n_tgt
+	edge_ix = np.repeat(np.arange(len(edges)), reps)
+	pos = np.arange(reps.sum()) - np.repeat(np.cumsum(reps) - reps, reps)
+	n_tgt_rep = n_tgt[edge_ix]
+	cat_src = codes[offsets[src[edge_ix]] + pos // n_tgt_rep]
+	cat_tgt = codes[offsets[tgt[edge_ix]] + pos % n_tgt_rep]
+	if fractional:
+		weight = 1 / reps[edge_ix]
+	else:
+		weight = np.ones(len(edge_ix))
+
+	# Self-loops go into the vertices
+	loops = cat_src == cat_tgt
+	n_loops = np.bincount(cat_src[loops], weights = weight[loops],
+							minlength = n_cats)
+	# Everything else is grouped into undirected, weighted edges
+	low = np.minimum(cat_src[~loops], cat_tgt[~loops])
+	high = np.maximum(cat_src[~loops], cat_tgt[~loops])
+	keys, inverse = np.unique(low * n_cats + high, return_inverse = True)
+	weights = np.bincount(inverse, weights = weight[~loops],
+							minlength = len(keys))
+	pairs = np.column_stack([keys // n_cats, keys % n_cats])
+
+	size = np.bincount(codes, minlength = n_cats)
+	return({'names': names, 'size': size, 'n_loops': n_loops,
+			'pairs': pairs, 'weights': weights})
+
+
+def aggregate(net, attributes = aggregate_outfiles.keys(), fractional = False):
+	'''
+	Contract the coauthor network by each of several vertex attributes
+
+	:param net: The coauthor network, as a `graph_tool.Graph`
+	:param attributes: Names of the vertex properties to aggregate by
+	:param fractional: Passed to `_contract`
+	:return: Dict mapping each attribute to its aggregated network
+	'''
+	import numpy as np
+	# The single pass over the edges; everything below works on this array
+	edges = net.get_edges()[:, :2].astype(np.int64)
+	quotients = {}
+	for attribute in attributes:
+		offsets, codes, names = _incidence(net, attribute)
+		quotients[attribute] = _to_graph(
+			_contract(edges, offsets, codes, names, fractional = fractional))
+	return(quotients)
+
+
+def _to_graph(contracted):
+	'''
+	Turn the output of `_contract` into a `graph_tool.Graph`
+	'''
+	import graph_tool as gt
+
+	q_net = gt.Graph(directed = False)
+	q_net.add_vertex(len(contracted['names']))
+	q_net.add_edge_list(contracted['pairs'])
+	q_net.vp['name'] = q_net.new_vp('string', vals = contracted['names'])
+	q_net.vp['size'] = q_net.new_vp('int', vals = contracted['size'])
+	q_net.vp['n_loops'] = q_net.new_vp('double', vals = contracted['n_loops'])
+	q_net.ep['weight'] = q_net.new_ep('double', vals = contracted['weights'])
+	return(q_net)
+
+
+def aggregate_files(infile = net_infile, outfiles = aggregate_outfiles,
+						fractional = False):
+	'''
+	Load the coauthor network, aggregate it, and save the aggregated networks
+
+	:param infile: Coauthor network file
+	:param outfiles: Dict mapping attributes to output graphml files
+	:return: True
+	'''
+	import graph_tool as gt
+	from export import ExportManager
+
+	net = gt.load_graph(infile)
+	quotients = aggregate(net, outfiles.keys(), fractional = fractional)
+	with ExportManager() as exports:
+		for attribute, q_net in quotients.items():
+			print(attribute + ': ' + str(q_net.num_vertices()) + ' vertices, ' +
+					str(q_net.num_edges()) + ' edges')
+			exports.save(q_net, outfiles[attribute])
+	return True
+
+
+if __name__ == '__main__':
+	aggregate_files()
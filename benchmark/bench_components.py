@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmark for `components.py`.  This script generates a synthetic network
+with one giant component and many small ones, like the coauthor network,
+and times each task two ways:
+	- `whole`:  graph-tool's function on the whole network, in one process
+	- `components`:  `components.analyze_edges`, with `--processes` workers
+and checks that the two agree (except `layout`, which is random).
+
+Usage:
+
+	python benchmark/bench_components.py --giant 20000 --small 5000 \
+		--processes 4 --tasks betweenness clustering paths layout
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+import numpy as np
+import components
+
+
+def synthetic_edges(n_giant, n_small, degree = 6, seed = 0):
+	'''
+	:param n_giant: Authors in the giant component
+	:param n_small: Number of small components, of 2 to 10 authors each
+	:return: Number of vertices, and `(m, 2)` array of edges, with the
+		vertices shuffled
+	'''
+	rng = np.random.default_rng(seed)
+	# A random tree holds the giant component together
+	tree = np.column_stack([np.arange(1, n_giant),
+							rng.integers(0, np.arange(1, n_giant))])
+	extra = rng.integers(0, n_giant, size = (n_giant * (degree // 2 - 1), 2))
+	edges = [tree, extra]
+	start = n_giant
+	for size in rng.integers(2, 11, size = n_small):
+		members = np.arange(start, start + size)
+		edges.append(np.column_stack([members[1:],
+									start + rng.integers(0, np.arange(1, size))]))
+		start += size
+	edges = np.concatenate(edges)
+	edges = edges[edges[:, 0] != edges[:, 1]]
+	edges = np.unique(np.sort(edges, axis = 1), axis = 0)
+	shuffle = rng.permutation(start)
+	return(start, shuffle[edges])
+
+
+def whole(task, n_vertices, edges):
+	'''
+	Run a task on the whole network, with graph-tool's own threads
+	'''
+	import graph_tool as gt
+	graph = gt.Graph(directed = False)
+	graph.add_vertex(n_vertices)
+	graph.add_edge_list(edges)
+	if task == 'betweenness':
+		from graph_tool.centrality import betweenness
+		return({'betweenness': betweenness(graph, norm = False)[0].a})
+	if task == 'clustering':
+		from graph_tool.clustering import local_clustering
+		return({'clustering': local_clustering(graph).a})
+	if task == 'paths':
+		from graph_tool.centrality import closeness
+		from graph_tool.topology import label_components
+		inverse_sum = closeness(graph, norm = False).a
+		labels, sizes = label_components(graph)
+		with np.errstate(divide = 'ignore', invalid = 'ignore'):
+			mean_dist = 1 / (inverse_sum * (sizes[labels.a] - 1))
+		mean_dist[~np.isfinite(mean_dist)] = np.nan
+		return({'mean_dist': mean_dist})
+	if task == 'layout':
+		from graph_tool.draw import sfdp_layout
+		x, y = sfdp_layout(graph).get_2d_array([0, 1])
+		return({'x': x, 'y': y})
+
+
+def run(args):
+	n_vertices, edges = synthetic_edges(args.giant, args.small)
+	print(str(n_vertices) + ' authors, ' + str(len(edges)) + ' pairs')
+	results = []
+	for task in args.tasks:
+		start = time.perf_counter()
+		expected = whole(task, n_vertices, edges)
+		whole_s = time.perf_counter() - start
+		start = time.perf_counter()
+		values = components.analyze_edges(n_vertices, edges, [task],
+											processes = args.processes)
+		components_s = time.perf_counter() - start
+		agree = task == 'layout' or all(
+					np.allclose(values[name], column, equal_nan = True)
+					for name, column in expected.items())
+		results.append({'task': task, 'whole_s': whole_s,
+						'components_s': components_s,
+						'speedup': whole_s / components_s, 'agree': agree})
+		print('{task}: {whole_s:.2f} s whole, {components_s:.2f} s by '
+				'component ({speedup:.1f}x); agree: {agree}'.format(
+					**results[-1]))
+	return(results)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+		description = 'Benchmark the component-parallel analyses')
+	parser.add_argument('--giant', type = int, default = 20000)
+	parser.add_argument('--small', type = int, default = 5000)
+	parser.add_argument('--processes', type = int)
+	parser.add_argument('--tasks', nargs = '+', choices = list(components.TASKS),
+						default = ['betweenness', 'clustering', 'paths'])
+	parser.add_argument('--output', default = 'bench_components.json')
+	args = parser.parse_args()
+
+	results = run(args)
+	with open(args.output, 'w') as writefile:
+		json.dump({'time': time.strftime('%c', time.localtime()),
+					'settings': vars(args), 'results': results},
+					writefile, indent = 4)
+	print('Results written to ' + args.output)
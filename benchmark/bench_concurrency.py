@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmark for the adaptive concurrency limit in `scrape/concurrency.py`.
+This script starts the local Scopus stand-in (`scrape/fake_scopus.py`) with a
+capacity that changes on a schedule, sends coauthor queries through
+`scrape._get_query` from a pool of threads for `--duration` seconds, and
+samples the concurrency limit and the server's capacity as it goes.
+
+For each step of the schedule it reports the mean capacity, the mean limit,
+the requests per second, and the number of `429` responses.  With `--fixed`,
+the limit is held at `--max-concurrency` instead, for comparison.
+
+Usage:
+
+	python benchmark/bench_concurrency.py --capacity 0:2,20:8,40:4 \
+		--duration 60 --latency 0.05 --output bench_concurrency.json
+'''
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_KEY = 'bench-key'
+SAMPLE_INTERVAL = 0.25		# Seconds between samples of the limit
+
+
+def run(args):
+	'''
+	:return: Dict of measurements
+	'''
+	sys.path.insert(0, REPO)
+	import scrape.fake_scopus as fake_scopus
+	capacity = fake_scopus.parse_schedule(args.capacity)
+	server = fake_scopus.serve(fake_scopus.SyntheticNetwork(args.authors),
+								{API_KEY: 10**9}, latency = args.latency,
+								capacity = capacity)
+	os.environ['SCOPUS_API_ROOT'] = 'http://localhost:' + \
+									str(server.server_port) + '/content/'
+	import scrape.concurrency as concurrency
+	import scrape.scrape as scrape
+	scrape.DELAY = args.delay
+	if args.fixed:
+		scrape.limiter = concurrency.AimdLimiter(
+							initial = args.max_concurrency,
+							minimum = args.max_concurrency,
+							maximum = args.max_concurrency)
+	else:
+		scrape.limiter = concurrency.AimdLimiter(maximum = args.max_concurrency)
+	limiter = scrape.limiter
+
+	samples = []
+	done = threading.Event()
+	def sample():
+		while not done.is_set():
+			samples.append({'t': time.time() - server.started,
+							'limit': int(limiter.limit),
+							'in_flight': limiter.in_flight,
+							'capacity': server.current_capacity()})
+			time.sleep(SAMPLE_INTERVAL)
+	completed = []
+	def query(i):
+		rng = random.Random(i)
+		while not done.is_set():
+			sid = str(10**10 + rng.randrange(args.authors))
+			scrape._get_query(scrape.API_ROOT + 'search/author?co-author=' +
+								sid + '&count=200', endpoint = 'coauthors')
+			completed.append(time.time() - server.started)
+
+	sampler = threading.Thread(target = sample, daemon = True)
+	sampler.start()
+	with ThreadPoolExecutor(args.max_concurrency) as pool:
+		for i in range(args.max_concurrency):
+			pool.submit(query, i)
+		time.sleep(args.duration)
+		done.set()
+	sampler.join()
+	server.shutdown()
+
+	# Summarize each step of the schedule
+	steps = []
+	bounds = [start for start, capacity in capacity] + [args.duration]
+	for (start, step_capacity), end in zip(capacity, bounds[1:]):
+		end = min(end, args.duration)
+		in_step = [s for s in samples if start <= s['t'] < end]
+		n_done = len([t for t in completed if start <= t < end])
+		steps.append({'start_s': start, 'end_s': end,
+						'capacity': step_capacity,
+						'mean_limit': sum(s['limit'] for s in in_step) /
+										max(1, len(in_step)),
+						'mean_in_flight': sum(s['in_flight'] for s in in_step) /
+											max(1, len(in_step)),
+						'requests_per_s': n_done / max(end - start, 1e-9)})
+	statuses = server.statuses
+	return({'fixed': args.fixed,
+			'requests': len(completed),
+			'requests_per_s': len(completed) / args.duration,
+			'throttled': statuses.get(429, 0),
+			'statuses': statuses,
+			'steps': steps,
+			'changes': list(limiter.history),
+			'samples': samples})
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+		description = 'Benchmark the adaptive concurrency limit')
+	parser.add_argument('--capacity', default = '0:2,20:8,40:4',
+						metavar = 'SECONDS:CAPACITY,...',
+						help = 'Schedule of the requests the server serves at once')
+	parser.add_argument('--duration', type = float, default = 60)
+	parser.add_argument('--latency', type = float, default = 0.05)
+	parser.add_argument('--authors', type = int, default = 10000)
+	parser.add_argument('--max-concurrency', type = int, default = 16)
+	parser.add_argument('--delay', type = float, default = 1,
+						help = 'Cooldown after a server error, in seconds')
+	parser.add_argument('--fixed', action = 'store_true',
+						help = 'Hold the limit at --max-concurrency')
+	parser.add_argument('--output', default = 'bench_concurrency.json')
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as workdir:
+		# The scrape module needs an API key file to import
+		with open(os.path.join(workdir, 'api_key.py'), 'w') as writefile:
+			writefile.write('MY_API_KEYS = [' + repr(API_KEY) + ']\n' +
+							'RNG_SEED = 0\n')
+		sys.path.insert(0, workdir)
+		result = run(args)
+	for step in result['steps']:
+		print('{start_s:5.0f}-{end_s:<5.0f} s  capacity {capacity:3}  '
+				'mean limit {mean_limit:5.1f}  in flight {mean_in_flight:5.1f}  '
+				'{requests_per_s:7.1f} requests/s'.format(**step))
+	print('{requests} requests, {requests_per_s:.1f}/s; {throttled} '
+			'throttled; {n} changes of the limit'.format(
+				n = len(result['changes']), **result))
+	with open(args.output, 'w') as writefile:
+		json.dump({'time': time.strftime('%c', time.localtime()),
+					'settings': vars(args), 'result': result},
+					writefile, indent = 4)
+	print('Results written to ' + args.output)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+'''
+End-to-end crawl benchmark.  For each scale, this script starts the local
+Scopus stand-in (`scrape/fake_scopus.py`) with a synthetic network of that many
+authors, writes a `sids.json` of evenly spaced seed authors, and runs every
+step of `run_scrape` against the stand-in in a fresh working directory.  Each
+scale runs in its own process, so that its peak memory can be measured.
+
+For each scale it reports:
+	- wall time, in total and for each step
+	- requests per second, as counted by the stand-in
+	- peak resident memory (RSS) of the crawling process
+	- time spent writing the batch checkpoint files, in total and as a share
+		of the wall time
+
+Usage:
+
+	python benchmark/bench_crawl.py --authors 1000 10000 100000 \
+		--latency 0.05 --error-rate 0.001 --output bench_crawl.json
+
+With `--overlap`, step 1b also retrieves the metadata for the authors certain
+to be in the network (`run_scrape.overlap_metadata`), so the time moves from
+step 2b into step 1b; compare the total wall time with and without it.
+'''
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_KEY = 'bench-key'
+
+
+def _free_port():
+	with socket.socket() as sock:
+		sock.bind(('localhost', 0))
+		return(sock.getsockname()[1])
+
+
+def _stats(api_root):
+	'''
+	:return: Request counts from the stand-in's `/stats` endpoint
+	'''
+	url = api_root.replace('/content/', '/stats')
+	with urllib.request.urlopen(url) as response:
+		return(json.loads(response.read()))
+
+
+def worker(args):
+	'''
+	Run every step of `run_scrape` in the current directory, and write the
+	measurements to `args.result`
+	'''
+	sys.path.insert(0, os.getcwd())
+	sys.path.insert(0, REPO)
+	import metrics
+	import scrape.scrape
+	import scrape.run_scrape as run_scrape
+	# Don't wait out the real API's cooldowns on injected errors
+	scrape.scrape.DELAY = args.delay
+	run_scrape.max_dist = args.max_dist
+	run_scrape.overlap_metadata = args.overlap
+
+	steps = [('1a', run_scrape.step_1a), ('parse_1a', run_scrape.parse_1a),
+				('1b', run_scrape.step_1b), ('parse_1b', run_scrape.parse_1b),
+				('2a', lambda: run_scrape.step_2a(max_dist = args.max_dist)),
+				('2b', run_scrape.step_2b), ('parse_2b', run_scrape.parse_2b),
+				('3', run_scrape.step_3)]
+	step_times = {}
+	requests_before = _stats(args.api_root)['requests']
+	start = time.perf_counter()
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		for name, step in steps:
+			step_start = time.perf_counter()
+			# Batch steps return False at the end of each run of the batch
+			while not step():
+				pass
+			step_times[name] = time.perf_counter() - step_start
+	wall = time.perf_counter() - start
+	stats = _stats(args.api_root)
+	n_requests = stats['requests'] - requests_before
+	# The batch module times each checkpoint:  appending the retrieved data,
+	#  and rewriting the list of items left
+	checkpoints = [hist['value'] for hist in 
+					metrics.registry.to_dict()['histograms']
+					if hist['name'] == 'batch_checkpoint_seconds']
+	checkpoint = {'seconds': sum(hist['sum'] for hist in checkpoints),
+					'writes': sum(hist['count'] for hist in checkpoints)}
+
+	result = {'authors': args.authors,
+				'seeds': len(json.load(open(run_scrape.sids_infile))),
+				'network_authors': len(json.load(
+					open(run_scrape.combined_sids_file))),
+				'wall_s': wall,
+				'step_s': step_times,
+				'requests': n_requests,
+				'statuses': stats['statuses'],
+				'requests_per_s': n_requests / wall,
+				'peak_rss_mb': resource.getrusage(
+					resource.RUSAGE_SELF).ru_maxrss / 1024,
+				'checkpoint_s': checkpoint['seconds'],
+				'checkpoint_writes': checkpoint['writes'],
+				'checkpoint_share': checkpoint['seconds'] / wall}
+	with open(args.result, 'w') as writefile:
+		json.dump(result, writefile)
+
+
+def run_scale(n_authors, args):
+	'''
+	Benchmark one scale, with its own stand-in server and working directory
+
+	:return: Dict of measurements
+	'''
+	port = _free_port()
+	api_root = 'http://localhost:' + str(port) + '/content/'
+	server_cmd = [sys.executable, os.path.join(REPO, 'scrape', 'fake_scopus.py'),
+				'--authors', str(n_authors), '--degree', str(args.degree),
+				'--port', str(port), '--key', API_KEY + ':' + str(10**9),
+				'--latency', str(args.latency),
+				'--error-rate', str(args.error_rate)]
+	if args.rate_limit is not None:
+		server_cmd += ['--rate-limit', str(args.rate_limit)]
+	server = subprocess.Popen(server_cmd, stdout = subprocess.DEVNULL)
+	try:
+		# Wait for the server to come up
+		for attempt in range(100):
+			try:
+				_stats(api_root)
+				break
+			except OSError:
+				time.sleep(0.1)
+		with tempfile.TemporaryDirectory() as workdir:
+			seeds = [str(10**10 + i) for i in range(0, n_authors, args.spacing)]
+			with open(os.path.join(workdir, 'sids.json'), 'w') as writefile:
+				json.dump(seeds, writefile)
+			with open(os.path.join(workdir, 'api_key.py'), 'w') as writefile:
+				writefile.write('MY_API_KEYS = [' + repr(API_KEY) + ']\n' +
+								'RNG_SEED = 0\n')
+			result_file = os.path.join(workdir, 'result.json')
+			env = dict(os.environ, SCOPUS_API_ROOT = api_root)
+			subprocess.run([sys.executable, os.path.abspath(__file__), '--worker',
+							'--authors', str(n_authors),
+							'--api-root', api_root, '--result', result_file,
+							'--max-dist', str(args.max_dist),
+							'--delay', str(args.delay)] + 
+							(['--overlap'] if args.overlap else []),
+							cwd = workdir, env = env, check = True)
+			with open(result_file) as readfile:
+				return(json.load(readfile))
+	finally:
+		server.terminate()
+		server.wait()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'End-to-end crawl benchmark')
+	parser.add_argument('--authors', type = int, nargs = '+',
+						default = [1000, 10000, 100000],
+						help = 'Sizes of the synthetic networks to crawl')
+	parser.add_argument('--spacing', type = int, default = 20,
+						help = 'One seed author for every SPACING authors')
+	parser.add_argument('--degree', type = float, default = 20)
+	parser.add_argument('--latency', type = float, default = 0.05)
+	parser.add_argument('--error-rate', type = float, default = 0)
+	parser.add_argument('--rate-limit', type = float, default = None)
+	parser.add_argument('--max-dist', type = int, default = 1)
+	parser.add_argument('--delay', type = float, default = 1,
+						help = 'Cooldown after a server error, in seconds')
+	parser.add_argument('--overlap', action = 'store_true',
+						help = 'Retrieve metadata during step 1b')
+	parser.add_argument('--output', default = 'bench_crawl.json')
+	# Used internally, to run a single scale in a separate process
+	parser.add_argument('--worker', action = 'store_true',
+						help = argparse.SUPPRESS)
+	parser.add_argument('--api-root', help = argparse.SUPPRESS)
+	parser.add_argument('--result', help = argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.worker:
+		worker(args)
+		sys.exit(0)
+
+	results = []
+	for n_authors in args.authors:
+		print('Crawling ' + str(n_authors) + ' synthetic authors')
+		result = run_scale(n_authors, args)
+		print('\t{wall_s:.1f} s, {requests} requests, '
+				'{requests_per_s:.1f} requests/s, peak RSS {peak_rss_mb:.0f} MB, '
+				'checkpoints {checkpoint_s:.2f} s '
+				'({checkpoint_share:.1%})'.format(**result))
+		results.append(result)
+	with open(args.output, 'w') as writefile:
+		json.dump({'time': time.strftime('%c', time.localtime()),
+					'settings': {key: value for key, value in vars(args).items()
+									if key not in ['worker', 'api_root', 'result']},
+					'results': results}, writefile, indent = 4)
+	print('Results written to ' + args.output)
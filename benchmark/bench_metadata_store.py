@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmark for `metadata_store`.  This script writes a synthetic
+`combined_metadata.json` with the given number of authors, then compares
+the list of dicts that `json_readf` returns with a `MetadataStore` built
+from the same file:
+	- memory held after loading, measured with `tracemalloc`
+	- load time
+	- SID lookups, one at a time (a dict keyed by SID vs `store.row`) and
+		vectorized (`store.rows`)
+	- a join of every SID to its number of documents
+
+Usage:
+
+	python benchmark/bench_metadata_store.py --authors 100000 1000000
+'''
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+import numpy as np
+from json_rw import *
+from metadata_store import MetadataStore
+
+AREAS = ['Medicine', 'Philosophy', 'Physics', 'Computer Science',
+			'Mathematics', 'Chemistry', 'Biochemistry', 'Engineering',
+			'Social Sciences', 'Arts and Humanities']
+SURNAMES = ['Smith', 'Novak', 'Dubois', 'Müller', 'García', 'Kowalski',
+			'Nakamura', 'Okafor', 'Ivanova', 'Rossi']
+COUNTRIES = ['United States', 'Germany', 'France', 'Japan', 'Brazil',
+				'Nigeria', 'Poland', 'Italy']
+
+
+def synthetic_records(n_authors, seed = 0):
+	'''
+	Metadata records in the format of `combined_metadata.json`
+	'''
+	rng = random.Random(seed)
+	for i in range(n_authors):
+		areas = [{'@abbrev': area[:4].upper(), '#text': area}
+					for area in rng.sample(AREAS, rng.randint(1, 4))]
+		yield({'name': {'surname': rng.choice(SURNAMES) + str(rng.randrange(5000)),
+						'given': chr(65 + rng.randrange(26)) + '.'},
+				'sid': str(10**10 + i),
+				'docs': rng.randrange(200),
+				'areas': areas[0] if len(areas) == 1 else areas,
+				'affiliation': 'University ' + str(rng.randrange(20000)),
+				'country': rng.choice(COUNTRIES)})
+
+
+def measure_load(load):
+	'''
+	:return: The loaded object, the memory it holds (MB), and the load time
+	'''
+	gc.collect()
+	tracemalloc.start()
+	start = time.perf_counter()
+	loaded = load()
+	elapsed = time.perf_counter() - start
+	gc.collect()
+	held = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	return(loaded, held / 2**20, elapsed)
+
+
+def run_scale(n_authors, n_lookups, datafile):
+	with JsonArrayWriter(datafile) as writer:
+		writer.write_all(synthetic_records(n_authors))
+	records, dict_mb, dict_s = measure_load(lambda: json_readf(datafile))
+	by_sid = {record['sid']: record for record in records}
+	store, store_mb, store_s = measure_load(lambda: MetadataStore.load(datafile))
+
+	rng = random.Random(1)
+	queries = [str(10**10 + rng.randrange(n_authors)) for i in range(n_lookups)]
+	start = time.perf_counter()
+	dict_docs = [by_sid[sid]['docs'] for sid in queries]
+	dict_lookup_s = time.perf_counter() - start
+	start = time.perf_counter()
+	row_docs = [int(store.docs[store.row(sid)]) for sid in queries]
+	row_lookup_s = time.perf_counter() - start
+	query_array = np.array(queries).astype(np.int64)
+	start = time.perf_counter()
+	vector_docs = store.column('docs', store.rows(query_array))
+	vector_lookup_s = time.perf_counter() - start
+	assert dict_docs == row_docs == vector_docs.tolist()
+
+	start = time.perf_counter()
+	store.column('docs', store.rows(store.sid))
+	join_s = time.perf_counter() - start
+	return({'authors': n_authors,
+			'dict_mb': dict_mb, 'store_mb': store_mb,
+			'memory_ratio': store_mb / dict_mb,
+			'dict_load_s': dict_s, 'store_load_s': store_s,
+			'lookups': n_lookups,
+			'dict_lookup_s': dict_lookup_s, 'row_lookup_s': row_lookup_s,
+			'vector_lookup_s': vector_lookup_s,
+			'join_s': join_s})
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Benchmark the metadata store')
+	parser.add_argument('--authors', type = int, nargs = '+',
+						default = [100000, 1000000])
+	parser.add_argument('--lookups', type = int, default = 100000)
+	parser.add_argument('--output', default = 'bench_metadata_store.json')
+	args = parser.parse_args()
+
+	results = []
+	with tempfile.TemporaryDirectory() as workdir:
+		for n_authors in args.authors:
+			print('Loading ' + str(n_authors) + ' synthetic authors')
+			result = run_scale(n_authors, args.lookups,
+								os.path.join(workdir, 'combined_metadata.json'))
+			print('\tmemory {dict_mb:.0f} MB as dicts, {store_mb:.0f} MB as '
+					'columns ({memory_ratio:.1%}); {lookups} lookups '
+					'{dict_lookup_s:.3f} s by dict, {row_lookup_s:.3f} s by row, '
+					'{vector_lookup_s:.3f} s vectorized; join of every SID '
+					'{join_s:.3f} s'.format(**result))
+			results.append(result)
+	with open(args.output, 'w') as writefile:
+		json.dump({'time': time.strftime('%c', time.localtime()),
+					'settings': vars(args), 'results': results},
+					writefile, indent = 4)
+	print('Results written to ' + args.output)
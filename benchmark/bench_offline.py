@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmarks for the offline graph stages, on synthetic data.  For each scale,
+this script generates the files that the crawl would produce —
+`sids.json`, `gen_1_coauth.json`, `gen_2_coauth.json`, `combined_metadata.json`
+— along with a `dupes.csv`, then times each offline stage separately:
+	- `build`: step 2a of `run_scrape`
+	- `attach`: step 3 of `run_scrape`
+	- `collapse`: `collapse_duplicates`
+	- `sanitize`: `sanitize`
+Each stage runs in its own process, so that its peak memory (RSS) can be
+measured.  The results are written as JSON; pass an earlier results file as
+`--baseline` to compare against it.
+
+Usage:
+
+	python benchmark/bench_offline.py --edges 10000 100000 1000000 \
+		--output bench_offline.json --baseline bench_offline.old.json
+'''
+
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SID_BASE = 10**10
+
+SURNAMES = ['Smith', 'Garcia', 'Nguyen', 'Müller', 'Kim', 'Rossi', 'Novak',
+			'Silva', 'Cohen', 'Sato', 'Dubois', 'Kowalski', 'Babić']
+COUNTRIES = ['United States', 'United Kingdom', 'Germany', 'China', 'Brazil',
+			'India', 'Japan', 'France', 'Canada', 'Australia']
+AREAS = ['Medicine', 'Biochemistry', 'Ecology', 'Philosophy', 'Physics',
+			'Computer Science', 'Sociology', 'Engineering', 'Economics']
+
+# Stage name, and the statement that runs it
+STAGES = [('build', 'run_scrape.step_2a(max_dist = 1)'),
+			('attach', 'run_scrape.step_3()'),
+			('collapse', 'collapse_duplicates.collapse_duplicates()'),
+			('sanitize', 'sanitize.sanitize()')]
+
+
+def generate(workdir, n_edges, degree = 20, n_dupes = 100, seed = 0):
+	'''
+	Write synthetic pipeline inputs to `workdir`.  Each generation 1 author
+	has about `degree` coauthors, and each generation 2 author has about
+	`degree` coauthors, most of them outside the filtered network.
+
+	:param n_edges: Approximate total number of coauthor pairs
+	:param n_dupes: Number of duplicate groups to write to `dupes.csv`
+	'''
+	rng = random.Random(seed)
+	sid = lambda i: str(SID_BASE + i)
+	# Each generation 1 author brings about 0.8*degree new generation 2 authors
+	n_gen_1 = max(1, int(n_edges / (degree * (1 + 0.8 * degree))))
+	next_author = n_gen_1
+
+	gen_1_coauth = []
+	gen_2 = []
+	for i in range(n_gen_1):
+		for k in range(degree):
+			# Mostly new authors, with some shared coauthors
+			if gen_2 != [] and rng.random() < 0.2:
+				j = rng.choice(gen_2)
+			else:
+				j = next_author
+				next_author += 1
+				gen_2.append(j)
+			gen_1_coauth.append([sid(i), sid(j)])
+	gen_2_coauth = []
+	in_net = set(range(next_author))
+	for j in sorted(set(gen_2)):
+		for k in range(degree):
+			if rng.random() < 0.3:
+				other = rng.randrange(next_author)
+			else:
+				other = next_author
+				next_author += 1
+			gen_2_coauth.append([sid(j), sid(other)])
+
+	metadata = []
+	for i in sorted(in_net):
+		areas = [{'@abbrev': area[:4].upper(), '#text': area}
+					for area in rng.sample(AREAS, rng.randint(1, 3))]
+		metadata.append({'name': {'surname': rng.choice(SURNAMES),
+									'given': rng.choice('ABCDEFGHJKLM') + '.'},
+						'sid': sid(i), 'docs': rng.randint(1, 200),
+						# xmltodict gives a dict for a single subject area
+						'areas': areas if len(areas) > 1 else areas[0],
+						'affiliation': 'University ' + str(rng.randrange(500)),
+						'country': rng.choice(COUNTRIES)})
+	dupes = [rng.sample(sorted(in_net), 2) for k in range(n_dupes)]
+
+	with open(os.path.join(workdir, 'sids.json'), 'w') as writefile:
+		json.dump([sid(i) for i in range(n_gen_1)], writefile)
+	with open(os.path.join(workdir, 'gen_1_coauth.json'), 'w') as writefile:
+		json.dump(gen_1_coauth, writefile)
+	with open(os.path.join(workdir, 'gen_2_coauth.json'), 'w') as writefile:
+		json.dump(gen_2_coauth, writefile)
+	with open(os.path.join(workdir, 'combined_metadata.json'), 'w') as writefile:
+		json.dump(metadata, writefile, ensure_ascii = False)
+	with open(os.path.join(workdir, 'dupes.csv'), 'w') as writefile:
+		writefile.write('surname,given,sids\n')
+		for pair in dupes:
+			writefile.write('Dupe,A.,' + ';'.join(sid(i) for i in pair) + '\n')
+	with open(os.path.join(workdir, 'api_key.py'), 'w') as writefile:
+		writefile.write('MY_API_KEY = ""\nRNG_SEED = 0\n')
+	return({'gen_1_authors': n_gen_1, 'authors': len(in_net),
+			'pairs': len(gen_1_coauth) + len(gen_2_coauth)})
+
+
+def worker(statement):
+	'''
+	Run a single stage in the current directory and print its measurements
+	'''
+	sys.path.insert(0, os.getcwd())
+	sys.path.insert(0, REPO)
+	import_start = time.perf_counter()
+	import scrape.run_scrape as run_scrape
+	from find_duplicates import collapse_duplicates
+	import sanitize
+	import_time = time.perf_counter() - import_start
+	with open(os.devnull, 'w') as devnull:
+		stdout = sys.stdout
+		sys.stdout = devnull
+		start = time.perf_counter()
+		try:
+			exec(statement)
+		finally:
+			wall = time.perf_counter() - start
+			sys.stdout = stdout
+	print(json.dumps({'wall_s': wall, 'import_s': import_time,
+						'peak_rss_mb': resource.getrusage(
+							resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+def run_scale(n_edges, args):
+	'''
+	Generate the inputs for one scale and time each stage
+
+	:return: Dict of measurements
+	'''
+	workdir = tempfile.mkdtemp()
+	try:
+		start = time.perf_counter()
+		result = generate(workdir, n_edges, degree = args.degree,
+							n_dupes = args.dupes, seed = args.seed)
+		result['generate_s'] = time.perf_counter() - start
+		result['edges'] = n_edges
+		result['stages'] = {}
+		for name, statement in STAGES:
+			completed = subprocess.run([sys.executable, os.path.abspath(__file__),
+										'--worker', statement],
+										cwd = workdir, check = True,
+										stdout = subprocess.PIPE, text = True)
+			result['stages'][name] = json.loads(
+				completed.stdout.strip().split('\n')[-1])
+		return(result)
+	finally:
+		if args.keep:
+			print('\tFiles kept in ' + workdir)
+		else:
+			shutil.rmtree(workdir)
+
+
+def compare(results, baseline):
+	'''
+	Print the change in wall time and peak memory against a baseline
+	'''
+	old = {result['edges']: result for result in baseline['results']}
+	for result in results:
+		if result['edges'] not in old:
+			continue
+		print(str(result['edges']) + ' edges, against baseline:')
+		for name, stage in result['stages'].items():
+			if name not in old[result['edges']]['stages']:
+				continue
+			base = old[result['edges']]['stages'][name]
+			print('\t{:10} wall {:+.1%}, peak RSS {:+.1%}'.format(name,
+					stage['wall_s'] / base['wall_s'] - 1,
+					stage['peak_rss_mb'] / base['peak_rss_mb'] - 1))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+		description = 'Benchmark the offline graph stages')
+	parser.add_argument('--edges', type = int, nargs = '+',
+						default = [10000, 100000, 1000000],
+						help = 'Approximate numbers of coauthor pairs')
+	parser.add_argument('--degree', type = int, default = 20)
+	parser.add_argument('--dupes', type = int, default = 100)
+	parser.add_argument('--seed', type = int, default = 0)
+	parser.add_argument('--output', default = 'bench_offline.json')
+	parser.add_argument('--baseline', help = 'Earlier results to compare to')
+	parser.add_argument('--keep', action = 'store_true',
+						help = 'Keep the generated files')
+	# Used internally, to run a single stage in a separate process
+	parser.add_argument('--worker', metavar = 'STATEMENT',
+						help = argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.worker:
+		worker(args.worker)
+		sys.exit(0)
+
+	results = []
+	for n_edges in args.edges:
+		print('Benchmarking ' + str(n_edges) + ' edges')
+		result = run_scale(n_edges, args)
+		for name, stage in result['stages'].items():
+			print('\t{:10} {:8.2f} s  {:8.0f} MB'.format(name, stage['wall_s'],
+					stage['peak_rss_mb']))
+		results.append(result)
+	with open(args.output, 'w') as writefile:
+		json.dump({'time': time.strftime('%c', time.localtime()),
+					'settings': {key: value for key, value in vars(args).items()
+									if key not in ['worker', 'keep']},
+					'results': results}, writefile, indent = 4)
+	print('Results written to ' + args.output)
+	if args.baseline:
+		with open(args.baseline) as readfile:
+			compare(results, json.load(readfile))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+'''
+Startup benchmark for the `build_network` command line.  Crawl workers run
+`build_network.py crawl` (or `metadata`) many times, so the command should
+start quickly, and shouldn't load graph-tool, pandas, or numpy, which the
+crawl stages don't use.  This script measures, in fresh processes:
+	- the time to import `build_network` and every stage module
+	- the wall time of `build_network.py crawl --help`, ie, interpreter
+		startup, imports, and argument parsing
+and checks which of the heavy modules were loaded.  It exits with status 1
+if any were, or if the import time is over `--max-seconds`, so it can be
+run as a check.
+
+Usage:
+
+	python benchmark/bench_startup.py --repeat 10 --max-seconds 0.5
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules the crawl stages shouldn't load
+HEAVY_MODULES = ['graph_tool', 'pandas', 'numpy']
+
+
+def worker():
+	'''
+	Import `build_network` and print the import time and the heavy modules
+	that were loaded
+	'''
+	sys.path.insert(0, REPO)
+	start = time.perf_counter()
+	import build_network
+	import_time = time.perf_counter() - start
+	print(json.dumps({'import_s': import_time,
+						'loaded': [module for module in HEAVY_MODULES
+									if module in sys.modules]}))
+
+
+def measure(workdir, env):
+	'''
+	Measure one startup, in fresh processes
+
+	:return: Dict of measurements
+	'''
+	completed = subprocess.run([sys.executable, os.path.abspath(__file__),
+								'--worker'],
+								cwd = workdir, env = env, check = True,
+								stdout = subprocess.PIPE, text = True)
+	result = json.loads(completed.stdout.strip().split('\n')[-1])
+	start = time.perf_counter()
+	subprocess.run([sys.executable, os.path.join(REPO, 'build_network.py'),
+					'crawl', '--help'],
+					cwd = workdir, env = env, check = True,
+					stdout = subprocess.DEVNULL)
+	result['cli_s'] = time.perf_counter() - start
+	return(result)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+		description = 'Benchmark the startup of build_network')
+	parser.add_argument('--repeat', type = int, default = 5)
+	parser.add_argument('--max-seconds', type = float, default = 1,
+						help = 'Fail if the median import time is over this')
+	parser.add_argument('--output', default = 'bench_startup.json')
+	# Used internally, to measure the imports in a separate process
+	parser.add_argument('--worker', action = 'store_true',
+						help = argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.worker:
+		worker()
+		sys.exit(0)
+
+	with tempfile.TemporaryDirectory() as workdir:
+		# The scrape module needs an API key file to import
+		with open(os.path.join(workdir, 'api_key.py'), 'w') as writefile:
+			writefile.write('MY_API_KEY = ""\nRNG_SEED = 0\n')
+		env = dict(os.environ, PYTHONPATH = os.pathsep.join(
+					[workdir] + os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+		results = [measure(workdir, env) for i in range(args.repeat)]
+
+	import_s = statistics.median(result['import_s'] for result in results)
+	cli_s = statistics.median(result['cli_s'] for result in results)
+	loaded = sorted(set(module for result in results
+							for module in result['loaded']))
+	print('Median import time {:.3f} s, CLI startup {:.3f} s'.format(import_s,
+																	cli_s))
+	print('Heavy modules loaded: ' + (', '.join(loaded) if loaded else 'none'))
+	with open(args.output, 'w') as writefile:
+		json.dump({'time': time.strftime('%c', time.localtime()),
+					'settings': {key: value for key, value in vars(args).items()
+									if key != 'worker'},
+					'import_s': import_s, 'cli_s': cli_s, 'loaded': loaded,
+					'results': results}, writefile, indent = 4)
+	print('Results written to ' + args.output)
+	if loaded != [] or import_s > args.max_seconds:
+		print('Startup check failed')
+		sys.exit(1)
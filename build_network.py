@@ -13,6 +13,19 @@ The primary output files are
 	- `combined_metadata.csv`: author-level metadata
 	- `coauth_net.gt`: coauthor network, in graph-tool's binary format
 	- `coauth_net.graphml`: coauthor network, in widely-supported graphml format
+
+Run without a subcommand to bring every stage up to date, or with a 
+subcommand to run only part of the pipeline (along with any out-of-date 
+stages it depends on):  
+
+	python build_network.py					# every stage
+	python build_network.py crawl			# coauthor queries only
+	python build_network.py collapse --force	# re-run a stage
+
+The stage modules import graph-tool, pandas, and numpy only in the functions 
+that use them, so the crawl subcommands start without loading them.  
+`benchmark/bench_startup.py` checks this.  The exit status is 1 if the 
+pipeline didn't finish, eg, because a batch of queries is to be continued.  
 '''
 
 import sys
@@ -20,16 +33,24 @@ if sys.version_info[0] < 3:
 	print('This script requires Python 3')
 
 
-from importlib import reload
+import argparse
 import os
-import shutil
-
-## Drop down to a subfolder to keep the output files tidy
-os.chdir('files')
 
 ## ----------
 ## The actual construction process starts here
 
+'''
+Each stage of the construction process is a function, declared below along 
+with the files it reads and writes.  The pipeline executor (`pipeline.py`) 
+runs the stages in order, skipping any stage whose inputs, outputs, and 
+parameters are unchanged since it last finished.  After a change — eg, 
+editing `dupes.csv` or `max_dist` — only the stages downstream of the change 
+are run again.  To resume scraping, or to continue after reviewing 
+duplicates, simply run `build_network` again.  
+'''
+
+from pipeline import Pipeline, PipelineError, Stage
+
 '''
 Start with a `Scopus IDs.csv` containing a column `Author 1 SID` of author 
 Scopus IDs. Run `get_sids` to build a list `sids.json` of SIDs to retrieve.  
@@ -39,57 +60,64 @@ import get_sids
 
 '''
 Run `run_scrape` to scrape the author data and build the network. This library
-is robust to errors and scraping data over multiple sessions.  To resume 
-scraping, simply run `build_network` again.  
+is robust to errors and scraping data over multiple sessions.  
+
+The crawl steps save the raw Scopus responses (`raw_*.jsonl.gz`), and 
+separate `parse_*` stages parse them in a pool of processes.  To parse the 
+raw files again, eg, after a change to the parsers, delete the parsed files 
+and run `build_network` again; Scopus isn't queried again.  
+
+For crawls whose coauthor pairs don't fit in memory, run with `--out-of-core` 
+(or set `out_of_core = True` in `run_scrape`), and the network is built from 
+sorted chunks of pairs on disk; see `scrape/external_pairs.py`.  
+
+To overlap the crawl with the metadata queries, run with `--overlap-metadata` 
+(or set `overlap_metadata = True` in `run_scrape`).  The metadata for the 
+authors already certain to be in the filtered network are then retrieved 
+while the generation 2 coauthors are queried, and the `metadata` stage only 
+queries the rest.  
+
+For approximate answers — the degree distribution, country mixing, or the 
+share of the giant component — for a new seed list, run `build_network 
+sample` instead.  This crawls a growing, stratified random sample of 
+generation 1 until the estimates are precise enough, in the `sample` folder, 
+and doesn't touch the pipeline's files; see `scrape/sampling.py`.  
 
 Outputs: 
 `gen_1_coauth.json`: Coauthor pairs starting with generation 1
-`gen_1_coauth.json`: Coauthor pairs starting with generation 2
+`gen_2_coauth.json`: Coauthor pairs starting with generation 2
 `combined_sids.json`: One big list of all of the author SIDs
 `combined_metadata.json`: One big list of all of the author metadata
-`coauth_net.graphml`: Coauthor network file, broad compatibility
-`coauth_net.gt`: Coauthor network file, graph-tool particular format
+`coauth_net.temp.gt`: Filtered coauthor network, without author metadata
+`coauth_net.precollapse.gt`: Coauthor network with author metadata
 '''
 
 from scrape import run_scrape
 
-## Cleanup
-try:
-	os.remove('sids.json')
-	os.remove('coauth_net.temp.graphml')
-	os.remove('coauth_net.temp.gt')
-	os.remove('combined_sids.json')
-	os.remove('status.json')
-	os.remove('gen_1_coauth.json')
-	os.remove('gen_2_coauth.json')
-	shutil.rmtree('batch')
-except OSError:
-	print('Error trying to clean up working files; skipping cleanup')
-
 '''
 Scopus contains duplicates — two distinct ID numbers — for some individuals.  
 Run `find_duplicates` to generate the list of potential duplicates.  
-Open `potential_dupes.csv` and review table to identify actual duplicates.  
+Open `potential_dupes.csv` and review table to identify actual duplicates, 
+then save them as `dupes.csv` and run `build_network` again.  
 The file `dupes.csv` should follow this pattern:  
 
 | surname 	| given 	| sids						|
 | Babi_		| Sandra	| 7004766561;54408195900 	|
 | Dang		| Duc Huy	| 56034688700;56454919100	|
 
-Note that the distinct SIDs should be separated with *semicolons*.  
+Note that the distinct SIDs should be separated with *semicolons*.  If there 
+are no duplicates, `dupes.csv` should contain only the header row.  
 
 Outputs: 
-`combined_metadata.csv`: A CSV containing the author-level metadata
-`coauth_net.gt`: The coauthor network, in graph-tool's binary format
-`coauth_net.graphml`: The coauthor network, in widely-supported graphml format
+`combined_metadata.collapsed.csv`: A CSV containing the author-level metadata
+`coauth_net.collapsed.gt`: The coauthor network, in graph-tool's binary format
 '''
 
 from find_duplicates import find_duplicates
-input('Identify duplicates in "potential_dupes.csv" and press Enter to continue')
 from find_duplicates import collapse_duplicates
 
 '''
-Finally, we sanitize the output files — replacing surname, given name, and 
+Next, we sanitize the output files — replacing surname, given name, and 
 Scopus IDs with encoded ID strings.  The resulting data files can be shared
 publicly without disclosing PII. 
 
@@ -100,10 +128,232 @@ Outputs:
 `coauth_net.graphml`: The coauthor network, in widely-supported graphml format
 `pii.csv`: A CSV containing the surname, given name, and Scopus ID
 	corresponding to each encoded ID string.
+
+The network files are written at the same time, by `export`.  To compress 
+them, add `.gz`, `.bz2`, or `.xz` to the file names in `sanitize.py` (eg, 
+`coauth_net.graphml.xz`); the same goes for the aggregated networks below, 
+in `aggregate.py`.  
 '''
 
 import sanitize
 
+'''
+Each new version of the collapsed network is also recorded in the 
+`snapshots` folder, storing only the changes from the previous version.  Use 
+`snapshots.py` to list the versions and compare them, eg, to find new authors, 
+new collaborations, or changed affiliations between two runs.  Since the 
+snapshots use SIDs, they contain PII.  
+'''
+
+import snapshots
+
+'''
+Finally, aggregate the coauthor network by country, affiliation, and research 
+area.  Each aggregated network has one vertex per category, with the number 
+of authors (`size`) and the number of within-category coauthor pairs 
+(`n_loops`), and weighted edges between categories.  
+
+Outputs:
+`country_net.graphml`: Country network
+`affiliation_net.graphml`: Affiliation network
+`areas_net.graphml`: Research area network
+'''
+
+import aggregate
+
+'''
+The expensive statistics for each author — betweenness, local clustering, 
+mean path length, and a layout — are computed one connected component at a 
+time, on a pool of processes, largest component first; see `components.py`.  
+To skip some of them, set `components.tasks`.  
+
+Outputs:
+`coauth_net.analyzed.gt`: The sanitized network, with the statistics as 
+	vertex properties
+`coauth_net.analyzed.graphml`: The same, in graphml format
+'''
+
+import components
+
+stages = [
+	Stage('seed', get_sids.get_sids, 
+			inputs = [get_sids.infile], outputs = [get_sids.outfile]), 
+	Stage('crawl_1', run_scrape.step_1a, 
+			inputs = [run_scrape.sids_infile], 
+			outputs = [run_scrape.raw_gen_1_coauth_file]), 
+	Stage('parse_1', run_scrape.parse_1a, 
+			inputs = [run_scrape.raw_gen_1_coauth_file], 
+			outputs = [run_scrape.gen_1_coauth_outfile]), 
+	Stage('crawl_2', run_scrape.step_1b, 
+			inputs = [run_scrape.gen_1_coauth_outfile], 
+			outputs = [run_scrape.raw_gen_2_coauth_file]), 
+	Stage('parse_2', run_scrape.parse_1b, 
+			inputs = [run_scrape.raw_gen_2_coauth_file], 
+			outputs = [run_scrape.gen_2_coauth_outfile]), 
+	Stage('build', run_scrape.step_2a, 
+			inputs = [run_scrape.gen_1_coauth_outfile, 
+						run_scrape.gen_2_coauth_outfile], 
+			outputs = [run_scrape.combined_sids_file, 
+						run_scrape.net_outfile_pre + '.temp.gt'], 
+			params = {'max_dist': run_scrape.max_dist, 
+						'out_of_core': run_scrape.out_of_core}), 
+	Stage('metadata', run_scrape.step_2b, 
+			inputs = [run_scrape.combined_sids_file, run_scrape.sids_infile], 
+			outputs = [run_scrape.raw_author_data_file]), 
+	Stage('parse_metadata', run_scrape.parse_2b, 
+			inputs = [run_scrape.raw_author_data_file], 
+			outputs = [run_scrape.author_data_file]), 
+	Stage('attach', run_scrape.step_3, 
+			inputs = [run_scrape.author_data_file, 
+						run_scrape.net_outfile_pre + '.temp.gt'], 
+			outputs = [run_scrape.net_outfile]), 
+	Stage('dedupe', find_duplicates.find_duplicates, 
+			inputs = [find_duplicates.datafile_in], 
+			outputs = [find_duplicates.potential_dupes_file]), 
+	Stage('collapse', collapse_duplicates.collapse_duplicates, 
+			inputs = [collapse_duplicates.dupes_file, 
+						collapse_duplicates.net_file_in], 
+			outputs = [collapse_duplicates.net_file_out, 
+						collapse_duplicates.datafile_out]), 
+	Stage('snapshot', snapshots.record, 
+			inputs = [snapshots.net_infile], 
+			outputs = [snapshots.INDEX_FILE]), 
+	Stage('sanitize', sanitize.sanitize, 
+			inputs = [sanitize.metadata_infile, sanitize.net_infile], 
+			outputs = [sanitize.metadata_file, sanitize.net_gt_file, 
+						sanitize.net_graphml_file, sanitize.pii_outfile]), 
+	Stage('aggregate', aggregate.aggregate_files, 
+			inputs = [aggregate.net_infile], 
+			outputs = list(aggregate.aggregate_outfiles.values())), 
+	Stage('analyze', components.analyze_files, 
+			inputs = [components.net_infile], 
+			outputs = [components.net_gt_outfile, 
+						components.net_graphml_outfile], 
+			params = {'tasks': components.tasks})
+	]
+
+'''
+To update a finished network, run `build_network --refresh [DAYS]`.  This 
+re-queries only the authors last queried more than `DAYS` days ago 
+(default 30), or newly added to `sids.json`, and patches the coauthor pairs, 
+network, and author metadata with the changes.  The remaining stages then run 
+as usual.  
+'''
+
+## Subcommands, with the stages each one brings up to date
+commands = {
+	'seed': (['seed'], 'Extract the generation 1 SIDs from the csv file'), 
+	'crawl': (['crawl_1', 'parse_1', 'crawl_2', 'parse_2'], 
+				'Query and parse the coauthors of generations 1 and 2'), 
+	'build': (['build'], 'Build and filter the coauthor network'), 
+	'metadata': (['metadata', 'parse_metadata'], 
+				'Query and parse the metadata for every author'), 
+	'dedupe': (['dedupe'], 'Write the list of potential duplicates'), 
+	'collapse': (['attach', 'collapse'], 
+				'Attach the metadata and collapse the duplicates in dupes.csv'), 
+	'snapshot': (['snapshot'], 'Record the collapsed network as a new version'), 
+	'sanitize': (['sanitize'], 'Replace the PII in the outputs'), 
+	'aggregate': (['aggregate'], 'Write the aggregated networks'), 
+	'analyze': (['analyze'], 'Compute betweenness, clustering, path ' + 
+				'lengths, and a layout, by component')
+	}
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(description = 'Build the coauthor network')
+	parser.add_argument('--dir', default = 'files', 
+						help = 'Folder for the input and output files')
+	parser.add_argument('--refresh', nargs = '?', type = float, 
+						const = run_scrape.max_age, metavar = 'DAYS', 
+						help = 'Re-query authors older than DAYS and patch the outputs')
+	parser.add_argument('--profile', choices = ['cprofile', 'sample'], 
+						help = 'Profile each stage, writing to the `profiles` folder')
+	parser.add_argument('--out-of-core', action = 'store_true', 
+						help = 'Build the network from sorted chunks of pairs ' + 
+								'on disk, for crawls too large for memory')
+	parser.add_argument('--overlap-metadata', action = 'store_true', 
+						help = 'Query author metadata during the generation 2 ' + 
+								'crawl, for the authors certain to be kept')
+	subparsers = parser.add_subparsers(dest = 'command', metavar = 'COMMAND', 
+						help = 'Part of the pipeline to run; by default, all of it')
+	for name, (targets, description) in commands.items():
+		subparser = subparsers.add_parser(name, help = description, 
+											description = description)
+		subparser.add_argument('--force', action = 'store_true', 
+							help = 'Run the stages even if they are up to date: ' + 
+									', '.join(targets))
+	plan_parser = subparsers.add_parser('plan', 
+						help = 'Estimate the requests and time the crawl will take', 
+						description = 'Estimate the requests, wall time, and quota ' + 
+										'the crawl will take; see scrape/plan.py')
+	plan_parser.add_argument('--probes', type = int, default = 5, 
+						help = 'Maximum number of requests to send to Scopus')
+	plan_parser.add_argument('--rate', type = float, 
+						help = 'Rate limit, in requests per second')
+	sample_parser = subparsers.add_parser('sample', 
+						help = 'Estimate network metrics from a sample of the seeds', 
+						description = 'Crawl a growing, stratified sample of ' + 
+										'generation 1 until the estimates of the ' + 
+										'network metrics are precise enough; see ' + 
+										'scrape/sampling.py')
+	sample_parser.add_argument('--precision', type = float, default = 0.02, 
+						help = 'Target half-width of the 90%% confidence bands')
+	sample_parser.add_argument('--initial-share', type = float, default = 0.05, 
+						help = 'Share of generation 1 in the first sample')
+	sample_parser.add_argument('--growth', type = float, default = 1.5, 
+						help = 'Factor to grow the sample by each round')
+	sample_parser.add_argument('--max-share', type = float, default = 0.5, 
+						help = 'Share of generation 1 to stop at')
+	sample_parser.add_argument('--strata', metavar = 'COLUMN', 
+						help = 'Column of the csv file to stratify the sample by')
+	args = parser.parse_args(argv)
+	
+	## Drop down to a subfolder to keep the output files tidy
+	os.chdir(args.dir)
+	
+	if args.command == 'plan':
+		from scrape import plan
+		plan.print_plan(plan.plan(max_dist = run_scrape.max_dist, 
+									probes = args.probes, rate = args.rate))
+		return True
+	
+	if args.command == 'sample':
+		from scrape import sampling
+		return(sampling.sample(precision = args.precision, 
+								initial_share = args.initial_share, 
+								growth = args.growth, max_share = args.max_share, 
+								strata_col_name = args.strata, 
+								max_dist = run_scrape.max_dist))
+	
+	if args.out_of_core:
+		for stage in stages:
+			if stage.name == 'build':
+				stage.params['out_of_core'] = True
+	if args.overlap_metadata:
+		run_scrape.overlap_metadata = True
+	
+	try:
+		pipeline = Pipeline(stages, profile = args.profile)
+		if args.refresh is not None:
+			# Bring `sids.json` up to date first, to pick up new authors
+			if not (pipeline.run(targets = ['seed']) and 
+					run_scrape.refresh(max_age = args.refresh, 
+										max_dist = run_scrape.max_dist)):
+				return False
+			pipeline.mark_current(['crawl_1', 'parse_1', 'crawl_2', 'parse_2', 
+									'build', 'metadata', 'parse_metadata'])
+		if args.command is None:
+			return(pipeline.run())
+		targets = commands[args.command][0]
+		return(pipeline.run(targets = targets, 
+							force = targets if args.force else []))
+	except PipelineError as error:
+		print(error)
+		if not os.access(collapse_duplicates.dupes_file, os.R_OK):
+			print('Identify duplicates in "potential_dupes.csv", save them as ' + 
+					'"dupes.csv", and run build_network again')
+		return False
+
+
 '''
 `combined_metadata` Codebook
 
@@ -125,4 +375,8 @@ After sanitization, `combined_metadata.csv` contains a header row and one row fo
 	One column for each area, topic, or keyword (Boolean)
 - sidr
 	A sanitized version of the author's SID (string)
-'''
\ No newline at end of file
+'''
+
+
+if __name__ == '__main__':
+	sys.exit(0 if main() else 1)
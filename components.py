@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+'''
+This module runs the expensive per-author analyses of the coauthor network
+— betweenness, local clustering, path lengths, and a layout — one connected
+component at a time, on a pool of processes.  The network has one giant
+component and many small ones, and none of these analyses reach across
+components, so the components can be analyzed separately and at once:
+
+	1. Split:  the components are labeled, 0 for the largest, and the
+		vertices and edges are sorted by component, so that each component
+		is a contiguous block of both
+	2. Share:  the sorted edges, the block offsets, and an array for the
+		results are put in shared memory; the workers read their edges and
+		write their results in place, rather than receiving and returning
+		pickled copies
+	3. Schedule:  each task for the giant component (or any component of
+		at least `CHUNK_VERTICES` authors), and for each chunk of the small
+		components, is a unit of work.  The units are queued largest first,
+		by the cost of the task, so that the giant component isn't left
+		for last.
+	4. Merge:  the results are put back in the original order of the
+		vertices, as vertex properties
+
+The tasks, and the vertex properties they write, are
+	- `betweenness`:  `betweenness`, not normalized
+	- `clustering`:  `clustering`, the local clustering coefficient
+	- `paths`:  `mean_dist`, the mean shortest-path length to the other
+		authors in the component (NaN for an author without coauthors)
+	- `layout`:  `x` and `y`, from a layout of each component, with the
+		components packed in rows, largest first
+and every author also gets `component`, the label of their component.
+
+	net = gt.load_graph('coauth_net.gt')
+	analyze(net, ['betweenness', 'clustering'], processes = 4)
+	net.vp['betweenness']
+
+The network files written by `analyze_files` can be read in R in place of
+computing the same statistics with igraph, eg, in `analysis/load_data.R`.
+'''
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import metrics
+
+net_infile = 'coauth_net.gt'
+net_gt_outfile = 'coauth_net.analyzed.gt'
+net_graphml_outfile = 'coauth_net.analyzed.graphml'
+
+CHUNK_VERTICES = 2000	# Small components are analyzed in chunks of about this many authors
+LAYOUT_GAP = 1.0		# Space between components in the packed layout
+
+
+## ----------
+## Tasks
+## Each task takes the number of vertices and an `(m, 2)` array of edges of
+##  one or more whole components, and returns an array for each of its
+##  vertex properties
+
+def _graph(n_vertices, edges):
+	import graph_tool as gt
+	# The components are run in parallel instead
+	gt.openmp_set_num_threads(1)
+	graph = gt.Graph(directed = False)
+	graph.add_vertex(n_vertices)
+	graph.add_edge_list(edges)
+	return(graph)
+
+
+def _betweenness(n_vertices, edges):
+	import numpy as np
+	from graph_tool.centrality import betweenness
+	vertex_btwn, edge_btwn = betweenness(_graph(n_vertices, edges),
+											norm = False)
+	return([np.array(vertex_btwn.a)])
+
+
+def _clustering(n_vertices, edges):
+	import numpy as np
+	from graph_tool.clustering import local_clustering
+	return([np.array(local_clustering(_graph(n_vertices, edges)).a)])
+
+
+def _paths(n_vertices, edges):
+	import numpy as np
+	from graph_tool.centrality import closeness
+	from graph_tool.topology import label_components
+	graph = _graph(n_vertices, edges)
+	# Without normalizing, closeness is 1 / the sum of the distances to the
+	#  other vertices in the component
+	inverse_sum = np.array(closeness(graph, norm = False).a)
+	labels, sizes = label_components(graph)
+	others = sizes[labels.a] - 1
+	mean_dist = np.full(n_vertices, np.nan)
+	reached = (others > 0) & (inverse_sum > 0)
+	mean_dist[reached] = 1 / (inverse_sum[reached] * others[reached])
+	return([mean_dist])
+
+
+def _layout(n_vertices, edges):
+	import numpy as np
+	from graph_tool.draw import sfdp_layout
+	if len(edges) == 0:
+		# Only isolated authors, each its own component
+		return([np.zeros(n_vertices), np.zeros(n_vertices)])
+	pos = sfdp_layout(_graph(n_vertices, edges))
+	x, y = pos.get_2d_array([0, 1])
+	return([x, y])
+
+
+def _all_pairs_cost(n_vertices, n_edges):
+	# One search from each vertex
+	return(n_vertices * (n_vertices + n_edges))
+
+def _linear_cost(n_vertices, n_edges):
+	return(n_vertices + n_edges)
+
+## Task name: (function, vertex properties, cost of a block of components)
+TASKS = {'betweenness': (_betweenness, ['betweenness'], _all_pairs_cost),
+			'clustering': (_clustering, ['clustering'], _linear_cost),
+			'paths': (_paths, ['mean_dist'], _all_pairs_cost),
+			'layout': (_layout, ['x', 'y'], _linear_cost)}
+# Tasks run by `analyze_files`; set to a subset to skip the others
+tasks = list(TASKS)
+
+
+## ----------
+## Splitting the network into components
+
+def component_labels(n_vertices, edges):
+	'''
+	Label the connected components of a graph, by repeatedly hooking the
+	higher of each edge's labels onto the lower, and then following the
+	labels until each vertex points directly at the root of its tree
+
+	:param n_vertices: Number of vertices
+	:param edges: `(m, 2)` array of vertex indices
+	:return: int64 array; each vertex is labeled with the lowest vertex
+		in its component
+	'''
+	import numpy as np
+	parent = np.arange(n_vertices, dtype = np.int64)
+	src = np.asarray(edges[:, 0], dtype = np.int64)
+	tgt = np.asarray(edges[:, 1], dtype = np.int64)
+	while len(src) > 0:
+		low = np.minimum(parent[src], parent[tgt])
+		high = np.maximum(parent[src], parent[tgt])
+		# Edges within a tree stay within it
+		apart = low != high
+		src, tgt, low, high = src[apart], tgt[apart], low[apart], high[apart]
+		np.minimum.at(parent, high, low)
+		while True:
+			grandparent = parent[parent]
+			if np.array_equal(grandparent, parent):
+				break
+			parent = grandparent
+	return(parent)
+
+
+def split_components(n_vertices, edges):
+	'''
+	Sort the vertices and edges of a graph by connected component, largest
+	component first
+
+	:return: Dict of
+		- `labels`:  component of each vertex, 0 for the largest
+		- `order`:  the vertices, sorted by component
+		- `vertex_ptr`:  the vertices of component `c` are
+			`order[vertex_ptr[c]:vertex_ptr[c + 1]]`
+		- `edges`:  the edges, sorted by component, as positions in `order`
+		- `edge_ptr`:  the edges of component `c` are
+			`edges[edge_ptr[c]:edge_ptr[c + 1]]`
+	'''
+	import numpy as np
+	edges = np.asarray(edges, dtype = np.int64).reshape(-1, 2)
+	roots = component_labels(n_vertices, edges)
+	roots, labels = np.unique(roots, return_inverse = True)
+	sizes = np.bincount(labels, minlength = len(roots))
+	# Renumber the components by size; ties keep the order of their first
+	#  vertex
+	rank = np.empty(len(sizes), dtype = np.int64)
+	rank[np.argsort(-sizes, kind = 'stable')] = np.arange(len(sizes))
+	labels = rank[labels]
+	sizes = np.bincount(labels, minlength = len(sizes))
+
+	order = np.argsort(labels, kind = 'stable')
+	position = np.empty(n_vertices, dtype = np.int64)
+	position[order] = np.arange(n_vertices)
+	edge_labels = labels[edges[:, 0]]
+	edge_order = np.argsort(edge_labels, kind = 'stable')
+	return({'labels': labels, 'order': order,
+			'vertex_ptr': np.concatenate([[0], np.cumsum(sizes)]),
+			'edges': position[edges[edge_order]],
+			'edge_ptr': np.concatenate([[0], np.cumsum(
+						np.bincount(edge_labels, minlength = len(sizes)))])})
+
+
+def _units(vertex_ptr, edge_ptr, task_names, chunk_vertices):
+	'''
+	Split the work into units of `(cost, task, first, last)`, each running a
+	task on components `first` to `last - 1`, largest cost first
+	'''
+	import numpy as np
+	sizes = np.diff(vertex_ptr)
+	# The components are largest first:  the big ones are units of their
+	#  own, and the rest are grouped into chunks of about `chunk_vertices`
+	n_big = int(np.sum(sizes >= chunk_vertices))
+	small = np.cumsum(sizes[n_big:])
+	chunk = (small - 1) // chunk_vertices
+	ends = n_big + np.flatnonzero(np.diff(chunk)) + 1
+	bounds = np.unique(np.concatenate([np.arange(n_big + 1), ends,
+										[len(sizes)]]))
+	n_edges = np.diff(edge_ptr)
+	units = []
+	for task in task_names:
+		cost = TASKS[task][2](sizes.astype(float), n_edges.astype(float))
+		unit_cost = np.add.reduceat(cost, bounds[:-1])
+		units += [(float(c), task, int(first), int(last)) for c, first, last
+					in zip(unit_cost, bounds[:-1], bounds[1:])]
+	units.sort(key = lambda unit: -unit[0])
+	return(units)
+
+
+## ----------
+## Shared memory
+
+def _share(arrays):
+	'''
+	Copy arrays into shared memory
+
+	:param arrays: Dict of numpy arrays
+	:return: List of `SharedMemory` blocks, to close and unlink when done;
+		dict of the arrays in them; and the spec to pass to `_attach`
+	'''
+	import numpy as np
+	blocks = []
+	shared = {}
+	spec = {}
+	for key, array in arrays.items():
+		block = shared_memory.SharedMemory(create = True,
+											size = max(1, array.nbytes))
+		blocks.append(block)
+		shared[key] = np.ndarray(array.shape, dtype = array.dtype,
+									buffer = block.buf)
+		shared[key][...] = array
+		spec[key] = (block.name, array.shape, array.dtype.str)
+	return(blocks, shared, spec)
+
+
+## Arrays in shared memory, in a worker process
+_blocks = []
+_shared = {}
+
+def _attach(spec):
+	'''
+	Attach a worker process to the arrays shared by `_share`
+	'''
+	import numpy as np
+	for key, (name, shape, dtype) in spec.items():
+		block = shared_memory.SharedMemory(name = name)
+		_blocks.append(block)
+		_shared[key] = np.ndarray(shape, dtype = dtype, buffer = block.buf)
+
+
+def _run_unit(task, first, last, rows):
+	'''
+	Run a task on components `first` to `last - 1`, in a worker process,
+	and write its results into the shared results array
+
+	:param rows: Rows of the results array for the task's properties
+	:return: Time taken, in seconds
+	'''
+	start = time.perf_counter()
+	v_start, v_end = _shared['vertex_ptr'][[first, last]]
+	e_start, e_end = _shared['edge_ptr'][[first, last]]
+	# Renumber the edges within the block
+	edges = _shared['edges'][e_start:e_end] - v_start
+	values = TASKS[task][0](int(v_end - v_start), edges)
+	for row, column in zip(rows, values):
+		_shared['results'][row, v_start:v_end] = column
+	return(time.perf_counter() - start)
+
+
+## ----------
+## Putting it together
+
+def _pack(x, y, vertex_ptr):
+	'''
+	Move the layout of each component into place, in rows, largest first
+
+	:param x, y: Coordinates of the vertices, sorted by component; changed
+		in place
+	'''
+	import numpy as np
+	starts = vertex_ptr[:-1]
+	if len(starts) == 0:
+		return
+	left = np.minimum.reduceat(x, starts)
+	bottom = np.minimum.reduceat(y, starts)
+	widths = np.maximum.reduceat(x, starts) - left + LAYOUT_GAP
+	heights = np.maximum.reduceat(y, starts) - bottom + LAYOUT_GAP
+	row_width = max(widths.max(), np.sqrt(np.sum(widths * heights)))
+	offset_x = np.empty(len(starts))
+	offset_y = np.empty(len(starts))
+	cursor_x = cursor_y = row_height = 0.0
+	for c, (width, height) in enumerate(zip(widths, heights)):
+		if cursor_x > 0 and cursor_x + width > row_width:
+			cursor_x = 0.0
+			cursor_y += row_height
+			row_height = 0.0
+		offset_x[c] = cursor_x - left[c]
+		offset_y[c] = cursor_y - bottom[c]
+		cursor_x += width
+		row_height = max(row_height, height)
+	sizes = np.diff(vertex_ptr)
+	x += np.repeat(offset_x, sizes)
+	y += np.repeat(offset_y, sizes)
+
+
+def analyze_edges(n_vertices, edges, task_names = TASKS.keys(),
+					processes = None, chunk_vertices = CHUNK_VERTICES):
+	'''
+	Run the tasks on each connected component of a graph, in parallel
+
+	:param n_vertices: Number of vertices
+	:param edges: `(m, 2)` array of vertex indices
+	:param task_names: Names of tasks in `TASKS`
+	:param processes: Number of worker processes; by default, one per core
+	:param chunk_vertices: Size of the chunks of small components
+	:return: Dict of arrays, in the order of the vertices:  `component`, and
+		the properties written by each task
+	'''
+	import numpy as np
+	task_names = list(task_names)
+	if processes is None:
+		processes = os.cpu_count() or 1
+	split = split_components(n_vertices, edges)
+	# Rows of the results array for each task's properties
+	rows = {}
+	n_rows = 0
+	for task in task_names:
+		rows[task] = list(range(n_rows, n_rows + len(TASKS[task][1])))
+		n_rows += len(rows[task])
+	units = _units(split['vertex_ptr'], split['edge_ptr'], task_names,
+					chunk_vertices)
+	sizes = np.diff(split['vertex_ptr'])
+	print(str(len(sizes)) + ' components; largest ' +
+			str(int(sizes.max(initial = 0))) + ' authors.  Running ' +
+			str(len(units)) + ' units of ' +
+			', '.join(task_names) + ' with ' + str(processes) + ' processes')
+
+	blocks, shared, spec = _share(
+			{'edges': split['edges'], 'vertex_ptr': split['vertex_ptr'],
+				'edge_ptr': split['edge_ptr'],
+				'results': np.full((n_rows, n_vertices), np.nan)})
+	try:
+		task_time = dict.fromkeys(task_names, 0.0)
+		with ProcessPoolExecutor(processes, initializer = _attach,
+									initargs = (spec,)) as pool:
+			# The pool takes the units in the order they're submitted
+			futures = {pool.submit(_run_unit, task, first, last, rows[task]):
+							task for cost, task, first, last in units}
+			for future in as_completed(futures):
+				task_time[futures[future]] += future.result()
+		results = np.array(shared['results'])
+	finally:
+		del shared
+		for block in blocks:
+			block.close()
+			block.unlink()
+	for task, seconds in task_time.items():
+		metrics.observe('analysis_task_seconds', seconds, task = task)
+		print(task + ': ' + str(round(seconds, 1)) + ' s in the workers')
+
+	if 'layout' in task_names:
+		x, y = rows['layout']
+		_pack(results[x], results[y], split['vertex_ptr'])
+	# Back to the original order
+	values = {'component': split['labels']}
+	for task in task_names:
+		for name, row in zip(TASKS[task][1], rows[task]):
+			values[name] = np.empty(n_vertices)
+			values[name][split['order']] = results[row]
+	return(values)
+
+
+def analyze(net, task_names = TASKS.keys(), processes = None,
+				chunk_vertices = CHUNK_VERTICES):
+	'''
+	Run the tasks on each component of the coauthor network, and store the
+	results as vertex properties of `net`
+
+	:param net: The coauthor network, as a `graph_tool.Graph`
+	:return: `net`
+	'''
+	import numpy as np
+	edges = net.get_edges()[:, :2].astype(np.int64)
+	values = analyze_edges(net.num_vertices(), edges, task_names,
+							processes = processes,
+							chunk_vertices = chunk_vertices)
+	for name, column in values.items():
+		value_type = 'int' if name == 'component' else 'double'
+		net.vp[name] = net.new_vp(value_type, vals = column)
+	return(net)
+
+
+def analyze_files(infile = net_infile,
+					outfiles = [net_gt_outfile, net_graphml_outfile],
+					tasks = tasks, processes = None):
+	'''
+	Load the coauthor network, analyze it, and save it with the results
+
+	:return: True
+	'''
+	import graph_tool as gt
+	import export
+	net = gt.load_graph(infile)
+	analyze(net, tasks, processes = processes)
+	return(export.save(net, outfiles))
+
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(
+		description = 'Analyze each component of the coauthor network')
+	parser.add_argument('--tasks', nargs = '+', choices = list(TASKS),
+						default = tasks)
+	parser.add_argument('--processes', type = int)
+	parser.add_argument('--infile', default = net_infile)
+	parser.add_argument('--outfiles', nargs = '+',
+						default = [net_gt_outfile, net_graphml_outfile])
+	args = parser.parse_args()
+	analyze_files(args.infile, args.outfiles, args.tasks, args.processes)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+'''
+This module writes networks to files on background threads, so that several
+formats (or several networks) are written at the same time rather than one
+after another.  The format is given by the file name, as in `Graph.save`:
+`.gt`, `.graphml`, `.xml`, `.gml`, or `.dot`, optionally followed by `.gz`,
+`.bz2`, or `.xz` for compression, eg, `coauth_net.graphml.xz`.
+
+	with ExportManager() as exports:
+		exports.save(net, 'coauth_net.gt')
+		exports.save(net, 'coauth_net.graphml.gz')
+
+The block waits for every file to be written, and raises the first error.
+Like the json files, each network file is written to a temporary file and
+then moved into place, so an interrupted export leaves the old file.
+
+Property maps holding Python objects (eg, `areas`) can only be read back by
+graph-tool, so they're left out of every format except `.gt`.  This uses a
+`GraphView`, so the network isn't copied.
+'''
+
+import bz2
+import gzip
+import lzma
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+FORMATS = {'.gt': 'gt', '.graphml': 'graphml', '.xml': 'graphml',
+			'.gml': 'gml', '.dot': 'dot'}
+COMPRESSION = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+MAX_WORKERS = 4
+
+
+class ExportError(Exception):
+	pass
+
+
+def _parse_name(filename):
+	'''
+	:return: Tuple of the graph-tool format and the function to open the
+		(compressed) file with
+	'''
+	root, ext = os.path.splitext(filename)
+	opener = open
+	if ext in COMPRESSION:
+		opener = COMPRESSION[ext]
+		root, ext = os.path.splitext(root)
+	if ext not in FORMATS:
+		raise ExportError('Unknown network format: ' + filename)
+	return(FORMATS[ext], opener)
+
+
+def _portable_view(net):
+	'''
+	A view of `net` without the property maps of Python objects
+	'''
+	objects = [(kind, name) for (kind, name), prop in net.properties.items()
+				if prop.value_type() == 'python::object']
+	if objects == []:
+		return(net)
+	import graph_tool as gt
+	view = gt.GraphView(net)
+	for key in objects:
+		del view.properties[key]
+	return(view)
+
+
+def _write(net, filename):
+	'''
+	Write a single network file, atomically
+	'''
+	fmt, opener = _parse_name(filename)
+	if fmt != 'gt':
+		net = _portable_view(net)
+	folder = os.path.dirname(os.path.abspath(filename))
+	handle, tempname = tempfile.mkstemp(dir = folder,
+								prefix = '.' + os.path.basename(filename),
+								suffix = '.tmp')
+	os.close(handle)
+	try:
+		with opener(tempname, 'wb') as writefile:
+			net.save(writefile, fmt = fmt)
+		# mkstemp creates the file readable only by us; use the usual permissions
+		umask = os.umask(0)
+		os.umask(umask)
+		os.chmod(tempname, 0o666 & ~umask)
+		os.replace(tempname, filename)
+	except BaseException:
+		os.remove(tempname)
+		raise
+	return(filename)
+
+
+class ExportManager:
+	'''
+	Context manager that writes networks on a pool of threads
+
+	:param max_workers: Number of files to write at once
+	'''
+	def __init__(self, max_workers = MAX_WORKERS):
+		self.max_workers = max_workers
+		self.futures = []
+
+	def __enter__(self):
+		self.pool = ThreadPoolExecutor(self.max_workers)
+		return(self)
+
+	def save(self, net, filename):
+		'''
+		Start writing `net` to `filename`.  `net` shouldn't be changed until
+		the export is finished.
+
+		:return: A `Future` for the file name
+		'''
+		# Check the name now, rather than on the worker
+		_parse_name(filename)
+		future = self.pool.submit(_write, net, filename)
+		self.futures.append(future)
+		return(future)
+
+	def wait(self):
+		'''
+		Wait for every export started so far
+
+		:return: List of the files written
+		'''
+		written = [future.result() for future in self.futures]
+		self.futures = []
+		return(written)
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		try:
+			if exc_type is None:
+				for filename in self.wait():
+					print('Saved ' + filename)
+		finally:
+			self.pool.shutdown(wait = True)
+		return False
+
+
+def save(net, filenames, max_workers = MAX_WORKERS):
+	'''
+	Write `net` to each of `filenames` at once
+
+	:return: True
+	'''
+	with ExportManager(max_workers) as exports:
+		for filename in filenames:
+			exports.save(net, filename)
+	return True
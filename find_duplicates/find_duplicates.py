@@ -3,45 +3,48 @@ Identify potential duplicates, based on surnames
 Second run: collapse them
 '''
 #import graph_tool as gt
-import json
-import pandas as pd
 #import os.path as os
 import unicodedata
 
 datafile_in = 'combined_metadata.json'
 potential_dupes_file = 'potential_dupes.csv'
 
-#if not os.exists(potential_dupes_file):
-# Load the data file
-with open(datafile_in) as readfile:
-	authors = json.load(readfile)
+def find_duplicates(datafile_in = datafile_in, 
+					potential_dupes_file = potential_dupes_file):
+	'''
+	Write the authors who share an (ascii-ed) surname to `potential_dupes_file`
+	'''
+	import numpy as np
+	import pandas as pd
+	import metadata_store
+	# Load the data file
+	authors = metadata_store.MetadataStore.load(datafile_in)
 
-# Convert to a Pandas data frame
-authors_df = pd.DataFrame(authors)
-# Remove some columns we won't need
-del authors_df['areas']
-del authors_df['docs']
-# `name` is a column of dicts; break it out
-authors_df['surname'] = pd.Series([author['name']['surname'] for author in authors])
-authors_df['given'] = pd.Series([author['name']['given'] for author in authors])
-# Convert surname to ascii, dropping non-ascii characters
-#authors_df['surname_ascii'] = authors_df['surname'].str.encode('ascii', 'ignore')
-authors_df['surname_ascii'] = pd.Series(
-	[unicodedata.normalize('NFKD', surname).encode('ascii', 'ignore') 
-		for surname in authors_df['surname']])
+	# Convert surname to ascii, dropping non-ascii characters; the surnames 
+	#  are dictionary-encoded, so each distinct surname is converted once
+	surnames_ascii = np.array(
+		[unicodedata.normalize('NFKD', surname).encode('ascii', 'ignore') 
+			for surname in authors.tables['surname']] + [None], 
+		dtype = object)[:-1]
+	# Code of each author's ascii-ed surname, in sorted order
+	surnames_ascii, ascii_code = np.unique(surnames_ascii, return_inverse = True)
+	ascii_code = ascii_code.reshape(-1)[authors.codes['surname']]
 
-# Identify ascii-ed surnames that appear more than once
-surnames = set(authors_df['surname_ascii'].tolist())
-surnames = [surname for surname in surnames 
-			if len(authors_df[authors_df['surname_ascii'] == surname]) > 1]
-# Identify the authors with these ascii-ed surnames
-authors_df = authors_df[authors_df['surname_ascii'].isin(surnames)]
-authors_df = authors_df.sort_values('surname_ascii')
+	# Identify the authors with ascii-ed surnames that appear more than once
+	counts = np.bincount(ascii_code, minlength = len(surnames_ascii))
+	rows = np.flatnonzero(counts[ascii_code] > 1)
+	rows = rows[np.argsort(ascii_code[rows], kind = 'stable')]
 
-# Clean up by removing the column of dicts and ascii-ed surnames
-del authors_df['name']
-#del authors_df['surname_ascii']
+	# Write to a CSV for manual checking
+	authors_df = pd.DataFrame({'sid': authors.column('sid', rows), 
+					'affiliation': authors.column('affiliation', rows), 
+					'country': authors.column('country', rows), 
+					'surname': authors.column('surname', rows), 
+					'given': authors.column('given', rows), 
+					'surname_ascii': surnames_ascii[ascii_code[rows]]})
+	authors_df.to_csv(potential_dupes_file, index = False)
+	return True
 
-# Write to a CSV for manual checking
-#print(authors_df)
-authors_df.to_csv(potential_dupes_file, index = False)
+
+if __name__ == '__main__':
+	find_duplicates()
@@ -5,20 +5,48 @@ Extract that column and save it as a `json` file.
 '''
 
 import json
-import pandas as pd
 
 infile = 'Scopus IDs.csv'
 sids_col_name = 'Author 1 SID'
 outfile = 'sids.json'
 
-# Read the CSV file
-data = pd.read_csv(infile, encoding='latin-1')
-# Grab the column with sids, drop NAs, and coerce to a list
-sids = data[sids_col_name].dropna().tolist()
-# Pandas reads the sids as floats; coerce to ints to drop decimal, then 
-#  to strings
-sids = [str(int(sid)) for sid in sids]
-
-# Write the result
-with open(outfile, 'w') as writefile:
-	json.dump(sids, writefile)
+def get_sids(infile = infile, sids_col_name = sids_col_name, 
+				outfile = outfile):
+	'''
+	Extract the column `sids_col_name` of `infile` into `outfile`
+	'''
+	# Imported here, so that the other stages don't pay for loading pandas
+	import pandas as pd
+	# Read the CSV file
+	data = pd.read_csv(infile, encoding='latin-1')
+	# Grab the column with sids, drop NAs, and coerce to a list
+	sids = data[sids_col_name].dropna().tolist()
+	# Pandas reads the sids as floats; coerce to ints to drop decimal, then 
+	#  to strings
+	sids = [str(int(sid)) for sid in sids]
+
+	# Write the result
+	with open(outfile, 'w') as writefile:
+		json.dump(sids, writefile)
+	return True
+
+
+def get_strata(strata_col_name, infile = infile, 
+				sids_col_name = sids_col_name):
+	'''
+	Read a column of `infile` to stratify the SIDs by, eg, for a stratified 
+	sample of generation 1 in `scrape/sampling.py`
+	
+	:return: Dict mapping each SID to its value of `strata_col_name`, as a 
+		string; '' where the value is missing
+	'''
+	import pandas as pd
+	data = pd.read_csv(infile, encoding='latin-1')
+	data = data[data[sids_col_name].notna()]
+	strata = data[strata_col_name].fillna('').astype(str).tolist()
+	sids = [str(int(sid)) for sid in data[sids_col_name]]
+	return(dict(zip(sids, strata)))
+
+
+if __name__ == '__main__':
+	get_sids()
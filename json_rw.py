@@ -1,33 +1,271 @@
 '''
-This module defines two wrappers around the `json` module's `load` and `dump` 
-methods.  The wrappers accept filename strings rather than file-like objects, 
-and `writef` and `writes` use `ensure_ascii = False`.  
+This module defines the json input and output used throughout the pipeline.
+
+`json_readf`, `json_writef`, and `json_writes` are wrappers around the `json`
+module's `load` and `dump` methods.  The wrappers accept filename strings
+rather than file-like objects, and `writef` and `writes` use
+`ensure_ascii = False`.  When the `orjson` package is installed, it's used as
+a faster backend, falling back to `json` for options `orjson` doesn't support.
+
+For files too large to hold in memory at once, `iter_json_array` and
+`iter_jsonl` read the items of a json array or a json lines file one at a
+time, and `JsonArrayWriter` writes them one at a time, in chunks.
+`text_writef` writes a plain text file in the same way as the json writers.
+
+All writes are atomic:  data are written to a temporary file in the same
+folder, which then replaces the target file.  An interrupted write leaves the
+old file in place.  Files whose names end in `.gz` are read and written with
+gzip compression.
 '''
 
+import gzip
 import json
+import os
+import tempfile
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+READ_CHUNK = 2**20		# Characters to read at a time when streaming
+WRITE_CHUNK = 10000		# Items to serialize at a time when streaming
+
+
+def _loads(string):
+	if orjson is not None:
+		return(orjson.loads(string))
+	return(json.loads(string))
+
+
+def _dumps(data, ensure_ascii = False, indent = None, **kwargs):
+	'''
+	Serialize `data` to a string, with `orjson` where it supports the options
+	'''
+	if orjson is not None and not ensure_ascii and kwargs == {} and \
+			indent in [None, 2]:
+		option = orjson.OPT_INDENT_2 if indent == 2 else 0
+		try:
+			return(orjson.dumps(data, option = option).decode('utf-8'))
+		except TypeError:
+			# Eg, integers too large for orjson; let json handle them
+			pass
+	return(json.dumps(data, ensure_ascii = ensure_ascii, indent = indent,
+						**kwargs))
+
+
+def _open(filename, mode = 'r'):
+	'''
+	Open a text file, decompressing it if its name ends in `.gz`
+	'''
+	if filename.endswith('.gz'):
+		return(gzip.open(filename, mode + 't', encoding = 'utf-8'))
+	return(open(filename, mode, encoding = 'utf-8'))
+
+
+class _AtomicFile:
+	'''
+	Context manager for writing a text file atomically.  Yields a file object
+	for a temporary file, which replaces `filename` only if the block exits
+	without an error.
+	'''
+	def __init__(self, filename):
+		self.filename = filename
+
+	def __enter__(self):
+		folder = os.path.dirname(os.path.abspath(self.filename))
+		handle, self.tempname = tempfile.mkstemp(dir = folder,
+									prefix = '.' + os.path.basename(self.filename),
+									suffix = '.tmp')
+		# mkstemp creates the file readable only by us; use the usual permissions
+		umask = os.umask(0)
+		os.umask(umask)
+		os.chmod(self.tempname, 0o666 & ~umask)
+		if self.filename.endswith('.gz'):
+			os.close(handle)
+			self.file = gzip.open(self.tempname, 'wt', encoding = 'utf-8')
+		else:
+			self.file = os.fdopen(handle, 'w', encoding = 'utf-8')
+		return(self.file)
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.file.close()
+		if exc_type is None:
+			os.replace(self.tempname, self.filename)
+		else:
+			os.remove(self.tempname)
+		return False
+
 
 def json_readf(filename, **kwargs):
 	'''
 	Read a json file named `filename`
 	'''
-	with open(filename) as readfile:
+	with _open(filename) as readfile:
+		if kwargs == {}:
+			return(_loads(readfile.read()))
 		data = json.load(readfile, **kwargs)
 	return data
 
 def json_writef(data, filename, ensure_ascii = False, **kwargs):
 	'''
-	Write `data` a json file to the file named in `filename`. 
-	Default `ensure_ascii = False`. 
+	Write `data` a json file to the file named in `filename`.
+	Default `ensure_ascii = False`.
+	'''
+	with _AtomicFile(filename) as writefile:
+		writefile.write(_dumps(data, ensure_ascii = ensure_ascii, **kwargs))
+	return True
+
+def text_writef(text, filename):
+	'''
+	Write the string `text` to the file named in `filename`.
 	'''
-	with open(filename, 'w') as writefile:
-		json.dump(data, writefile, ensure_ascii = ensure_ascii, **kwargs)
+	with _AtomicFile(filename) as writefile:
+		writefile.write(text)
 	return True
-	
+
 def json_writes(data, ensure_ascii = False, indent = 4, **kwargs):
 	'''
-	Generate a string for pretty printing of `data`.  
-	By default, `ensure_ascii = False` and `indent = 4`.  
+	Generate a string for pretty printing of `data`.
+	By default, `ensure_ascii = False` and `indent = 4`.
 	'''
-	return json.dumps(data, ensure_ascii = ensure_ascii, indent = indent, 
+	return json.dumps(data, ensure_ascii = ensure_ascii, indent = indent,
 						**kwargs)
 
+
+def iter_json_array(filename, chunk_size = READ_CHUNK):
+	'''
+	Iterate over the items of the json array in the file named `filename`,
+	reading `chunk_size` characters at a time.
+	'''
+	decoder = json.JSONDecoder()
+	with _open(filename) as readfile:
+		buffer = ''
+		pos = 0
+		eof = False
+		def fill():
+			# Drop what's been parsed, and read the next chunk
+			nonlocal buffer, pos, eof
+			chunk = readfile.read(chunk_size)
+			eof = chunk == ''
+			buffer = buffer[pos:] + chunk
+			pos = 0
+		def skip(chars):
+			# Skip over any of `chars`, reading more as needed
+			nonlocal pos
+			while True:
+				while pos < len(buffer) and buffer[pos] in chars:
+					pos += 1
+				if pos < len(buffer) or eof:
+					return
+				fill()
+
+		fill()
+		skip(' \t\n\r')
+		if buffer[pos:pos + 1] != '[':
+			raise ValueError(filename + ' does not contain a json array')
+		pos += 1
+		while True:
+			skip(' \t\n\r,')
+			if pos >= len(buffer):
+				raise ValueError('Unexpected end of ' + filename)
+			if buffer[pos] == ']':
+				return
+			try:
+				item, end = decoder.raw_decode(buffer, pos)
+			except ValueError:
+				if eof:
+					raise
+				fill()
+				continue
+			# An item is only complete if it's followed by a delimiter; eg, a 
+			#  number at the end of the buffer might continue in the next chunk
+			if end == len(buffer) or buffer[end] not in ' \t\n\r,]':
+				if eof:
+					raise ValueError('Malformed json array in ' + filename)
+				fill()
+				continue
+			pos = end
+			yield item
+
+
+def iter_jsonl(filename):
+	'''
+	Iterate over the items in the json lines file named `filename`.  A
+	truncated last line (eg, from an interrupted append) is skipped.
+	'''
+	with _open(filename) as readfile:
+		for line in readfile:
+			if line.strip() == '':
+				continue
+			try:
+				yield _loads(line)
+			except ValueError:
+				if line.endswith('\n'):
+					raise
+				print('Skipping truncated last line of ' + filename)
+
+
+def append_jsonl(items, filename):
+	'''
+	Append `items` to the json lines file named `filename`, one per line.
+	Unlike the other writers, this isn't atomic, but `iter_jsonl` skips a
+	truncated last line.
+	'''
+	lines = ''.join(_dumps(item) + '\n' for item in items)
+	with _open(filename, 'a') as writefile:
+		writefile.write(lines)
+	return True
+
+
+class JsonArrayWriter:
+	'''
+	Context manager for writing a json array (or, with `lines = True`, a json
+	lines file) one item at a time.  Items are serialized in chunks of
+	`chunk_size`, and the file is replaced atomically when the block exits.
+
+		with JsonArrayWriter('combined_sids.json') as writer:
+			for sid in sids:
+				writer.write(sid)
+	'''
+	def __init__(self, filename, lines = False, chunk_size = WRITE_CHUNK):
+		self.filename = filename
+		self.lines = lines
+		self.chunk_size = chunk_size
+		self.pending = []
+		self.count = 0
+
+	def __enter__(self):
+		self.atomic = _AtomicFile(self.filename)
+		self.file = self.atomic.__enter__()
+		if not self.lines:
+			self.file.write('[')
+		return(self)
+
+	def _flush(self):
+		if self.pending == []:
+			return
+		if self.lines:
+			self.file.write(''.join(item + '\n' for item in self.pending))
+		else:
+			if self.count > len(self.pending):
+				self.file.write(', ')
+			self.file.write(', '.join(self.pending))
+		self.pending = []
+
+	def write(self, item):
+		self.pending.append(_dumps(item))
+		self.count += 1
+		if len(self.pending) >= self.chunk_size:
+			self._flush()
+
+	def write_all(self, items):
+		for item in items:
+			self.write(item)
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self._flush()
+			if not self.lines:
+				self.file.write(']')
+		return(self.atomic.__exit__(exc_type, exc_value, traceback))
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+'''
+This module holds the author metadata from `combined_metadata.json` in
+columns of numpy arrays, rather than as a list of nested dicts:
+
+	- `sid` and `docs`:  int64 and int32 arrays, one entry per author
+	- `surname`, `given`, `affiliation`, and `country`:  int32 codes into
+		a table of the distinct strings, so that each string is stored once
+	- `areas`:  the research areas of every author, as codes into a table of
+		area names, in one array; author `i`'s areas are
+		`area_codes[area_ptr[i]:area_ptr[i + 1]]`.  Scopus gives a single
+		area as a dict and several as a list; both are read the same way.
+
+Authors are found by SID with a hash table (open addressing, with linear
+probing) built and searched with vectorized numpy operations, so that a
+whole column of SIDs can be joined to the rows in one call:
+
+	store = MetadataStore.load('combined_metadata.json')
+	rows = store.rows(net_sids)			# -1 where an SID has no metadata
+	docs = store.column('docs', rows)
+
+At a million authors the store takes around a twentieth of the memory of
+the list of dicts; see `benchmark/bench_metadata_store.py`.  SIDs must be
+numeric, as Scopus's are.  If an SID appears more than once, the last
+record is kept, as when the records are written into the network in turn.
+'''
+
+from array import array
+import numpy as np
+from json_rw import *
+
+author_data_file = 'combined_metadata.json'
+STRING_FIELDS = ['surname', 'given', 'affiliation', 'country']
+EMPTY = -1				# Key for an empty slot in the hash table
+HASH_FACTOR = 0x9E3779B97F4A7C15	# Fibonacci hashing:  2**64 / golden ratio
+
+
+def _hash(keys, bits):
+	'''
+	Slots in a table of `2**bits` slots for an array of int64 `keys`
+	'''
+	keys = np.asarray(keys, dtype = np.int64).view(np.uint64)
+	return((keys * np.uint64(HASH_FACTOR) >> np.uint64(64 - bits))
+				.astype(np.int64))
+
+
+class SidIndex:
+	'''
+	Hash table mapping int64 SIDs to rows, at most half full
+
+	:param keys: Array of distinct, non-negative SIDs; SID `keys[i]` maps to
+		row `i`
+	'''
+	def __init__(self, keys):
+		keys = np.asarray(keys, dtype = np.int64)
+		self.bits = max(1, int(2 * len(keys) - 1).bit_length())
+		self.mask = (1 << self.bits) - 1
+		self.keys = np.full(1 << self.bits, EMPTY, dtype = np.int64)
+		self.values = np.full(1 << self.bits, -1, dtype = np.int64)
+		# Each round, every key still pending tries its current slot; for
+		#  each empty slot, the first key to try it takes it, and the rest
+		#  move on to the next slot
+		pending = np.arange(len(keys))
+		slots = _hash(keys, self.bits)
+		while len(pending) > 0:
+			empty = np.flatnonzero(self.keys[slots] == EMPTY)
+			taken, first = np.unique(slots[empty], return_index = True)
+			winners = pending[empty[first]]
+			self.keys[taken] = keys[winners]
+			self.values[taken] = winners
+			placed = np.zeros(len(pending), dtype = bool)
+			placed[empty[first]] = True
+			pending = pending[~placed]
+			slots = (slots[~placed] + 1) & self.mask
+
+	def get(self, sid, default = -1):
+		'''
+		Row of a single SID
+		'''
+		sid = int(sid)
+		slot = ((sid * HASH_FACTOR) & 0xFFFFFFFFFFFFFFFF) >> (64 - self.bits)
+		while True:
+			key = self.keys[slot]
+			if key == sid:
+				return(int(self.values[slot]))
+			if key == EMPTY:
+				return(default)
+			slot = (slot + 1) & self.mask
+
+	def lookup(self, sids):
+		'''
+		Rows of an array of SIDs
+
+		:return: int64 array of rows, -1 for SIDs not in the table
+		'''
+		sids = np.asarray(sids, dtype = np.int64)
+		rows = np.full(len(sids), -1, dtype = np.int64)
+		pending = np.arange(len(sids))
+		slots = _hash(sids, self.bits)
+		while len(pending) > 0:
+			found = self.keys[slots]
+			hit = found == sids[pending]
+			rows[pending[hit]] = self.values[slots[hit]]
+			going = ~hit & (found != EMPTY)
+			pending = pending[going]
+			slots = (slots[going] + 1) & self.mask
+		return(rows)
+
+	@property
+	def nbytes(self):
+		return(self.keys.nbytes + self.values.nbytes)
+
+
+def _area_name(area):
+	if isinstance(area, dict):
+		return(area['#text'])
+	return(area)
+
+
+def area_names(areas):
+	'''
+	The names of the research areas in a metadata record's `areas`, which
+	Scopus gives as a dict for a single area and a list for several
+	'''
+	if isinstance(areas, dict):
+		areas = [areas]
+	return([_area_name(area) for area in areas or []])
+
+
+def encode_lists(lists):
+	'''
+	Dictionary-encode a sequence of lists of strings, as compressed rows
+
+	:return: Tuple of the row pointers (int64, one longer than `lists`), the
+		codes (int32), and the sorted array of distinct strings
+	'''
+	table = {}
+	ptr = array('q', [0])
+	codes = array('i')
+	for items in lists:
+		codes.extend(table.setdefault(item, len(table)) for item in items)
+		ptr.append(len(codes))
+	names = np.array(list(table) + [''], dtype = object)[:-1]
+	# Renumber the codes in order of name, for sorted output
+	order = np.argsort(names.astype(str), kind = 'stable')
+	recode = np.empty(len(order), dtype = np.int32)
+	recode[order] = np.arange(len(order), dtype = np.int32)
+	return(np.frombuffer(ptr, dtype = np.int64).copy(),
+			recode[np.frombuffer(codes, dtype = np.int32)],
+			names[order])
+
+
+def indicator_matrix(ptr, codes, n_names):
+	'''
+	Boolean matrix with a row for each list encoded by `encode_lists`, and a
+	column for each name, true where the list includes the name
+	'''
+	matrix = np.zeros((len(ptr) - 1, n_names), dtype = bool)
+	matrix[np.repeat(np.arange(len(ptr) - 1), np.diff(ptr)), codes] = True
+	return(matrix)
+
+
+class MetadataStore:
+	'''
+	Columnar store of author metadata, indexed by SID; build it with `load`
+	or `from_records`
+	'''
+	def __init__(self, sid, docs, codes, tables, area_ptr, area_codes,
+					areas_table):
+		self.sid = sid
+		self.docs = docs
+		self.codes = codes				# Dict of int32 arrays, by field
+		self.tables = tables			# Dict of object arrays of strings
+		self.area_ptr = area_ptr
+		self.area_codes = area_codes
+		self.areas_table = areas_table
+		self.index = SidIndex(sid)
+
+	@classmethod
+	def from_records(cls, records):
+		'''
+		Build the store from an iterable of metadata records, in the format
+		of `combined_metadata.json`, reading them one at a time
+		'''
+		sid = array('q')
+		docs = array('i')
+		codes = {field: array('i') for field in STRING_FIELDS}
+		# The empty string is code 0, for authors without a value
+		tables = {field: {'': 0} for field in STRING_FIELDS}
+		areas = []
+		for record in records:
+			sid.append(int(record['sid']))
+			docs.append(record['docs'])
+			values = {'surname': record['name']['surname'],
+						'given': record['name']['given'],
+						'affiliation': record['affiliation'],
+						'country': record['country']}
+			for field in STRING_FIELDS:
+				value = values[field] or ''
+				codes[field].append(tables[field].setdefault(value,
+														len(tables[field])))
+			areas.append(area_names(record['areas']))
+		area_ptr, area_codes, areas_table = encode_lists(areas)
+		sid = np.frombuffer(sid, dtype = np.int64)
+		docs = np.frombuffer(docs, dtype = np.int32)
+		codes = {field: np.frombuffer(codes[field], dtype = np.int32)
+					for field in STRING_FIELDS}
+		tables = {field: np.array(list(tables[field]) + [None],
+									dtype = object)[:-1]
+					for field in STRING_FIELDS}
+
+		# Keep the last record for each SID
+		last = len(sid) - 1 - np.unique(sid[::-1], return_index = True)[1]
+		if len(last) < len(sid):
+			keep = np.sort(last)
+			sizes = np.diff(area_ptr)[keep]
+			starts = area_ptr[keep]
+			area_codes = area_codes[np.repeat(starts - np.cumsum(sizes) + sizes,
+												sizes) + np.arange(sizes.sum())]
+			area_ptr = np.concatenate([[0], np.cumsum(sizes)])
+			sid = sid[keep]
+			docs = docs[keep]
+			codes = {field: column[keep] for field, column in codes.items()}
+		return(cls(sid.copy(), docs.copy(),
+					{field: column.copy() for field, column in codes.items()},
+					tables, area_ptr, area_codes, areas_table))
+
+	@classmethod
+	def load(cls, filename = author_data_file):
+		'''
+		Build the store from a metadata file, streaming through it
+		'''
+		return(cls.from_records(iter_json_array(filename)))
+
+	def __len__(self):
+		return(len(self.sid))
+
+	def __contains__(self, sid):
+		return(self.index.get(sid) >= 0)
+
+	def row(self, sid):
+		'''
+		:return: The row of an SID
+		'''
+		row = self.index.get(sid)
+		if row < 0:
+			raise KeyError(sid)
+		return(row)
+
+	def rows(self, sids):
+		'''
+		Vectorized `row`
+
+		:return: int64 array of rows, -1 for SIDs without metadata
+		'''
+		return(self.index.lookup(np.asarray(sids).astype(np.int64)))
+
+	def column(self, field, rows = None):
+		'''
+		Values of a field, decoded, for `rows` (by default, every author).
+		Rows of -1 get an empty string or 0.
+
+		:param field: `sid`, `docs`, or one of `STRING_FIELDS`
+		:return: numpy array; object array of strings for the string fields
+			(and `sid`, as strings)
+		'''
+		if rows is None:
+			rows = np.arange(len(self))
+		rows = np.asarray(rows, dtype = np.int64)
+		missing = rows < 0
+		if field in STRING_FIELDS:
+			codes = self.codes[field][rows]
+			codes[missing] = 0
+			return(self.tables[field][codes])
+		if field == 'sid':
+			values = self.sid[rows].astype(str).astype(object)
+			values[missing] = ''
+			return(values)
+		if field == 'docs':
+			values = self.docs[rows]
+			values[missing] = 0
+			return(values)
+		raise KeyError(field)
+
+	def areas(self, row):
+		'''
+		:return: List of the research areas of the author in `row`
+		'''
+		return(self.areas_table[self.area_codes[self.area_ptr[row]:
+												self.area_ptr[row + 1]]].tolist())
+
+	def area_lists(self, rows = None):
+		'''
+		Research areas of the authors in `rows`, as lists; [] for rows of -1
+		'''
+		if rows is None:
+			rows = range(len(self))
+		return([self.areas(row) if row >= 0 else [] for row in rows])
+
+	def area_matrix(self, rows = None):
+		'''
+		:return: Boolean matrix with a row for each of `rows` (by default,
+			every author) and a column for each research area in
+			`areas_table`; rows of -1 are all false
+		'''
+		matrix = indicator_matrix(self.area_ptr, self.area_codes,
+									len(self.areas_table))
+		if rows is None:
+			return(matrix)
+		rows = np.asarray(rows, dtype = np.int64)
+		return(np.where((rows >= 0)[:, None], matrix[rows], False))
+
+	def get(self, sid):
+		'''
+		:return: Dict of the metadata for an SID, flattened
+		'''
+		row = self.row(sid)
+		record = {field: self.tables[field][self.codes[field][row]]
+					for field in STRING_FIELDS}
+		record.update({'sid': str(self.sid[row]), 'docs': int(self.docs[row]),
+						'areas': self.areas(row)})
+		return(record)
+
+	@property
+	def nbytes(self):
+		'''
+		Approximate memory used by the store, including the string tables
+		'''
+		import sys
+		strings = sum(sys.getsizeof(value) + 8 for table in
+						list(self.tables.values()) + [self.areas_table]
+						for value in table)
+		arrays = [self.sid, self.docs, self.area_ptr, self.area_codes] + \
+					list(self.codes.values())
+		return(sum(column.nbytes for column in arrays) + strings +
+				self.index.nbytes)
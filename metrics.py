@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+'''
+This module collects timing and count metrics for the pipeline: request
+latencies and outcomes in `scrape`, checkpoint writes in `batch`, and the
+wall time and peak memory of each pipeline stage.  Metrics are kept in a
+single process-wide registry and written out by `write` as both json
+(`metrics.json`) and Prometheus text format (`metrics.prom`).
+
+Stages can also be profiled, by passing `profile` to `stage` or setting the
+environment variable `PIPELINE_PROFILE`:
+	- `cprofile`: deterministic profile, saved as `profiles/<stage>.prof`
+		(readable with `pstats`, `snakeviz`, or `flameprof`)
+	- `sample`: sampling profile of the main thread, saved as
+		`profiles/<stage>.folded` in the folded-stack format read by
+		`flamegraph.pl` and speedscope
+'''
+
+import cProfile
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from json_rw import json_writef, text_writef
+
+METRICS_FILE = 'metrics.json'
+PROMETHEUS_FILE = 'metrics.prom'
+PROFILE_FOLDER = 'profiles'
+SAMPLE_INTERVAL = 0.005		# Seconds between samples for the sampling profiler
+RSS_INTERVAL = 0.1			# Seconds between memory samples during a stage
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float('inf')]
+
+
+class Histogram:
+	'''
+	Cumulative histogram with fixed buckets, as in Prometheus
+	'''
+	def __init__(self, buckets = BUCKETS):
+		self.buckets = buckets
+		self.counts = [0] * len(buckets)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value):
+		for i, bound in enumerate(self.buckets):
+			if value <= bound:
+				self.counts[i] += 1
+		self.sum += value
+		self.count += 1
+
+	def to_dict(self):
+		return({'buckets': {str(bound): count for bound, count
+								in zip(self.buckets, self.counts)},
+				'sum': self.sum, 'count': self.count})
+
+
+class Registry:
+	'''
+	Thread-safe store of counters, histograms, and per-stage measurements.
+	Counters and histograms are identified by a name and a set of labels.
+	'''
+	def __init__(self):
+		self.started = time.time()
+		self.counters = {}
+		self.histograms = {}
+		self.gauges = {}
+		self.stages = {}
+		self._lock = threading.Lock()
+
+	def inc(self, name, value = 1, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self._lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+
+	def set(self, name, value, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self._lock:
+			self.gauges[key] = value
+
+	def observe(self, name, value, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self._lock:
+			if key not in self.histograms:
+				self.histograms[key] = Histogram()
+			self.histograms[key].observe(value)
+
+	@contextmanager
+	def timer(self, name, **labels):
+		'''
+		Context manager recording the time spent in the block in histogram
+		`name`
+		'''
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(name, time.perf_counter() - start, **labels)
+
+	def record_stage(self, name, wall, peak_rss):
+		with self._lock:
+			stage = self.stages.setdefault(name,
+							{'runs': 0, 'wall_s': 0.0, 'peak_rss_mb': 0.0})
+			stage['runs'] += 1
+			stage['wall_s'] += wall
+			stage['peak_rss_mb'] = max(stage['peak_rss_mb'], peak_rss / 2**20)
+
+	def to_dict(self):
+		with self._lock:
+			def entries(store, value):
+				return([{'name': name, 'labels': dict(labels),
+							'value': value(item)}
+						for (name, labels), item in sorted(store.items())])
+			return({'started': self.started, 'written': time.time(),
+					'counters': entries(self.counters, lambda x: x),
+					'gauges': entries(self.gauges, lambda x: x),
+					'histograms': entries(self.histograms, Histogram.to_dict),
+					'stages': {name: dict(stage)
+								for name, stage in self.stages.items()}})
+
+	def to_prometheus(self):
+		'''
+		:return: The metrics in the Prometheus text exposition format
+		'''
+		def fmt_labels(labels, extra = ()):
+			labels = list(labels) + list(extra)
+			if labels == []:
+				return('')
+			return('{' + ','.join(name + '="' + str(value) + '"'
+									for name, value in labels) + '}')
+		lines = []
+		with self._lock:
+			typed = set()
+			for kind, store in [('counter', self.counters),
+								('gauge', self.gauges)]:
+				for (name, labels), value in sorted(store.items()):
+					if name not in typed:
+						lines.append('# TYPE ' + name + ' ' + kind)
+						typed.add(name)
+					lines.append(name + fmt_labels(labels) + ' ' + str(value))
+			for (name, labels), hist in sorted(self.histograms.items()):
+				if name not in typed:
+					lines.append('# TYPE ' + name + ' histogram')
+					typed.add(name)
+				for bound, count in zip(hist.buckets, hist.counts):
+					le = '+Inf' if bound == float('inf') else str(bound)
+					lines.append(name + '_bucket' +
+									fmt_labels(labels, [('le', le)]) +
+									' ' + str(count))
+				lines.append(name + '_sum' + fmt_labels(labels) + ' ' +
+								str(hist.sum))
+				lines.append(name + '_count' + fmt_labels(labels) + ' ' +
+								str(hist.count))
+			for field, metric in [('wall_s', 'pipeline_stage_seconds'),
+									('peak_rss_mb', 'pipeline_stage_peak_rss_mb')]:
+				lines.append('# TYPE ' + metric + ' gauge')
+				for name, stage in sorted(self.stages.items()):
+					lines.append(metric + fmt_labels([('stage', name)]) + ' ' +
+									str(stage[field]))
+		return('\n'.join(lines) + '\n')
+
+
+## The process-wide registry, and shortcuts to its methods
+registry = Registry()
+inc = registry.inc
+observe = registry.observe
+gauge = registry.set
+timer = registry.timer
+
+
+def write(json_file = METRICS_FILE, prometheus_file = PROMETHEUS_FILE):
+	'''
+	Write the metrics in the registry to `json_file` and `prometheus_file`
+	'''
+	# Written atomically, so that an interrupted run doesn't leave a 
+	#  truncated file for `plan` to read
+	json_writef(registry.to_dict(), json_file, indent = 4)
+	text_writef(registry.to_prometheus(), prometheus_file)
+	return True
+
+
+def _current_rss():
+	'''
+	:return: Current resident memory, in bytes; falls back to the peak so far
+		where `/proc` isn't available
+	'''
+	try:
+		with open('/proc/self/statm') as readfile:
+			return(int(readfile.read().split()[1]) * resource.getpagesize())
+	except OSError:
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		# ru_maxrss is in bytes on macOS and kilobytes elsewhere
+		return(peak if sys.platform == 'darwin' else peak * 1024)
+
+
+class _Sampler(threading.Thread):
+	'''
+	Background thread that samples memory use, and optionally the stack of
+	the thread that started it
+	'''
+	def __init__(self, interval, stacks = False):
+		super().__init__(daemon = True)
+		self.interval = interval
+		self.stacks = stacks
+		self.target = threading.get_ident()
+		self.peak_rss = _current_rss()
+		self.folded = {}
+		self._done = threading.Event()
+
+	def run(self):
+		while not self._done.wait(self.interval):
+			self.peak_rss = max(self.peak_rss, _current_rss())
+			if self.stacks:
+				frame = sys._current_frames().get(self.target)
+				stack = []
+				while frame is not None:
+					code = frame.f_code
+					stack.append(code.co_name + ' (' +
+									os.path.basename(code.co_filename) + ':' +
+									str(code.co_firstlineno) + ')')
+					frame = frame.f_back
+				folded = ';'.join(reversed(stack))
+				self.folded[folded] = self.folded.get(folded, 0) + 1
+
+	def stop(self):
+		self._done.set()
+		self.join()
+		self.peak_rss = max(self.peak_rss, _current_rss())
+
+
+@contextmanager
+def stage(name, profile = None):
+	'''
+	Context manager measuring the wall time and peak memory of a pipeline
+	stage, and optionally profiling it
+
+	:param name: Name of the stage
+	:param profile: None, `'cprofile'`, or `'sample'`; defaults to the
+		environment variable `PIPELINE_PROFILE`
+	'''
+	if profile is None:
+		profile = os.environ.get('PIPELINE_PROFILE')
+	sampler = _Sampler(SAMPLE_INTERVAL if profile == 'sample' else RSS_INTERVAL,
+						stacks = profile == 'sample')
+	profiler = cProfile.Profile() if profile == 'cprofile' else None
+	sampler.start()
+	start = time.perf_counter()
+	if profiler is not None:
+		profiler.enable()
+	try:
+		yield
+	finally:
+		if profiler is not None:
+			profiler.disable()
+		wall = time.perf_counter() - start
+		sampler.stop()
+		registry.record_stage(name, wall, sampler.peak_rss)
+		if profile in ['cprofile', 'sample']:
+			if not os.access(PROFILE_FOLDER, os.F_OK):
+				os.mkdir(PROFILE_FOLDER)
+			if profiler is not None:
+				profiler.dump_stats(os.path.join(PROFILE_FOLDER, name + '.prof'))
+			else:
+				with open(os.path.join(PROFILE_FOLDER, name + '.folded'),
+							'w') as writefile:
+					for stack, count in sorted(sampler.folded.items()):
+						writefile.write(stack + ' ' + str(count) + '\n')
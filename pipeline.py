@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+'''
+This module defines a small executor for the stages of the pipeline.
+
+Each stage is a function together with the files it reads (`inputs`), the
+files it writes (`outputs`), and any parameters that change its results
+(`params`).  The executor orders the stages by matching outputs to inputs,
+and records a hash of every input, output, and parameter when a stage
+finishes.  On the next run, a stage is skipped if none of these have
+changed.  Since a stage that re-runs usually changes its outputs, and these
+are the inputs of the downstream stages, only the stages affected by a
+change (eg, editing `dupes.csv` or `max_dist`) are re-run.
+
+A stage function returns `False` if it did not finish on this run (eg, a
+batch of API queries that will be continued in the next session).  The
+executor then stops, without recording the stage as current, so that the
+stage picks up where it left off the next time the pipeline is run.
+
+The wall time and peak memory of each stage are recorded with `metrics`, and 
+written to `metrics.json` and `metrics.prom` after each stage.  
+'''
+
+import hashlib
+import json
+import os
+from json_rw import *
+import metrics
+
+STATE_FILE = 'pipeline_state.json'	# File, in cwd, that records stage hashes
+HASH_BLOCK = 2**20					# Block size for reading files to hash
+
+
+class PipelineError(Exception):
+	pass
+
+
+class Stage:
+	'''
+	A single stage of the pipeline
+
+	:param name: Name of the stage, used in messages and the state file
+	:param run: Function that runs the stage; called with `params` as
+		keyword arguments
+	:param inputs: List of files read by the stage
+	:param outputs: List of files written by the stage
+	:param params: Dict of parameters passed to `run`; these must be
+		serializable as json
+	'''
+	def __init__(self, name, run, inputs = [], outputs = [], params = {}):
+		self.name = name
+		self.run = run
+		self.inputs = list(inputs)
+		self.outputs = list(outputs)
+		self.params = dict(params)
+
+
+class Pipeline:
+	'''
+	Run a list of `Stage`s, skipping the ones whose inputs, outputs, and
+	parameters are unchanged since they last finished.
+
+	:param stages: List of `Stage`s, in any order
+	:param state_file: File used to record the hashes between runs
+	:param profile: Profiler to run on each stage; see `metrics.stage`
+	'''
+	def __init__(self, stages, state_file = STATE_FILE, profile = None):
+		self.stages = self._order(stages)
+		self.state_file = state_file
+		self.profile = profile
+		if os.access(state_file, os.R_OK):
+			self.state = json_readf(state_file)
+		else:
+			self.state = {'stages': {}, 'files': {}}
+
+	@staticmethod
+	def _order(stages):
+		'''
+		Sort the stages so that every stage comes after the stages that
+		write its inputs.
+		'''
+		producer = {}
+		for stage in stages:
+			for outfile in stage.outputs:
+				if outfile in producer:
+					raise PipelineError('Stages ' + producer[outfile].name +
+						' and ' + stage.name + ' both write ' + outfile)
+				producer[outfile] = stage
+		ordered = []
+		visiting = set()
+		def visit(stage):
+			if stage in ordered:
+				return
+			if stage in visiting:
+				raise PipelineError('Cycle in pipeline at stage ' + stage.name)
+			visiting.add(stage)
+			for infile in stage.inputs:
+				if infile in producer:
+					visit(producer[infile])
+			visiting.discard(stage)
+			ordered.append(stage)
+		for stage in stages:
+			visit(stage)
+		return(ordered)
+
+	def _hash_file(self, filename):
+		'''
+		Hash a file's contents.  Hashes are cached in the state file by size
+		and modification time, so unchanged files are not read again.
+
+		:return: The hex digest, or None if the file does not exist
+		'''
+		try:
+			stat = os.stat(filename)
+		except OSError:
+			return(None)
+		key = [stat.st_size, stat.st_mtime_ns]
+		cached = self.state['files'].get(filename)
+		if cached is not None and cached[:2] == key:
+			return(cached[2])
+		digest = hashlib.sha256()
+		with open(filename, 'rb') as readfile:
+			for block in iter(lambda: readfile.read(HASH_BLOCK), b''):
+				digest.update(block)
+		self.state['files'][filename] = key + [digest.hexdigest()]
+		return(digest.hexdigest())
+
+	def _fingerprint(self, stage):
+		'''
+		Hash the inputs, outputs, and parameters of a stage
+		'''
+		return({'inputs': {f: self._hash_file(f) for f in stage.inputs},
+				'outputs': {f: self._hash_file(f) for f in stage.outputs},
+				'params': json.loads(json.dumps(stage.params, sort_keys = True))})
+
+	def is_current(self, stage):
+		'''
+		:return: True iff the stage finished previously, and none of its
+			inputs, outputs, or parameters have changed since
+		'''
+		recorded = self.state['stages'].get(stage.name)
+		if recorded is None:
+			return False
+		fingerprint = self._fingerprint(stage)
+		if None in fingerprint['outputs'].values():
+			return False
+		return(fingerprint == recorded)
+
+	def mark_current(self, names):
+		'''
+		Record the named stages as current, without running them.  Used when
+		files are updated outside of the pipeline (eg, by `refresh`).
+		'''
+		for stage in self.stages:
+			if stage.name in names:
+				self.state['stages'][stage.name] = self._fingerprint(stage)
+		json_writef(self.state, self.state_file)
+		return True
+
+	def _upstream(self, targets):
+		'''
+		:return: Names of the target stages and every stage they depend on
+		'''
+		producer = {f: stage for stage in self.stages for f in stage.outputs}
+		needed = set()
+		pending = [stage for stage in self.stages if stage.name in targets]
+		while pending:
+			stage = pending.pop()
+			if stage.name in needed:
+				continue
+			needed.add(stage.name)
+			pending += [producer[f] for f in stage.inputs if f in producer]
+		return(needed)
+
+	def run(self, targets = None, force = []):
+		'''
+		Run the pipeline
+
+		:param targets: Names of the stages to bring up to date, along with
+			their upstream stages; by default, every stage
+		:param force: Names of stages to run even if they are current
+
+		:return: True iff every stage is up to date at the end of the run
+		'''
+		if targets is None:
+			needed = {stage.name for stage in self.stages}
+		else:
+			needed = self._upstream(targets)
+		for stage in self.stages:
+			if stage.name not in needed:
+				continue
+			if stage.name not in force and self.is_current(stage):
+				print('Stage ' + stage.name + ' is up to date; skipping')
+				continue
+			missing = [f for f in stage.inputs if not os.access(f, os.R_OK)]
+			if missing != []:
+				raise PipelineError('Stage ' + stage.name +
+									' is missing inputs: ' + ', '.join(missing))
+			print('Running stage ' + stage.name)
+			# Forget the old record, in case the stage fails partway through
+			self.state['stages'].pop(stage.name, None)
+			json_writef(self.state, self.state_file)
+			try:
+				with metrics.stage(stage.name, profile = self.profile):
+					finished = stage.run(**stage.params)
+			finally:
+				metrics.write()
+			if finished is False:
+				print('Stage ' + stage.name + ' is not finished; ' +
+						'run the pipeline again to continue')
+				return False
+			missing = [f for f in stage.outputs if not os.access(f, os.R_OK)]
+			if missing != []:
+				raise PipelineError('Stage ' + stage.name +
+									' did not write: ' + ', '.join(missing))
+			self.state['stages'][stage.name] = self._fingerprint(stage)
+			json_writef(self.state, self.state_file)
+		print('Finished with all stages')
+		return True
@@ -1,8 +1,7 @@
-import graph_tool.all as gt
-import pandas as pd
 import random
 
 from api_key import RNG_SEED
+import export
 
 
 def rotate(numstring):
@@ -21,6 +20,9 @@ def rotate(numstring):
 										for ch in list(numstring)])
 	return(nums)
 
+metadata_infile = 'combined_metadata.collapsed.csv'
+net_infile = 'coauth_net.collapsed.gt'
+
 metadata_file = 'combined_metadata.csv'
 net_gt_file = 'coauth_net.gt'
 net_graphml_file = 'coauth_net.graphml'
@@ -28,47 +30,51 @@ net_graphml_file = 'coauth_net.graphml'
 pii_outfile = 'pii.csv'
 
 
-## ----------
-## Sanitize the metadata spreadsheet
-data = pd.read_csv(metadata_file)
+def sanitize(metadata_infile = metadata_infile, net_infile = net_infile):
+	'''
+	Replace the PII in the collapsed metadata and network with rotated SIDs, 
+	writing the PII to `pii_outfile`
+	'''
+	import graph_tool.all as gt
+	import pandas as pd
+	## ----------
+	## Sanitize the metadata spreadsheet
+	data = pd.read_csv(metadata_infile)
+
+	## Set a seed and rotate the author SIDs
+	random.seed(RNG_SEED)
+	print(data['sid'])
+	data['sidr'] = data['sid'].apply(rotate)
+	#print(data['sidr'])
 
-## Set a seed and rotate the author SIDs
-random.seed(RNG_SEED)
-print(data['sid'])
-data['sidr'] = data['sid'].apply(rotate)
-#print(data['sidr'])
+	## Separate the personally identifiable information
+	## Rotated SID allows us to reconnect PII to publicizable data later
+	pii_data = data[['given', 'surname', 'sid', 'sidr']]
+	pii_data.to_csv(pii_outfile)
+	#print(pii_data)
 
-## Separate the personally identifiable information
-## Rotated SID allows us to reconnect PII to publicizable data later
-pii_data = data[['given', 'surname', 'sid', 'sidr']]
-pii_data.to_csv(pii_outfile)
-#print(pii_data)
+	## Remove the PII from the publicizable data
+	del data['given']
+	del data['surname']
+	del data['sid']
+	data.to_csv(metadata_file)
 
-## Remove the PII from the publicizable data
-del data['given']
-del data['surname']
-del data['sid']
-data.to_csv(metadata_file)
+	## ----------
+	## Sanitize the graph files 
 
-## ----------
-## Sanitize the graph files 
+	net = gt.load_graph(net_infile)
+	#print(net.vertex_properties.keys())
+	#print([net.vp['sid'][v] for v in net.vertices()[1:10]])
+	net.vp['sidr'] = net.new_vp('string', vals = data['sidr'])
+	del net.vp['surname']
+	del net.vp['given']
+	del net.vp['sid']
+	#print(net.vertex_properties.keys())
+	## Both files are written at once; 'areas' is a Python list and not 
+	##  graphml standard, so `export` leaves it out of the graphml file
+	export.save(net, [net_gt_file, net_graphml_file])
+	return True
 
-gt_net = gt.load_graph(net_gt_file)
-#print(gt_net.vertex_properties.keys())
-#print([gt_net.vp['sid'][v] for v in gt_net.vertices()[1:10]])
-gt_net.vp['sidr'] = gt_net.new_vp('string', vals = data['sidr'])
-del gt_net.vp['surname']
-del gt_net.vp['given']
-del gt_net.vp['sid']
-#print(gt_net.vertex_properties.keys())
-gt_net.save(net_gt_file)
 
-gml_net = gt.load_graph(net_graphml_file)
-#print(gml_net.vertex_properties.keys())
-#print([gml_net.vp['sid'][v] for v in gml_net.vertices()[1:10]])
-gml_net.vp['sidr'] = gml_net.new_vp('string', vals = data['sidr'])
-del gml_net.vp['surname']
-del gml_net.vp['given']
-del gml_net.vp['sid']
-#print(gml_net.vertex_properties.keys())
-gml_net.save(net_graphml_file)
+if __name__ == '__main__':
+	sanitize()
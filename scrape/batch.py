@@ -4,14 +4,31 @@ This module allows us to break the process of retrieving metadata using `scrape`
 across several batch sessions.  The retrieval function is abstracted
 as the `retrieve` parameter in `run_batch`, and retrieved data are saved 
 periodically for some basic error handling.  
+
+Retrieved data are appended to the output file as json lines, so saving them 
+doesn't require reading or rewriting the data retrieved earlier.  Use 
+`iter_batch` to read them back without loading them all at once.  
+
+With `workers` > 1, `run_batch` retrieves several items at once on a pool of 
+threads; the data are still saved in the order of the items.  `scrape` 
+limits the number of requests actually in flight.  
+
+Each function takes the batch folder as `folder`, so that a separate batch 
+(eg, a `refresh` of a finished crawl) doesn't disturb one in progress.  
 '''
 
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+if __name__ == '__main__':
+	# Find the modules in the repository root when run as a script
+	sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from json_rw import *
+import metrics
 
 BATCH_FOLDER = 'batch'			# Folder, in cwd, to store batch data
 BATCH_FILENAME = 'batch.json'	# File that holds the list of items to be retrieved
-OUTPUT_FILENAME = 'data.json'
+OUTPUT_FILENAME = 'data.jsonl'
 								# File that holds the retrieved data
 MAX_RUN_LEN = 1000				# Maximum number of items to retrieve w/ each run
 
@@ -20,33 +37,48 @@ class BatchError(Exception):
 	pass
 
 
-def exists_batch():
+def exists_batch(folder = BATCH_FOLDER):
 	'''
 	Test for an active (incomplete) batch
 	
+	:param folder: The batch folder
+	
 	:return: True iff a batch file exists in the batch folder
 	'''
-	return(os.access(BATCH_FOLDER + '/' + BATCH_FILENAME, os.F_OK))
+	return(os.access(folder + '/' + BATCH_FILENAME, os.F_OK))
+
+
+def finished_batch(folder = BATCH_FOLDER):
+	'''
+	Test for a finished batch whose output hasn't been retrieved and cleaned
+	
+	:param folder: The batch folder
+	
+	:return: True iff there is an output file but no batch file
+	'''
+	return(not exists_batch(folder) and 
+			os.access(folder + '/' + OUTPUT_FILENAME, os.F_OK))
 
 
-def set_batch(item_list):
+def set_batch(item_list, folder = BATCH_FOLDER):
 	'''
 	Set up a new batch.  
 	
 	:param list: List of items to retrieve
+	:param folder: The batch folder
 	
 	:return: True if the batch was set up correctly
 	'''
 	# Check whether the batch folder exists and we have write access
-	if not os.access(BATCH_FOLDER, os.F_OK):
-		os.mkdir(BATCH_FOLDER)
-	if not os.access(BATCH_FOLDER, os.W_OK): 
+	if not os.access(folder, os.F_OK):
+		os.mkdir(folder)
+	if not os.access(folder, os.W_OK): 
 		raise BatchError('No permission to write to batch folder')
 		
 	# Save the current working directory, to restore it later
 	original_wd = os.getcwd()
 	# Move down into the batch folder
-	os.chdir(BATCH_FOLDER)
+	os.chdir(folder)
 		
 	# Check that we're not overwriting anything
 	if os.access(BATCH_FILENAME, os.F_OK):
@@ -56,44 +88,43 @@ def set_batch(item_list):
 
 	# Write the list of items into the batch file
 	json_writef(item_list, BATCH_FILENAME)
-	# Write an empty list into the data file
-	json_writef([], OUTPUT_FILENAME)
+	# Start an empty data file
+	open(OUTPUT_FILENAME, 'w').close()
 	
 	# Reset the working directory and return that everything went okay
 	os.chdir(original_wd)
 	return True
 
 
-def run_batch(retrieve):
+def run_batch(retrieve, workers = 1, folder = BATCH_FOLDER):
 	'''
 	Run a session of the batch. 
 	
 	:param retrieve: The function used to retrieve the data
+	:param workers: Number of items to retrieve at once
+	:param folder: The batch folder
 	
 	:return: True iff we reached the end of the run without errors
 	'''
 	# Check whether the batch folder exists and we have write access
-	if not os.access(BATCH_FOLDER, os.F_OK):
+	if not os.access(folder, os.F_OK):
 		raise BatchError('Batch folder does not exist')
-	if not os.access(BATCH_FOLDER, os.W_OK): 
+	if not os.access(folder, os.W_OK): 
 		raise BatchError('No permission to write to batch folder')
 	# Check whether there's an active batch
-	if not exists_batch():
+	if not exists_batch(folder):
 		raise BatchError('No active batch')
 	
 	# Save the current working directory, to restore it later
 	original_wd = os.getcwd()
 	# Move down into the batch folder
-	os.chdir(BATCH_FOLDER)
+	os.chdir(folder)
 	
 	# Read the item and data lists
 	item_list = json_readf(BATCH_FILENAME)
 	if type(item_list) is not list:
 		# item_list should be a list of DOIs or other ID numbers
 		raise BatchError('Batch file does not read as list') 
-	data = json_readf(OUTPUT_FILENAME)
-	# Make a backup of the data file
-	json_writef(data, OUTPUT_FILENAME + '.bak')
 
 	print('Total items to retrieve: ' + str(len(item_list)))
 		
@@ -101,17 +132,30 @@ def run_batch(retrieve):
 	this_run = item_list[:MAX_RUN_LEN]
 	print('Items to retrieve on this run: ' + str(len(this_run)))
 	
+	def retrieve_item(item):
+		# Skip empty items
+		if item == '':
+			return(None)
+		new_data = retrieve(item)
+		metrics.inc('batch_items_total')
+		return(new_data)
+	pool = None
+	if workers > 1:
+		pool = ThreadPoolExecutor(workers)
+		# Results come back in the order of the items
+		results = pool.map(retrieve_item, this_run)
+	else:
+		results = map(retrieve_item, this_run)
+	
 	try:
 		temp_data = []					# Temp container for the retrieved data
 		retrieved = []					# List of items successfully retrieved on this run
-		for item in this_run:
+		for item, new_data in zip(this_run, results):
 			# Skip empty items
-			if item == '':
+			if new_data is None:
 				print('Skipped empty item')
 				retrieved += [item]
 				continue
-			# Retrieve the data for the item
-			new_data = retrieve(item)
 			# The retrieve functions in scrape return empty metadata if 
 			#  the server returns a `Resource not found` error
 			if new_data == []:
@@ -123,32 +167,33 @@ def run_batch(retrieve):
 			if len(retrieved) % 100 == 0:
 				print(len(retrieved))
 			if len(retrieved) >= 1000:
-				# Add temp_data to data
-				data += temp_data
-				# Write to the disk
-				json_writef(data, OUTPUT_FILENAME)
-				# Remove retrieved items from item_list
-				item_list = [item for item in item_list if item not in retrieved]
-				json_writef(item_list, BATCH_FILENAME)
+				with metrics.timer('batch_checkpoint_seconds'):
+					# Add temp_data to the data on the disk
+					append_jsonl(temp_data, OUTPUT_FILENAME)
+					# Remove retrieved items from item_list
+					item_list = [item for item in item_list if item not in retrieved]
+					json_writef(item_list, BATCH_FILENAME)
 				print('Saved retrieved data')
 				print('Continuing batch run')
 				temp_data = []
 				retrieved = []
 	finally:
+		if pool is not None:
+			# Items retrieved after an error are retrieved again next run
+			pool.shutdown(wait = True, cancel_futures = True)
 		# In case of error: 
-		# Add temp_data to data
-		data += temp_data
-		# Write to the disk
-		json_writef(data, OUTPUT_FILENAME)
-		# Remove retrieved items from item_list
-		item_list = [item for item in item_list if item not in retrieved]
-		json_writef(item_list, BATCH_FILENAME)
-		
-		# For the item list, check whether the list is empty
-		if item_list != []:
+		with metrics.timer('batch_checkpoint_seconds'):
+			# Add temp_data to the data on the disk
+			append_jsonl(temp_data, OUTPUT_FILENAME)
+			# Remove retrieved items from item_list
+			item_list = [item for item in item_list if item not in retrieved]
 			json_writef(item_list, BATCH_FILENAME)
-		else:
-			os.remove(BATCH_FILENAME)
+			
+			# For the item list, check whether the list is empty
+			if item_list != []:
+				json_writef(item_list, BATCH_FILENAME)
+			else:
+				os.remove(BATCH_FILENAME)
 		print('Saved retrieved data')
 		# Reset the working directory
 		os.chdir(original_wd)
@@ -158,27 +203,34 @@ def run_batch(retrieve):
 	return True
 
 	
-def retrieve_batch():
+def iter_batch(folder = BATCH_FOLDER):
+	'''
+	Iterate over the retrieved data in the output file from the batch folder, 
+	without loading them all into memory. 
+	'''
+	if exists_batch(folder):
+		BatchError('Current batch is not finished')
+	return(iter_jsonl(folder + '/' + OUTPUT_FILENAME))
+
+
+def retrieve_batch(folder = BATCH_FOLDER):
 	'''
 	Abstraction for reading the output file from the batch folder. 
 	
 	:return: The retrieved data
 	'''
-	if exists_batch():
-		BatchError('Current batch is not finished')
-	data = json_readf(BATCH_FOLDER + '/' + OUTPUT_FILENAME)
-	return(data)
+	return(list(iter_batch(folder)))
 
 	
-def clean_batch():
+def clean_batch(folder = BATCH_FOLDER):
 	'''
 	Abstraction for removing the output file from the batch folder. 
 	
 	:return: True iff remove completed without error
 	'''
-	if exists_batch():
+	if exists_batch(folder):
 		BatchError('Current batch is not finished')
-	os.remove(BATCH_FOLDER + '/' + OUTPUT_FILENAME)
+	os.remove(folder + '/' + OUTPUT_FILENAME)
 	return True
 
 
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+'''
+This module defines an adaptive limit on the number of Scopus requests in
+flight at once.  The capacity of the API varies through the day, so rather
+than a fixed setting, the limit is tuned while the crawl runs, by additive
+increase and multiplicative decrease (AIMD), as in TCP congestion control:
+
+	- after each window of successful requests, the limit goes up by
+		`increase`, if the limit was reached during the window and the
+		latency looks normal
+	- it's multiplied by `decrease` after a rate-limited (`429`) response,
+		a timeout, or a window whose `quantile` latency is more than
+		`tolerance` times the baseline latency
+
+The baseline is the lowest `quantile` latency seen in a window, allowed to
+drift up slowly, so that a slower API (eg, at a busy time of day) doesn't
+count as congestion forever.  A decrease is made at most once for the
+requests in flight when it happens, so that a burst of `429`s from the same
+overload halves the limit once rather than many times.
+
+Each change is printed, counted in `metrics` (`fetch_concurrency_changes_total`,
+by `action` and `reason`), and the limit is kept in the gauge
+`fetch_concurrency_limit`.  The changes are also kept in `history`.
+
+	limiter = AimdLimiter(maximum = 8)
+	ticket = limiter.acquire()		# Blocks while the limit is reached
+	...
+	limiter.release(ticket, 'ok', latency)
+'''
+
+import collections
+import threading
+import time
+import metrics
+
+MAX_LIMIT = 8			# Default maximum number of requests in flight
+WINDOW = 20				# Successful requests between decisions to increase
+QUANTILE = 0.9			# Latency quantile compared with the baseline
+TOLERANCE = 2.0			# Latency over this multiple of the baseline is congestion
+BASELINE_DRIFT = 0.05	# Share the baseline can rise after each window
+HISTORY_LEN = 1000		# Changes to keep in `history`
+
+# Outcomes of a request, for `release`
+OK = 'ok'
+THROTTLED = 'throttled'		# A `429` for the rate limit
+TIMEOUT = 'timeout'
+ERROR = 'error'				# Anything else; doesn't change the limit
+
+
+def quantile(values, q):
+	'''
+	The `q` quantile of a non-empty list, by the nearest rank
+	'''
+	values = sorted(values)
+	return(values[min(len(values) - 1, int(q * len(values)))])
+
+
+class AimdLimiter:
+	'''
+	Thread-safe AIMD limit on the number of requests in flight
+
+	:param initial: Starting limit
+	:param minimum: Lowest limit
+	:param maximum: Highest limit
+	:param increase: Amount to add to the limit after a good window
+	:param decrease: Factor to multiply the limit by on congestion
+	:param window: Successful requests between decisions to increase
+	:param quantile: Latency quantile compared with the baseline
+	:param tolerance: Multiple of the baseline latency counted as congestion
+	:param name: Label for the metrics
+	'''
+	def __init__(self, initial = 1, minimum = 1, maximum = MAX_LIMIT,
+					increase = 1, decrease = 0.5, window = WINDOW,
+					quantile = QUANTILE, tolerance = TOLERANCE,
+					name = 'scopus'):
+		self.limit = float(min(max(initial, minimum), maximum))
+		self.minimum = minimum
+		self.maximum = maximum
+		self.increase = increase
+		self.decrease = decrease
+		self.window = window
+		self.quantile = quantile
+		self.tolerance = tolerance
+		self.name = name
+		self.in_flight = 0
+		self.baseline = None
+		self.history = collections.deque(maxlen = HISTORY_LEN)
+		self._latencies = []
+		self._saturated = False		# Whether the limit was reached this window
+		self._started = 0			# Tickets handed out
+		self._protected = 0			# Tickets up to this don't cause a decrease
+		self._cond = threading.Condition()
+		metrics.gauge('fetch_concurrency_limit', int(self.limit), limiter = name)
+
+	def acquire(self):
+		'''
+		Wait for a free slot under the limit
+
+		:return: Ticket to pass to `release`
+		'''
+		with self._cond:
+			while self.in_flight >= int(self.limit):
+				self._cond.wait()
+			self.in_flight += 1
+			if self.in_flight >= int(self.limit):
+				self._saturated = True
+			self._started += 1
+			return(self._started)
+
+	def release(self, ticket, outcome, latency = None):
+		'''
+		Free a slot, and adjust the limit for the outcome of the request
+
+		:param ticket: Ticket from `acquire`
+		:param outcome: `OK`, `THROTTLED`, `TIMEOUT`, or `ERROR`
+		:param latency: Latency of a successful request, in seconds
+		'''
+		with self._cond:
+			self.in_flight -= 1
+			if outcome in (THROTTLED, TIMEOUT):
+				if ticket > self._protected:
+					self._decrease(outcome)
+			elif outcome == OK and latency is not None:
+				self._latencies.append(latency)
+				if len(self._latencies) >= max(self.window, int(self.limit)):
+					self._decide()
+			self._cond.notify_all()
+
+	def at_minimum(self):
+		'''
+		:return: True iff the limit can't go any lower
+		'''
+		return(self.limit <= self.minimum)
+
+	def _decide(self):
+		'''
+		End a window of successful requests
+		'''
+		high = quantile(self._latencies, self.quantile)
+		saturated = self._saturated
+		self._latencies = []
+		self._saturated = self.in_flight >= int(self.limit)
+		if self.baseline is None:
+			self.baseline = high
+		else:
+			self.baseline = min(high, self.baseline * (1 + BASELINE_DRIFT))
+		metrics.gauge('fetch_latency_baseline_seconds', self.baseline,
+					limiter = self.name)
+		if high > self.tolerance * self.baseline:
+			if self._started > self._protected:
+				self._decrease('latency')
+		elif saturated and self.limit < self.maximum:
+			self._change(min(self.maximum, self.limit + self.increase),
+							'increase', 'window')
+
+	def _decrease(self, reason):
+		# Requests already in flight saw the same congestion
+		self._protected = self._started
+		self._latencies = []
+		if self.limit > self.minimum:
+			self._change(max(self.minimum, self.limit * self.decrease),
+							'decrease', reason)
+
+	def _change(self, limit, action, reason):
+		old = int(self.limit)
+		self.limit = limit
+		self.history.append({'time': time.time(), 'limit': int(limit),
+								'action': action, 'reason': reason})
+		metrics.inc('fetch_concurrency_changes_total', limiter = self.name,
+					action = action, reason = reason)
+		metrics.gauge('fetch_concurrency_limit', int(limit), limiter = self.name)
+		if int(limit) != old:
+			print('Concurrency limit ' + str(old) + ' -> ' + str(int(limit)) +
+					' (' + reason + ')')
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+'''
+This module defines a pool of Scopus API keys.  Scopus reports the remaining
+quota for a key in the headers of each response:
+	- `X-RateLimit-Limit`: total number of requests allowed in the period
+	- `X-RateLimit-Remaining`: requests remaining in the period
+	- `X-RateLimit-Reset`: when the quota resets, in seconds since the epoch
+The pool records these for each key, and routes each request to the key with
+the most remaining quota.  Keys that run out (or receive a `429 Too Many
+Requests` response with `X-ELS-Status: QUOTA_EXCEEDED`) are parked until their
+reset time.
+'''
+
+import threading
+import time
+
+DEFAULT_QUOTA = 20000	# Assumed quota for a key before we hear from Scopus
+PARK_DELAY = 60*60		# Seconds to park a key when Scopus gives no reset time
+
+
+class CredentialError(Exception):
+	pass
+
+
+class CredentialPool:
+	'''
+	A thread-safe pool of API keys with per-key quota accounting
+
+	:param keys: List of API key strings
+	:param default_quota: Remaining quota to assume for a key until a
+		response reports the actual value
+	'''
+	def __init__(self, keys, default_quota = DEFAULT_QUOTA):
+		if len(keys) == 0:
+			raise CredentialError('No API keys given')
+		self.default_quota = default_quota
+		# `reported` is False while `remaining` is only the assumed quota
+		self.keys = {key: {'remaining': default_quota, 'reset': 0,
+							'parked': False, 'requests': 0, 'reported': False}
+						for key in keys}
+		self._lock = threading.Lock()
+
+	def _unpark(self, now):
+		for state in self.keys.values():
+			if state['parked'] and state['reset'] <= now:
+				state['parked'] = False
+				state['remaining'] = self.default_quota
+				state['reported'] = False
+
+	def choose(self):
+		'''
+		Pick the key with the most remaining quota.  The remaining quota is
+		decremented right away, so that concurrent requests spread across
+		the keys.
+
+		:return: An API key
+		'''
+		with self._lock:
+			self._unpark(time.time())
+			active = {key: state for key, state in self.keys.items()
+						if not state['parked']}
+			if active == {}:
+				raise CredentialError('All API keys are exhausted until ' +
+					time.strftime('%c', time.localtime(self.next_reset())))
+			key = max(active, key = lambda k: active[k]['remaining'])
+			active[key]['remaining'] -= 1
+			active[key]['requests'] += 1
+			return(key)
+
+	def update(self, key, headers, status_code = 200):
+		'''
+		Record the quota information from a response
+
+		:param key: The key used for the request
+		:param headers: The response headers (any mapping)
+		:param status_code: HTTP status code of the response
+		'''
+		with self._lock:
+			state = self.keys[key]
+			if 'X-RateLimit-Remaining' in headers:
+				state['remaining'] = int(headers['X-RateLimit-Remaining'])
+				state['reported'] = True
+			if 'X-RateLimit-Reset' in headers:
+				state['reset'] = float(headers['X-RateLimit-Reset'])
+			# A `429` can also mean the key is over the per-second rate limit; 
+			#  only park keys whose quota is used up
+			exhausted = state['remaining'] <= 0 or \
+				'QUOTA_EXCEEDED' in headers.get('X-ELS-Status', '')
+			if exhausted:
+				if state['reset'] <= time.time():
+					state['reset'] = time.time() + PARK_DELAY
+				if not state['parked']:
+					print('API key ending ' + key[-4:] + ' is exhausted; ' +
+						'parked until ' +
+						time.strftime('%c', time.localtime(state['reset'])))
+				state['parked'] = True
+		return True
+
+	def next_reset(self):
+		'''
+		:return: Earliest reset time of the parked keys, in seconds since
+			the epoch, or 0 if no keys are parked
+		'''
+		resets = [state['reset'] for state in self.keys.values()
+					if state['parked']]
+		if resets == []:
+			return(0)
+		return(min(resets))
+
+	def status(self):
+		'''
+		:return: Dict with the quota state of each key, labelled by its 
+			position in the pool and its last four characters, eg, 
+			`'1:...abcd'`, so that keys with the same ending stay apart
+		'''
+		with self._lock:
+			return({str(i + 1) + ':...' + key[-4:]: dict(state)
+						for i, (key, state) in enumerate(self.keys.items())})
+
+
+if __name__ == '__main__':
+	# A little test, against the local stand-in server with per-key quotas
+	import urllib.error
+	import urllib.request
+	from fake_scopus import SyntheticNetwork, serve
+	
+	server = serve(SyntheticNetwork(100), {'key-aaaa': 5, 'key-bbbb': 10})
+	root = 'http://localhost:' + str(server.server_port) + '/content/'
+	pool = CredentialPool(['key-aaaa', 'key-bbbb'])
+	served = 0
+	try:
+		while True:
+			key = pool.choose()
+			request = urllib.request.Request(
+				root + 'search/author?co-author=' + str(10**10 + served % 100), 
+				headers = {'X-ELS-APIKey': key})
+			try:
+				with urllib.request.urlopen(request) as response:
+					pool.update(key, response.headers, response.status)
+					served += 1
+			except urllib.error.HTTPError as error:
+				pool.update(key, error.headers, error.code)
+	except CredentialError as error:
+		print(error)
+	print(str(served) + ' requests served')
+	print(pool.status())
+	server.shutdown()
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+'''
+This module builds the filtered coauthor network of step 2a from coauthor
+pair files too large to hold in memory.  Rather than a dict of SIDs and a
+graph of every pair, it works on integer arrays on disk:
+
+	1. Spill:  the pairs are read one at a time, as SIDs converted to int64
+		and ordered within each pair, into fixed-size chunks, which are
+		sorted, deduplicated, and saved as `.npy` files
+	2. Merge:  the chunks are merged a block at a time, dropping
+		duplicates, into a single sorted edge list on disk; each round
+		writes out every pair up to the smallest of the blocks' last pairs
+	3. Filter:  the authors within `max_dist` of generation 1 are found by
+		scanning the edge list in blocks, once for each step of distance;
+		the authors found are spilled to sorted runs on disk and merged
+		the same way
+	4. Build:  the edges between the kept authors are streamed into the
+		graph in blocks, with `Graph.add_edge_list`
+
+Memory use is set by `chunk_pairs` and `block_pairs`, plus the kept authors,
+which the final network holds anyway.  The result matches the in-memory
+path in `run_scrape.step_2a`, except that the vertices are in order of SID
+rather than order of appearance.  SIDs must be numeric, as Scopus's are.
+'''
+
+import os
+import tempfile
+import numpy as np
+from json_rw import *
+
+SPILL_PAIRS = 2**22		# Pairs per sorted chunk; 64 MB as int64
+BLOCK_PAIRS = 2**20		# Pairs per block when merging or scanning
+
+
+def _sort_unique(pairs):
+	'''
+	Sort an `(n, 2)` array of pairs, and drop repeated pairs; a 1-d array 
+	of values is sorted and deduplicated the same way
+	'''
+	if pairs.ndim == 1:
+		return(np.unique(pairs))
+	pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+	if len(pairs) > 1:
+		repeated = np.all(pairs[1:] == pairs[:-1], axis = 1)
+		pairs = pairs[np.concatenate([[True], ~repeated])]
+	return(pairs)
+
+
+def spill_pairs(pair_files, folder, chunk_pairs = SPILL_PAIRS):
+	'''
+	Read the coauthor pairs into sorted, deduplicated chunks on disk
+
+	:param pair_files: Pair files; the queried authors in the first one
+		are generation 1
+	:param folder: Folder to write the chunks to
+	:return: List of chunk files, sorted array of generation 1 SIDs, and the
+		number of pairs read
+	'''
+	chunks = []
+	buffer = np.empty((chunk_pairs, 2), dtype = np.int64)
+	filled = 0
+	n_pairs = 0
+	gen_1_sids = set()
+	def spill(filled):
+		chunk_file = os.path.join(folder, 'chunk_' + str(len(chunks)) + '.npy')
+		np.save(chunk_file, _sort_unique(buffer[:filled]))
+		chunks.append(chunk_file)
+	for i, pair_file in enumerate(pair_files):
+		for [auth1, auth2] in iter_json_array(pair_file):
+			auth1 = int(auth1)
+			auth2 = int(auth2)
+			if i == 0:
+				gen_1_sids.add(auth1)
+			buffer[filled] = (auth1, auth2) if auth1 <= auth2 else (auth2, auth1)
+			filled += 1
+			n_pairs += 1
+			if filled == chunk_pairs:
+				spill(filled)
+				filled = 0
+	if filled > 0:
+		spill(filled)
+	return(chunks, np.array(sorted(gen_1_sids), dtype = np.int64), n_pairs)
+
+
+def _count_upto(block, item):
+	'''
+	Number of items in the sorted `block` (of values, or of pairs) that are
+	no greater than `item`
+	'''
+	if block.ndim == 1:
+		return(np.searchsorted(block, item, 'right'))
+	start = np.searchsorted(block[:, 0], item[0], 'left')
+	end = np.searchsorted(block[:, 0], item[0], 'right')
+	return(start + np.searchsorted(block[start:end, 1], item[1], 'right'))
+
+
+def _merged_blocks(runs, block_pairs = BLOCK_PAIRS):
+	'''
+	Merge sorted arrays without repeats, of values or of pairs, reading each
+	a block at a time.  Each round takes every item up to the smallest of
+	the blocks' last items, since no later block can hold an item before it.
+
+	:param runs: Sorted arrays (or memory maps) without repeats
+	:param block_pairs: Items to hold for all of the runs together
+	:return: Generator of sorted blocks, without repeats within or between
+		them
+	'''
+	run_block = max(block_pairs // max(len(runs), 1), 1)
+	offsets = [0] * len(runs)
+	blocks = [run[:0] for run in runs]
+	while True:
+		for i, run in enumerate(runs):
+			if len(blocks[i]) == 0 and offsets[i] < len(run):
+				blocks[i] = np.asarray(run[offsets[i]:offsets[i] + run_block])
+				offsets[i] += len(blocks[i])
+		lasts = [block[-1] for block in blocks if len(block) > 0]
+		if lasts == []:
+			return
+		cutoff = min(lasts, key = lambda last: np.atleast_1d(last).tolist())
+		ready = []
+		for i, block in enumerate(blocks):
+			n = _count_upto(block, cutoff)
+			ready.append(block[:n])
+			blocks[i] = block[n:]
+		yield _sort_unique(np.concatenate(ready))
+
+
+def merge_chunks(chunks, outfile, block_pairs = BLOCK_PAIRS):
+	'''
+	Merge the sorted chunks into one sorted edge list without repeats, saved
+	as raw int64 pairs
+
+	:return: The edge list, as a read-only memory map of shape `(n, 2)`
+	'''
+	n_edges = 0
+	with open(outfile, 'wb') as writefile:
+		for block in _merged_blocks([np.load(chunk, mmap_mode = 'r')
+										for chunk in chunks], block_pairs):
+			block.tofile(writefile)
+			n_edges += len(block)
+	if n_edges == 0:
+		return(np.empty((0, 2), dtype = np.int64))
+	return(np.memmap(outfile, dtype = np.int64, mode = 'r',
+						shape = (n_edges, 2)))
+
+
+def _union(arrays, folder, block_pairs = BLOCK_PAIRS, spill_size = SPILL_PAIRS):
+	'''
+	The sorted, unique values in an iterable of int64 arrays.  The arrays
+	are collected into sorted runs of about `spill_size` values, saved in
+	`folder`, and merged, so only the result and one run are held at once.
+	'''
+	runs = []
+	pending = []
+	filled = 0
+	for array in arrays:
+		pending.append(array)
+		filled += len(array)
+		if filled >= spill_size:
+			run_file = os.path.join(folder, 'run_' + str(len(runs)) + '.npy')
+			np.save(run_file, np.unique(np.concatenate(pending)))
+			runs.append(run_file)
+			pending = []
+			filled = 0
+	last = np.unique(np.concatenate(pending + [np.empty(0, np.int64)]))
+	if runs == []:
+		return(last)
+	merged = np.concatenate(list(_merged_blocks(
+				[np.load(run_file, mmap_mode = 'r') for run_file in runs] +
+				[last], block_pairs)))
+	for run_file in runs:
+		os.remove(run_file)
+	return(merged)
+
+
+def _member(values, sorted_set):
+	'''
+	Vectorized test for membership of `values` in the sorted array
+	`sorted_set`; like `np.isin`, but without sorting `sorted_set` again
+	'''
+	if len(sorted_set) == 0:
+		return(np.zeros(len(values), dtype = bool))
+	index = np.searchsorted(sorted_set, values)
+	index[index == len(sorted_set)] = 0
+	return(sorted_set[index] == values)
+
+
+def distance_filter(edges, seeds, max_dist, folder,
+					block_pairs = BLOCK_PAIRS, spill_size = SPILL_PAIRS):
+	'''
+	The authors within `max_dist` of `seeds`, as in
+	`graph_tool.infect_vertex_property`, scanning `edges` in blocks
+
+	:param edges: Edge list of SIDs, shape `(n, 2)`
+	:param seeds: Sorted array of SIDs; only those that appear in `edges`
+		are kept
+	:param folder: Folder to spill the authors found to
+	:return: Sorted array of the kept SIDs
+	'''
+	def blocks():
+		for start in range(0, len(edges), block_pairs):
+			yield np.asarray(edges[start:start + block_pairs])
+	def present():
+		for block in blocks():
+			yield block[_member(block[:, 0], seeds), 0]
+			yield block[_member(block[:, 1], seeds), 1]
+	def neighbors(keep):
+		yield keep
+		for block in blocks():
+			yield block[_member(block[:, 0], keep), 1]
+			yield block[_member(block[:, 1], keep), 0]
+	keep = _union(present(), folder, block_pairs, spill_size)
+	for i in range(max_dist):
+		keep = _union(neighbors(keep), folder, block_pairs, spill_size)
+	return(keep)
+
+
+def filtered_network(pair_files, max_dist, chunk_pairs = SPILL_PAIRS,
+						block_pairs = BLOCK_PAIRS):
+	'''
+	Build the coauthor network from the pair files, keeping only the authors
+	within `max_dist` of generation 1
+
+	:param pair_files: Pair files; the queried authors in the first one are
+		generation 1
+	:return: The filtered `graph_tool.Graph`, with vertex property `sid`
+	'''
+	import graph_tool as gt
+
+	# Work files go in the current folder, next to the data, rather than in
+	#  a possibly small system temp folder
+	with tempfile.TemporaryDirectory(prefix = '.pairs.', dir = '.') as folder:
+		print('Spilling coauthor pairs to sorted chunks')
+		chunks, gen_1_sids, n_pairs = spill_pairs(pair_files, folder,
+													chunk_pairs)
+		print(str(n_pairs) + ' pairs processed, in ' + str(len(chunks)) +
+				' chunks')
+		edges = merge_chunks(chunks, os.path.join(folder, 'edges.bin'),
+								block_pairs)
+		for chunk in chunks:
+			os.remove(chunk)
+		print('Unfiltered edges: ' + str(len(edges)))
+
+		keep = distance_filter(edges, gen_1_sids, max_dist, folder,
+								block_pairs, chunk_pairs)
+		net = gt.Graph(directed = False)
+		net.add_vertex(len(keep))
+		for start in range(0, len(edges), block_pairs):
+			block = np.asarray(edges[start:start + block_pairs])
+			block = block[_member(block[:, 0], keep) &
+							_member(block[:, 1], keep)]
+			net.add_edge_list(np.searchsorted(keep, block))
+		del edges
+	net.vp['sid'] = net.new_vp('string', vals = [str(sid) for sid in keep])
+	print('Filtered nodes: ' + str(net.num_vertices()))
+	print('Filtered edges: ' + str(net.num_edges()))
+	return(net)
@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+'''
+This module defines a local stand-in for the two Scopus API endpoints used by
+`scrape`, for testing without touching the real API:
+	- `search/author?co-author=<sid>`: JSON search results, as parsed by
+		`_parse_coauth_data`
+	- `author/author_id/<sid>`: XML author retrieval, as parsed by
+		`_parse_auth_data`
+The responses describe a synthetic coauthor network, generated
+deterministically from a seed.  Like Scopus, the server requires an API key
+in the `X-ELS-APIKey` header, enforces a quota for each key, and reports the
+quota in the `X-RateLimit-*` headers.  It can also inject latency, server
+errors, and a per-key rate limit (`429` responses with `Retry-After`).
+Request counts are available as JSON at `/stats`.
+
+To test the adaptive concurrency limit in `concurrency.py`, the server's
+capacity can vary over time, with a schedule of `SECONDS:CAPACITY` steps,
+eg, `--capacity 0:8,30:2,60:16`.  At most `CAPACITY` requests are served at
+once; up to as many again wait their turn, which shows up as latency, and
+any more get a `429` right away.  The schedule repeats after
+`--capacity-period` seconds, if given.
+
+To run the server from the command line:
+
+	python fake_scopus.py --authors 1000 --key KEY1:500 --key KEY2:500 \
+		--latency 0.2 --error-rate 0.01 --rate-limit 9
+
+then point `scrape` at it with `SCOPUS_API_ROOT=http://localhost:8000/content/`.
+'''
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+SID_BASE = 10**10		# Synthetic SIDs are SID_BASE + author index
+WINDOW = 200			# Coauthors are drawn from this many neighboring indices
+MAX_COUNT = 200			# Maximum number of search results per response
+
+SURNAMES = ['Smith', 'Garcia', 'Nguyen', 'Müller', 'Mueller', 'Kim', 'Rossi',
+			'Novak', 'Silva', 'Cohen', 'Sato', 'Dubois', 'Kowalski', 'Babić']
+GIVEN = ['A.', 'B.', 'C.', 'D.', 'E.', 'F.', 'G.', 'H.', 'J.', 'K.', 'L.', 'M.']
+COUNTRIES = ['United States', 'United Kingdom', 'Germany', 'China', 'Brazil',
+			'India', 'Japan', 'France', 'Canada', 'Australia']
+AREAS = ['Medicine', 'Biochemistry', 'Ecology', 'Philosophy', 'Physics',
+			'Computer Science', 'Sociology', 'Engineering', 'Economics']
+
+
+def _unit(*values):
+	'''
+	A deterministic pseudo-random number in [0, 1) for the given values
+	'''
+	digest = hashlib.blake2b(repr(values).encode(), digest_size = 8).digest()
+	return(int.from_bytes(digest, 'big') / 2**64)
+
+
+class SyntheticNetwork:
+	'''
+	A synthetic coauthor network over `n_authors` authors.  Authors have a
+	heavy-tailed "activity", and two authors within `WINDOW` of each other
+	are coauthors with a probability proportional to the product of their
+	activities.  Coauthorship is symmetric and is computed on demand, so even
+	large networks take no memory.
+
+	:param n_authors: Number of authors
+	:param mean_degree: Approximate mean number of coauthors
+	:param seed: Seed for the network
+	'''
+	def __init__(self, n_authors, mean_degree = 20, seed = 0):
+		self.n_authors = n_authors
+		self.mean_degree = mean_degree
+		self.seed = seed
+
+	def activity(self, i):
+		# Pareto-distributed, with mean 1 (shape 3, scale 2/3)
+		return((2/3) / (1 - _unit(self.seed, 'activity', i))**(1/3))
+
+	def index(self, sid):
+		'''
+		:return: Author index for `sid`, or None if it's not in the network
+		'''
+		try:
+			i = int(sid) - SID_BASE
+		except ValueError:
+			return(None)
+		if 0 <= i < self.n_authors:
+			return(i)
+		return(None)
+
+	def sid(self, i):
+		return(str(SID_BASE + i))
+
+	def coauthors(self, i):
+		'''
+		:return: List of the author indices of the coauthors of `i`
+		'''
+		found = []
+		scale = self.mean_degree / (2 * WINDOW)
+		for j in range(max(0, i - WINDOW), min(self.n_authors, i + WINDOW + 1)):
+			if j == i:
+				continue
+			p = scale * self.activity(i) * self.activity(j)
+			if _unit(self.seed, 'edge', min(i, j), max(i, j)) < p:
+				found.append(j)
+		return(found)
+
+	def author(self, i):
+		'''
+		:return: Dict of metadata for author `i`
+		'''
+		rng = random.Random(repr((self.seed, 'author', i)))
+		return({'surname': rng.choice(SURNAMES),
+				'given': rng.choice(GIVEN),
+				'docs': int(5 * self.activity(i) * rng.uniform(0.5, 2)),
+				'country': rng.choice(COUNTRIES),
+				'affiliation': 'University ' + str(rng.randrange(500)),
+				'areas': rng.sample(AREAS, rng.randint(1, 3))})
+
+
+def coauth_json(network, i):
+	'''
+	Body of a coauthor search response for author `i`
+	'''
+	if i is None:
+		return(json.dumps({'service-error': {'status': {
+			'statusCode': 'INVALID_INPUT',
+			'statusText': 'Invalid author identifier'}}}))
+	entries = [{'dc:identifier': 'AUTHOR_ID:' + network.sid(j)}
+				for j in network.coauthors(i)[:MAX_COUNT]]
+	if entries == []:
+		return(json.dumps({'service-error': {'status': {
+			'statusCode': 'GENERAL_SYSTEM_ERROR',
+			'statusText': 'There was a search failure'}}}))
+	return(json.dumps({'search-results': {
+		'opensearch:totalResults': str(len(entries)), 'entry': entries}}))
+
+
+def author_xml(network, i):
+	'''
+	Body of an author retrieval response for author `i`
+	'''
+	if i is None:
+		return('<service-error><status><statusCode>INVALID_INPUT</statusCode>'
+				'<statusText>Invalid author identifier</statusText>'
+				'</status></service-error>')
+	meta = network.author(i)
+	areas = ''.join('<subject-area abbrev="' + area[:4].upper() + '">' +
+						escape(area) + '</subject-area>'
+					for area in meta['areas'])
+	return('<author-retrieval-response>'
+		'<coredata><dc:identifier>AUTHOR_ID:' + network.sid(i) +
+		'</dc:identifier><document-count>' + str(meta['docs']) +
+		'</document-count></coredata>'
+		'<subject-areas>' + areas + '</subject-areas>'
+		'<author-profile><preferred-name><surname>' + escape(meta['surname']) +
+		'</surname><given-name>' + escape(meta['given']) +
+		'</given-name></preferred-name>'
+		'<affiliation-current><affiliation><ip-doc><preferred-name>' +
+		escape(meta['affiliation']) + '</preferred-name><address><country>' +
+		escape(meta['country']) + '</country></address></ip-doc>'
+		'</affiliation></affiliation-current></author-profile>'
+		'</author-retrieval-response>')
+
+
+class FakeScopus(ThreadingHTTPServer):
+	'''
+	The stand-in server
+
+	:param address: Tuple of (host, port)
+	:param network: A `SyntheticNetwork`
+	:param quotas: Dict mapping each valid API key to the number of requests
+		it may make per `reset_period` seconds
+	:param latency: Mean response latency, in seconds (lognormal)
+	:param error_rate: Fraction of requests that get a `500` error
+	:param rate_limit: Requests per second allowed for each key; requests
+		over the limit get a `429` response.  None for no limit.
+	:param capacity: Schedule of the number of requests served at once, as
+		a list of `(seconds, capacity)` steps from the start of the server;
+		None for no limit
+	:param capacity_period: Seconds after which the schedule repeats; None
+		to keep the last capacity
+	'''
+	daemon_threads = True
+	request_queue_size = 128
+
+	def __init__(self, address, network, quotas, reset_period = 7*24*60*60,
+					latency = 0, error_rate = 0, rate_limit = None,
+					capacity = None, capacity_period = None):
+		super().__init__(address, _Handler)
+		self.network = network
+		self.quotas = dict(quotas)
+		self.reset_period = reset_period
+		self.latency = latency
+		self.error_rate = error_rate
+		self.rate_limit = rate_limit
+		self.lock = threading.Lock()
+		self.rng = random.Random(network.seed)
+		self.used = {key: 0 for key in quotas}
+		self.reset_at = {key: time.time() + reset_period for key in quotas}
+		self.tokens = {key: (rate_limit or 0, time.time()) for key in quotas}
+		self.requests = 0
+		self.statuses = {}
+		self.capacity = sorted(capacity) if capacity else None
+		self.capacity_period = capacity_period
+		self.started = time.time()
+		self.serving = 0
+		self.waiting = 0
+		self.slots = threading.Condition(self.lock)
+
+	def current_capacity(self, now = None):
+		'''
+		:return: Number of requests served at once, now; None for no limit
+		'''
+		if self.capacity is None:
+			return(None)
+		elapsed = (now or time.time()) - self.started
+		if self.capacity_period:
+			elapsed %= self.capacity_period
+		current = self.capacity[0][1]
+		for start, capacity in self.capacity:
+			if elapsed >= start:
+				current = capacity
+		return(current)
+
+	def admit(self):
+		'''
+		Wait for a free serving slot under the current capacity
+
+		:return: True iff the request was admitted; if so, `leave` must be
+			called when it's served
+		'''
+		with self.lock:
+			capacity = self.current_capacity()
+			if capacity is None:
+				self.serving += 1
+				return True
+			if self.serving >= capacity and self.waiting >= capacity:
+				return False
+			self.waiting += 1
+			# Wake up now and then, to follow changes in the capacity
+			while self.serving >= self.current_capacity():
+				self.slots.wait(0.05)
+			self.waiting -= 1
+			self.serving += 1
+			return True
+
+	def leave(self):
+		with self.lock:
+			self.serving -= 1
+			self.slots.notify()
+
+	def _throttled(self, key, now):
+		'''
+		Token bucket for the per-key rate limit
+
+		:return: True iff the request is over the rate limit
+		'''
+		if self.rate_limit is None:
+			return False
+		tokens, last = self.tokens[key]
+		tokens = min(self.rate_limit, tokens + (now - last) * self.rate_limit)
+		if tokens < 1:
+			self.tokens[key] = (tokens, now)
+			return True
+		self.tokens[key] = (tokens - 1, now)
+		return False
+
+	def record(self, status):
+		with self.lock:
+			self.statuses[status] = self.statuses.get(status, 0) + 1
+
+	def delay(self):
+		'''
+		:return: Injected latency for a request, in seconds
+		'''
+		if self.latency <= 0:
+			return(0)
+		with self.lock:
+			return(self.rng.lognormvariate(0, 0.5) * self.latency / 1.133)
+
+	def failed(self):
+		'''
+		:return: True iff this request should get an injected server error
+		'''
+		with self.lock:
+			return(self.rng.random() < self.error_rate)
+
+	def charge(self, key):
+		'''
+		Charge a request to `key`
+
+		:return: Tuple of (HTTP status, quota headers)
+		'''
+		with self.lock:
+			self.requests += 1
+			if key not in self.quotas:
+				return(401, {})
+			now = time.time()
+			if self._throttled(key, now):
+				return(429, {'Retry-After': '1',
+								'X-ELS-Status': 'TOO_MANY_REQUESTS'})
+			if now >= self.reset_at[key]:
+				self.used[key] = 0
+				self.reset_at[key] = now + self.reset_period
+			headers = {'X-RateLimit-Limit': str(self.quotas[key]),
+						'X-RateLimit-Reset': str(int(self.reset_at[key]))}
+			if self.used[key] >= self.quotas[key]:
+				headers['X-RateLimit-Remaining'] = '0'
+				headers['X-ELS-Status'] = 'QUOTA_EXCEEDED - Quota Exceeded'
+				return(429, headers)
+			self.used[key] += 1
+			headers['X-RateLimit-Remaining'] = \
+				str(self.quotas[key] - self.used[key])
+			return(200, headers)
+
+
+class _Handler(BaseHTTPRequestHandler):
+	def log_message(self, format, *args):
+		pass
+
+	def _send(self, status, headers, body, content_type):
+		self.server.record(status)
+		body = body.encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		for name, value in headers.items():
+			self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		if url.path == '/stats':
+			with self.server.lock:
+				stats = {'requests': self.server.requests,
+							'statuses': dict(self.server.statuses),
+							'capacity': self.server.current_capacity(),
+							'serving': self.server.serving,
+							'waiting': self.server.waiting}
+			body = json.dumps(stats).encode('utf-8')
+			self.send_response(200)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+			return
+		key = self.headers.get('X-ELS-APIKey') or \
+				parse_qs(url.query).get('apiKey', [None])[0]
+		if not self.server.admit():
+			with self.server.lock:
+				self.server.requests += 1
+			self._send(429, {'Retry-After': '1',
+								'X-ELS-Status': 'TOO_MANY_REQUESTS'},
+						json.dumps({'error-response': {'error-code':
+							'TOO_MANY_REQUESTS'}}), 'application/json')
+			return
+		try:
+			self._serve(url, key)
+		finally:
+			self.server.leave()
+
+	def _serve(self, url, key):
+		status, headers = self.server.charge(key)
+		time.sleep(self.server.delay())
+		if status == 200 and self.server.failed():
+			self._send(500, headers, json.dumps({'service-error': {'status': {
+				'statusCode': 'GENERAL_SYSTEM_ERROR',
+				'statusText': 'Injected server error'}}}), 'application/json')
+			return
+		if status != 200:
+			error = {'error-response': {'error-code':
+						'TOO_MANY_REQUESTS' if status == 429 else 'AUTHENTICATION_ERROR'}}
+			self._send(status, headers, json.dumps(error), 'application/json')
+			return
+		network = self.server.network
+		if url.path.endswith('/search/author'):
+			sid = parse_qs(url.query).get('co-author', [''])[0]
+			self._send(200, headers, coauth_json(network, network.index(sid)),
+						'application/json')
+		elif '/author/author_id/' in url.path:
+			sid = url.path.rsplit('/', 1)[1]
+			self._send(200, headers, author_xml(network, network.index(sid)),
+						'text/xml')
+		else:
+			self._send(404, headers, json.dumps({'service-error': {'status': {
+				'statusCode': 'RESOURCE_NOT_FOUND',
+				'statusText': 'Unknown endpoint'}}}), 'application/json')
+
+
+def parse_schedule(schedule):
+	'''
+	Parse a capacity schedule, `'SECONDS:CAPACITY,...'`
+
+	:return: List of `(seconds, capacity)` steps, or None
+	'''
+	if not schedule:
+		return(None)
+	return([(float(start), int(capacity)) for start, capacity in
+				(step.split(':') for step in schedule.split(','))])
+
+
+def serve(network, quotas, port = 0, **kwargs):
+	'''
+	Start the stand-in server in a background thread
+
+	:param network: A `SyntheticNetwork`
+	:param quotas: Dict mapping API keys to their quotas
+	:param port: Port to listen on; 0 picks a free port
+	:return: The running server; its API root is
+		`'http://localhost:' + str(server.server_port) + '/content/'`
+	'''
+	server = FakeScopus(('localhost', port), network, quotas, **kwargs)
+	thread = threading.Thread(target = server.serve_forever, daemon = True)
+	thread.start()
+	return(server)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Local Scopus stand-in')
+	parser.add_argument('--authors', type = int, default = 1000)
+	parser.add_argument('--degree', type = float, default = 20)
+	parser.add_argument('--seed', type = int, default = 0)
+	parser.add_argument('--port', type = int, default = 8000)
+	parser.add_argument('--key', action = 'append', default = [],
+						metavar = 'KEY:QUOTA',
+						help = 'API key and its quota; may be repeated')
+	parser.add_argument('--latency', type = float, default = 0,
+						help = 'Mean response latency, in seconds')
+	parser.add_argument('--error-rate', type = float, default = 0,
+						help = 'Fraction of requests that get a 500 error')
+	parser.add_argument('--rate-limit', type = float, default = None,
+						help = 'Requests per second allowed for each key')
+	parser.add_argument('--capacity', default = None,
+						metavar = 'SECONDS:CAPACITY,...',
+						help = 'Schedule of the number of requests served at once')
+	parser.add_argument('--capacity-period', type = float, default = None,
+						help = 'Seconds after which the capacity schedule repeats')
+	args = parser.parse_args()
+	quotas = {key: int(quota) for key, quota in
+				(item.rsplit(':', 1) for item in args.key)}
+	server = FakeScopus(('localhost', args.port),
+						SyntheticNetwork(args.authors, args.degree, args.seed),
+						quotas, latency = args.latency,
+						error_rate = args.error_rate,
+						rate_limit = args.rate_limit,
+						capacity = parse_schedule(args.capacity),
+						capacity_period = args.capacity_period)
+	print('Serving on http://localhost:' + str(args.port) + '/content/')
+	server.serve_forever()
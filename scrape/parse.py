@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+'''
+This module parses the raw Scopus responses saved by the fetch steps of
+`run_scrape`.  Fetching and parsing are separate stages:  the fetch steps
+only send queries and save each response, as a json line
+`{'sid': ..., 'response': ...}` in a gzipped raw file, and `parse_raw` then
+parses the raw file in a pool of processes.  So parsing doesn't hold up the
+queries, and after a change to the parsers the raw files can be parsed again
+without re-querying Scopus.
+
+A response that can't be parsed doesn't stop the stage.  Its SID and the
+error are written to an errors file next to the output, eg,
+`gen_1_coauth.errors.json`, and the other responses are parsed as usual.
+'''
+
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+if __name__ == '__main__':
+	# Find the modules in the repository root when run as a script
+	sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_rw import *
+import metrics
+if __package__:
+	from .scrape import parse_response
+else:
+	from scrape import parse_response
+
+PARSE_CHUNK = 500		# Responses sent to a worker process at a time
+TASKS_PER_WORKER = 2	# Chunks queued for each worker, to bound memory use
+# Endpoint each kind of response comes from, to label the parse times like 
+#  the inline parsers in `scrape` do
+ENDPOINTS = {'coauths': 'coauthors', 'metadata': 'author'}
+
+
+def raw_fetcher(fetch):
+	'''
+	Wrap a fetch function from `scrape` for `batch.run_batch`, so that each
+	raw response is saved along with its SID
+	'''
+	def retrieve(sid):
+		return([{'sid': sid, 'response': fetch(sid)}])
+	return(retrieve)
+
+
+def errors_file(outfile):
+	'''
+	:return: Name of the file listing the responses in `outfile`'s raw file
+		that couldn't be parsed
+	'''
+	return(os.path.splitext(outfile)[0] + '.errors.json')
+
+
+def _parse_chunk(kind, records):
+	'''
+	Parse a chunk of raw responses, in a worker process
+
+	:return: List of parsed items, list of `{'sid', 'error'}` for the
+		responses that couldn't be parsed, and the seconds spent parsing; 
+		the worker's metrics are lost, so the parent records the time
+	'''
+	start = time.perf_counter()
+	items = []
+	errors = []
+	for record in records:
+		try:
+			items += parse_response(kind, record['sid'], record['response'])
+		except Exception as error:
+			errors.append({'sid': record['sid'],
+							'error': type(error).__name__ + ': ' + str(error)})
+	return(items, errors, time.perf_counter() - start)
+
+
+def _chunks(records, size):
+	chunk = []
+	for record in records:
+		chunk.append(record)
+		if len(chunk) >= size:
+			yield chunk
+			chunk = []
+	if chunk != []:
+		yield chunk
+
+
+def parse_raw(kind, infile, outfile, processes = None):
+	'''
+	Parse the raw responses in `infile`, writing the parsed items to
+	`outfile` as a json array, in the order of the raw file
+
+	:param kind: `'coauths'` or `'metadata'`; see `scrape.parse_response`
+	:param infile: Raw file written by a fetch step
+	:param outfile: File to write the parsed items to
+	:param processes: Number of worker processes; by default, one per core
+
+	:return: True
+	'''
+	if processes is None:
+		processes = os.cpu_count() or 1
+	errors = []
+	n_records = 0
+	print('Parsing ' + infile + ' with ' + str(processes) + ' processes')
+	with ProcessPoolExecutor(processes) as pool, \
+			JsonArrayWriter(outfile) as writer:
+		# Keep a bounded number of chunks in flight, collecting them in order
+		pending = deque()
+		def collect():
+			items, chunk_errors, seconds = pending.popleft().result()
+			# One observation for each chunk of up to `PARSE_CHUNK` responses
+			metrics.observe('scrape_parse_seconds', seconds, 
+							endpoint = ENDPOINTS[kind])
+			writer.write_all(items)
+			errors.extend(chunk_errors)
+		for chunk in _chunks(iter_jsonl(infile), PARSE_CHUNK):
+			n_records += len(chunk)
+			pending.append(pool.submit(_parse_chunk, kind, chunk))
+			if len(pending) >= processes * TASKS_PER_WORKER:
+				collect()
+		while pending:
+			collect()
+	metrics.inc('parse_responses_total', n_records, kind = kind)
+	metrics.inc('parse_errors_total', len(errors), kind = kind)
+	json_writef(errors, errors_file(outfile))
+	print(str(n_records) + ' responses parsed; ' + str(len(errors)) +
+			' errors, listed in ' + errors_file(outfile))
+	return True
+
+
+if __name__ == '__main__':
+	# Parse a raw file again, eg, after a change to the parsers
+	import argparse
+	parser = argparse.ArgumentParser(description = 'Parse raw Scopus responses')
+	parser.add_argument('kind', choices = ['coauths', 'metadata'])
+	parser.add_argument('infile')
+	parser.add_argument('outfile')
+	parser.add_argument('--processes', type = int)
+	args = parser.parse_args()
+	parse_raw(args.kind, args.infile, args.outfile, processes = args.processes)
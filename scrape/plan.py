@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+'''
+This module estimates the cost of a crawl before running it:  the number of
+Scopus requests each batch step of `run_scrape` will send, the wall time at
+a given rate limit, and the share of the API quota it will use.  Run it with
+
+	python build_network.py plan --probes 5 --rate 3
+
+The counts are exact for the steps whose inputs already exist (eg, step 1b
+once `gen_1_coauth.json` has been written).  The others are extrapolated
+from a sample of authors whose coauthors are known:  from the pair files,
+the raw response files, the data of a batch in progress, and, if these give
+fewer than `min_sample` authors, up to `probes` new queries.  The sample is
+bootstrapped for a 90% confidence band.  Coauthors shared between authors
+are discounted by the overlap seen in the sample, which underestimates the
+overlap in the full crawl, so the estimates tend to be high.
+'''
+
+import math
+import os
+import random
+import time
+from json_rw import *
+import scrape.batch as batch
+import scrape.prefetch as prefetch
+import scrape.run_scrape as run_scrape
+from scrape.scrape import parse_response, fetch_coauths_by_sid, credentials, \
+	limiter
+
+BOOTSTRAP_SAMPLES = 1000
+BAND = [0.05, 0.95]		# Quantiles of the bootstrap for the confidence band
+MIN_SAMPLE = 30			# Authors to sample before probing isn't needed
+MAX_SAMPLE = 2000		# Authors to use from the files, at most
+PROBES = 5				# Maximum number of requests to send while planning
+
+
+def _read_pairs(filename):
+	'''
+	:return: Dict mapping each queried SID in a pair file to its coauthors
+	'''
+	coauths = {}
+	for [sid, coauth] in iter_json_array(filename):
+		coauths.setdefault(sid, set()).add(coauth)
+	return(coauths)
+
+
+def _read_raw(filename):
+	'''
+	Parse the coauthor responses in a raw file, or in the data of a batch,
+	skipping any that don't parse
+
+	:return: Dict mapping each queried SID to its coauthors
+	'''
+	coauths = {}
+	for record in iter_jsonl(filename):
+		try:
+			pairs = parse_response('coauths', record['sid'], record['response'])
+		except Exception:
+			continue
+		coauths[record['sid']] = set(pair[1] for pair in pairs)
+	return(coauths)
+
+
+def _active_batch():
+	'''
+	The step that the batch in progress belongs to, if any, and the number of
+	items left in it
+
+	:return: Tuple of the step name and the number of items, or `(None, 0)`
+	'''
+	if not batch.exists_batch():
+		return(None, 0)
+	remaining = len(json_readf(os.path.join(batch.BATCH_FOLDER,
+											batch.BATCH_FILENAME)))
+	for step, raw_file in [('1a', run_scrape.raw_gen_1_coauth_file),
+							('1b', run_scrape.raw_gen_2_coauth_file),
+							('2b', run_scrape.raw_author_data_file)]:
+		if not os.access(raw_file, os.R_OK):
+			return(step, remaining)
+	return(None, 0)
+
+
+def _known_coauths(pair_file, raw_file, step, active_step):
+	'''
+	Coauthors known for the authors queried in one step, from whichever of
+	its files exist
+	'''
+	if os.access(pair_file, os.R_OK):
+		return(_read_pairs(pair_file))
+	if os.access(raw_file, os.R_OK):
+		return(_read_raw(raw_file))
+	if active_step == step:
+		return(_read_raw(os.path.join(batch.BATCH_FOLDER,
+										batch.OUTPUT_FILENAME)))
+	return({})
+
+
+def _bootstrap(values, rng):
+	'''
+	Bootstrap confidence band for the mean of `values`
+
+	:return: List of the lower and upper ends of the band
+	'''
+	if values == []:
+		return([0, 0])
+	means = sorted(sum(rng.choice(values) for value in values) / len(values)
+					for i in range(BOOTSTRAP_SAMPLES))
+	return([means[int(q * (BOOTSTRAP_SAMPLES - 1))] for q in BAND])
+
+
+def _extrapolate(n_queried, samples, exclude, rng):
+	'''
+	Estimate the number of new authors found by querying `n_queried`
+	authors, from the coauthors of a sample of them
+
+	:param samples: List of sets of coauthors, one for each sampled author
+	:param exclude: Set of SIDs that don't count as new
+	:return: Dict with the `estimate` and its confidence `band`
+	'''
+	if len(samples) > MAX_SAMPLE:
+		samples = rng.sample(samples, MAX_SAMPLE)
+	new = [coauths - exclude for coauths in samples]
+	counts = [len(coauths) for coauths in new]
+	if sum(counts) == 0:
+		return({'estimate': 0, 'band': [0, 0], 'sample': len(samples)})
+	# Share of the sampled coauthors that aren't shared with another sample
+	distinct = len(set().union(*new)) / sum(counts)
+	mean = sum(counts) / len(counts)
+	return({'estimate': round(n_queried * mean * distinct),
+			'band': [round(n_queried * bound * distinct)
+						for bound in _bootstrap(counts, rng)],
+			'sample': len(samples)})
+
+
+def _exact(count):
+	return({'estimate': count, 'band': [count, count], 'exact': True})
+
+
+def _probe(sids, n, rng, latencies):
+	'''
+	Query the coauthors of up to `n` of `sids`.  Probes that fail don't stop
+	the plan:  if a query fails (eg, every API key is exhausted), probing
+	stops, and the estimates use the sample without the rest; a response
+	that can't be parsed is left out of the sample.
+
+	:return: List of sets of coauthors
+	'''
+	found = []
+	for sid in rng.sample(sorted(sids), min(n, len(sids))):
+		start = time.perf_counter()
+		try:
+			response = fetch_coauths_by_sid(sid)
+		except Exception as error:
+			print('Probes stopped:  ' + str(error))
+			break
+		latencies.append(time.perf_counter() - start)
+		try:
+			pairs = parse_response('coauths', sid, response)
+		except Exception as error:
+			print('Skipping probe of ' + str(sid) + ':  ' + 
+					type(error).__name__ + ': ' + str(error))
+			continue
+		found.append(set(pair[1] for pair in pairs))
+	return(found)
+
+
+def _past_metrics():
+	'''
+	Mean request latency, requests per queried author, and the limit on
+	requests in flight, from the metrics of earlier runs
+
+	:return: Tuple of the latency (or None), the overhead factor, and the
+		concurrency limit (or None)
+	'''
+	if not os.access('metrics.json', os.R_OK):
+		return(None, 1, None)
+	past = json_readf('metrics.json')
+	hists = [hist['value'] for hist in past['histograms']
+				if hist['name'] == 'scrape_request_seconds']
+	count = sum(hist['count'] for hist in hists)
+	latency = sum(hist['sum'] for hist in hists) / count if count else None
+	requests = sum(counter['value'] for counter in past['counters']
+					if counter['name'] == 'scrape_requests_total')
+	# Authors retrieved by the batches, and by the metadata prefetch of step
+	#  1b (with `overlap_metadata`), whose requests are counted too
+	items = sum(counter['value'] for counter in past['counters']
+				if counter['name'] in ['batch_items_total',
+										'prefetch_items_total'])
+	limits = [entry['value'] for entry in past.get('gauges', [])
+				if entry['name'] == 'fetch_concurrency_limit']
+	return(latency, requests / items if items and requests else 1,
+			max(limits) if limits else None)
+
+
+def plan(max_dist = run_scrape.max_dist, probes = PROBES, rate = None,
+			min_sample = MIN_SAMPLE, seed = 0):
+	'''
+	Estimate the requests, wall time, and quota needed to finish the crawl
+
+	:param max_dist: Maximum distance from generation 1, as in step 2a
+	:param probes: Maximum number of requests to send for the estimates
+	:param rate: Rate limit, in requests per second; None for no limit
+	:param min_sample: Probe only if fewer authors than this are sampled
+	:param seed: Seed for sampling and bootstrapping
+
+	:return: Dict with the estimates
+	'''
+	rng = random.Random(seed)
+	latencies = []
+	active_step, active_left = _active_batch()
+	gen_1 = set(json_readf(run_scrape.sids_infile))
+
+	# Generation 1:  one request per author
+	if os.access(run_scrape.raw_gen_1_coauth_file, os.R_OK):
+		step_1a = _exact(0)
+	elif active_step == '1a':
+		step_1a = _exact(active_left)
+	else:
+		step_1a = _exact(len(gen_1))
+
+	# Generation 2:  one request per new coauthor of generation 1
+	known_1 = _known_coauths(run_scrape.gen_1_coauth_outfile,
+								run_scrape.raw_gen_1_coauth_file, '1a',
+								active_step)
+	gen_2 = set().union(*known_1.values()) - gen_1 if known_1 else set()
+	if os.access(run_scrape.raw_gen_2_coauth_file, os.R_OK):
+		step_1b = _exact(0)
+		n_gen_2 = _exact(len(gen_2))
+	elif os.access(run_scrape.gen_1_coauth_outfile, os.R_OK) or \
+			os.access(run_scrape.raw_gen_1_coauth_file, os.R_OK):
+		n_gen_2 = _exact(len(gen_2))
+		step_1b = _exact(active_left if active_step == '1b' else len(gen_2))
+	else:
+		samples = list(known_1.values())
+		if len(samples) < min_sample:
+			samples += _probe(gen_1 - known_1.keys(), probes, rng, latencies)
+			probes -= len(latencies)
+		# The sampled part of generation 2, to probe for generation 3
+		gen_2 = set().union(*samples) - gen_1
+		n_gen_2 = _extrapolate(len(gen_1), samples, gen_1, rng)
+		step_1b = n_gen_2
+
+	# Metadata:  one request per author within `max_dist` of generation 1
+	if os.access(run_scrape.raw_author_data_file, os.R_OK):
+		step_2b = _exact(0)
+	elif os.access(run_scrape.combined_sids_file, os.R_OK):
+		combined = set(json_readf(run_scrape.combined_sids_file)) | gen_1
+		# Less any retrieved during step 1b, with `overlap_metadata`
+		combined -= prefetch.prefetched_sids(run_scrape.prefetch_metadata_file)
+		step_2b = _exact(active_left if active_step == '2b' else len(combined))
+	else:
+		step_2b = {'estimate': len(gen_1), 'band': [len(gen_1)] * 2}
+		if max_dist >= 1:
+			step_2b = {'estimate': len(gen_1) + n_gen_2['estimate'],
+						'band': [len(gen_1) + bound for bound in n_gen_2['band']]}
+		if max_dist < 2 and n_gen_2.get('exact'):
+			step_2b['exact'] = True
+		if max_dist >= 2:
+			# Generation 3:  the new coauthors of generation 2
+			known_2 = _known_coauths(run_scrape.gen_2_coauth_outfile,
+										run_scrape.raw_gen_2_coauth_file, '1b',
+										active_step)
+			samples = list(known_2.values())
+			if len(samples) < min_sample and gen_2 - known_2.keys():
+				samples += _probe(gen_2 - known_2.keys(), probes, rng, latencies)
+			n_gen_3 = _extrapolate(n_gen_2['estimate'], samples,
+									gen_1 | gen_2, rng)
+			step_2b = {'estimate': step_2b['estimate'] + n_gen_3['estimate'],
+						'band': [a + b for a, b in zip(step_2b['band'],
+														n_gen_3['band'])]}
+
+	steps = {'1a': step_1a, '1b': step_1b, '2b': step_2b}
+	latency, overhead, concurrency = _past_metrics()
+	if latencies != []:
+		latency = sum(latencies) / len(latencies)
+	# Up to `concurrency` requests are in flight at once, as limited by the
+	#  limit the last run settled on (or the limiter's current one); but no
+	#  faster than the rate limit allows
+	if concurrency is None:
+		concurrency = limiter.limit
+	concurrency = max(1, min(int(concurrency), run_scrape.fetch_workers))
+	interval = max((latency or 0) / concurrency, 1 / rate if rate else 0)
+	total = {'estimate': sum(step['estimate'] for step in steps.values()),
+				'band': [sum(step['band'][i] for step in steps.values())
+						for i in range(2)]}
+	requests = {'estimate': math.ceil(total['estimate'] * overhead),
+				'band': [math.ceil(bound * overhead) for bound in total['band']]}
+	# Keys that Scopus hasn't reported on yet (eg, when no probes were sent) 
+	#  count as `credentials.DEFAULT_QUOTA`; parked keys count as empty
+	keys = credentials.status().values()
+	quota = sum(max(state['remaining'], 0) for state in keys 
+				if not state['parked'])
+	assumed = sum(1 for state in keys if not state['reported'])
+	if quota > 0:
+		share = {'estimate': requests['estimate'] / quota,
+					'band': [bound / quota for bound in requests['band']]}
+	else:
+		share = None
+	return({'steps': steps, 'max_dist': max_dist, 'overhead': overhead,
+			'requests': requests,
+			'latency_s': latency, 'rate': rate, 'concurrency': concurrency,
+			'wall_s': {'estimate': requests['estimate'] * interval,
+						'band': [bound * interval for bound in requests['band']]},
+			'quota_remaining': quota, 'quota_assumed_keys': assumed,
+			'quota_share': share, 'quota_reset': credentials.next_reset(),
+			'probes_sent': len(latencies)})
+
+
+def print_plan(report):
+	'''
+	Print the estimates from `plan`
+	'''
+	names = {'1a': 'Step 1a (coauthors, generation 1)',
+				'1b': 'Step 1b (coauthors, generation 2)',
+				'2b': 'Step 2b (author metadata)'}
+	for step, estimate in report['steps'].items():
+		if estimate.get('exact'):
+			detail = 'exact'
+		else:
+			detail = '90% band {:,} - {:,}'.format(*estimate['band'])
+			if 'sample' in estimate:
+				detail += ', from {} sampled authors'.format(estimate['sample'])
+		print('{:36} {:>10,} requests ({})'.format(names[step],
+						estimate['estimate'], detail))
+	requests = report['requests']
+	print('Total, with {:.0%} retry overhead: {:,} requests '
+			'(90% band {:,} - {:,})'.format(report['overhead'] - 1,
+				requests['estimate'], *requests['band']))
+	if report['latency_s'] is None and report['rate'] is None:
+		print('Wall time: unknown; give a rate limit, or run with probes')
+	else:
+		hours = [seconds / 3600 for seconds in
+					[report['wall_s']['estimate']] + report['wall_s']['band']]
+		print('Wall time: {:.1f} hours (90% band {:.1f} - {:.1f}), with up to '
+				'{} requests in flight'.format(*hours, report['concurrency']))
+	share = report['quota_share']
+	if share is None:
+		print('Quota: exhausted' + (' until ' + time.strftime('%c', 
+					time.localtime(report['quota_reset'])) 
+				if report['quota_reset'] else ''))
+	else:
+		print('Quota: {:.0%} of the {:,} requests remaining '
+				'(90% band {:.0%} - {:.0%})'.format(share['estimate'],
+					report['quota_remaining'], *share['band']))
+	if report['quota_assumed_keys'] > 0:
+		print('\tAssumed, not reported by Scopus, for {} of the API keys; '
+				'run with probes to check'.format(report['quota_assumed_keys']))
+	print(str(report['probes_sent']) + ' probe requests sent')
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+'''
+This module fetches raw responses for a stream of SIDs on background
+threads, while another step of the crawl runs in the foreground.  It's used
+by `run_scrape` to retrieve the metadata for authors who are certain to be
+in the filtered network while step 1b is still querying coauthors.
+
+Responses are appended to a json lines file, in the same
+`{'sid': ..., 'response': ...}` format as the raw files of the batch steps.
+SIDs already in the file are skipped, so an interrupted prefetch picks up
+where it left off.  `cancel` drops the SIDs still waiting in the queue, 
+so a session isn't held up by the prefetch backlog; they're left for the 
+next run.  The file name is made absolute when the prefetcher
+starts, since `batch.run_batch` changes the working directory while it runs.
+'''
+
+import os
+import queue
+import sys
+import threading
+import time
+if __name__ == '__main__':
+	# Find the modules in the repository root when run as a script
+	sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_rw import *
+import metrics
+
+FLUSH_EVERY = 100		# Responses to collect before appending them to the file
+
+
+def prefetched_sids(filename):
+	'''
+	:return: Set of SIDs whose responses are in the prefetch file `filename`
+	'''
+	if not os.access(filename, os.R_OK):
+		return(set())
+	return(set(record['sid'] for record in iter_jsonl(filename)))
+
+
+class Prefetcher:
+	'''
+	Fetch the responses for SIDs added with `add` on background threads,
+	appending them to `outfile`
+
+	:param fetch: Function returning the raw response for a SID
+	:param outfile: Json lines file to append the responses to
+	:param workers: Number of fetching threads
+	'''
+	def __init__(self, fetch, outfile, workers = 1):
+		self.fetch = fetch
+		self.outfile = os.path.abspath(outfile)
+		self.seen = prefetched_sids(outfile)
+		self.queue = queue.Queue()
+		self.pending = []
+		self.fetched = {}		# Time each SID was queried
+		self.error = None
+		self.stopped = threading.Event()
+		self._lock = threading.Lock()
+		self.threads = [threading.Thread(target = self._work, daemon = True)
+							for i in range(workers)]
+		for thread in self.threads:
+			thread.start()
+
+	def add(self, sids):
+		'''
+		Queue SIDs to fetch; SIDs already fetched or queued are skipped.  Can 
+		be called from several threads.  
+		'''
+		for sid in sids:
+			if self.stopped.is_set():
+				return
+			with self._lock:
+				if sid in self.seen:
+					continue
+				self.seen.add(sid)
+			self.queue.put(sid)
+
+	def _flush(self):
+		with self._lock:
+			records = self.pending
+			self.pending = []
+			if records != []:
+				append_jsonl(records, self.outfile)
+
+	def _work(self):
+		while True:
+			sid = self.queue.get()
+			if sid is None or self.error is not None or self.stopped.is_set():
+				return
+			try:
+				response = self.fetch(sid)
+			except Exception as error:
+				# Eg, every API key is exhausted; stop, and leave the rest
+				#  for the next run
+				self.error = error
+				return
+			metrics.inc('prefetch_items_total')
+			with self._lock:
+				self.pending.append({'sid': sid, 'response': response})
+				self.fetched[sid] = time.time()
+				full = len(self.pending) >= FLUSH_EVERY
+			if full:
+				self._flush()
+
+	def cancel(self):
+		'''
+		Stop fetching, and drop the SIDs still waiting in the queue.  Fetches 
+		already in flight finish, and are saved by `close`.  
+		'''
+		self.stopped.set()
+		dropped = 0
+		while True:
+			try:
+				sid = self.queue.get_nowait()
+			except queue.Empty:
+				break
+			if sid is not None:
+				dropped += 1
+		if dropped > 0:
+			print('Prefetching cancelled; ' + str(dropped) + 
+					' authors left for the next run')
+
+	def close(self):
+		'''
+		Wait for the queued SIDs to be fetched, and save the responses; call 
+		`cancel` first to save only the responses already fetched
+
+		:return: Dict of the time each SID was queried
+		'''
+		for thread in self.threads:
+			self.queue.put(None)
+		for thread in self.threads:
+			thread.join()
+		self._flush()
+		if self.error is not None:
+			print('Prefetching stopped early: ' + str(self.error))
+		return(self.fetched)
@@ -10,10 +10,12 @@ Pseudocode for scraping and network construction:
 read gen 1 SIDs from file
 for each gen 1 author:
 	retrieve list of coauthors
+parse the responses
 <1b>
 aggregate set of gen 2 coauthors
 for each gen 2 coauthor:
 	retrieve list of coauthors
+parse the responses
 combine coauthor lists
 
 <2a>
@@ -23,29 +25,56 @@ extract list of authors
 
 <2b>
 retrieve metadata for each author
+parse the responses
 
 <3>
 write author metadata into graph
+
+Each step is a function, run in order by the pipeline in `build_network`.  
+The batch steps return False if the batch was not finished on this run; 
+running the step again continues the batch.  The batch steps only save the 
+raw responses; the `parse_*` steps parse them, and can be run again on their 
+own (eg, after a change to the parsers) without re-querying Scopus.  
+
+With `overlap_metadata`, step 1b also starts step 2b early:  the authors 
+who are certain to be in the filtered network are known before step 2a runs 
+(generation 1 and, for `max_dist` >= 1, generation 2; for `max_dist` >= 2, 
+the coauthors of generation 2, as their responses come in), so their 
+metadata are retrieved on a background thread while 1b is querying 
+coauthors.  Step 2b then only queries the rest.  
 '''
 
+import os
+import sys
 if __name__ == '__main__':
+	# Find the modules in the repository root when run as a script
+	sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 	import batch
+	import parse
+	import prefetch
 	from scrape import *
 else:
 	import scrape.batch as batch
+	import scrape.parse as parse
+	import scrape.prefetch as prefetch
 	from scrape.scrape import *
 import csv
-import graph_tool as gt
 from json_rw import *
-import os
+import metrics
 import random
-import sys
 import time
 
 # File with the list of generation 1 SIDs
 sids_infile = 'sids.json'
 
 # Files to save the scraped data
+#  Raw responses, as gzipped json lines
+raw_gen_1_coauth_file = 'raw_gen_1_coauth.jsonl.gz'
+raw_gen_2_coauth_file = 'raw_gen_2_coauth.jsonl.gz'
+raw_author_data_file = 'raw_metadata.jsonl.gz'
+#  Metadata retrieved during step 1b, with `overlap_metadata`; merged into 
+#  `raw_author_data_file` by step 2b
+prefetch_metadata_file = 'raw_metadata.prefetch.jsonl'
 #  Coauthor pairs from generation 1 and 2
 gen_1_coauth_outfile = 'gen_1_coauth.json'
 gen_2_coauth_outfile = 'gen_2_coauth.json'
@@ -53,129 +82,234 @@ gen_2_coauth_outfile = 'gen_2_coauth.json'
 combined_sids_file = 'combined_sids.json'
 author_data_file = 'combined_metadata.json'
 net_outfile_pre = 'coauth_net'
+#  Network with author metadata, before duplicates are collapsed
+net_outfile = net_outfile_pre + '.precollapse.gt'
 
 max_dist = 1	# Maximum distance from generation 1 to include in the final net
+# Build the network in step 2a from sorted chunks of pairs on disk, for 
+#  crawls whose pairs don't fit in memory; see `external_pairs`
+out_of_core = False
+# Items each batch step retrieves at once; the requests in flight are 
+#  limited further by `scrape.limiter`, which adapts to the API's capacity
+fetch_workers = MAX_CONCURRENCY
+# Retrieve metadata for the authors certain to be in the network while 
+#  step 1b runs, with this many threads; see `step_1b`
+overlap_metadata = False
+prefetch_workers = MAX_CONCURRENCY
 
-print('Run started at ' + time.strftime('%c', time.localtime()))
+# File with the time each author was last queried, for `refresh`
+fetched_file = 'fetched.json'
+# File to track the progress of a refresh, the batch folder it uses, so an 
+#  unfinished crawl batch is left alone, and the raw responses it retrieves
+refresh_status_file = 'refresh.json'
+refresh_batch_folder = 'refresh_batch'
+refresh_coauth_1_file = 'refresh_gen_1_coauth.jsonl.gz'
+refresh_coauth_2_file = 'refresh_gen_2_coauth.jsonl.gz'
+refresh_metadata_file = 'refresh_metadata.jsonl.gz'
+max_age = 30	# Age, in days, after which an author is re-queried by `refresh`
 
-# A file to track the status of the scrape
-status_file = 'status.json'
-if os.access(status_file, os.R_OK):
-	status = json_readf(status_file)
-else:
-	status = {
-		'1a': {'start': False, 'finish': False},
-		'1b': {'start': False, 'finish': False},
-		'2a': {'start': False, 'finish': False},
-		'2b': {'start': False, 'finish': False},
-		'3': {'start': False, 'finish': False}}
 
+def _load_fetched():
+	'''
+	Load the log of query times, `{'coauths': {sid: time}, 'metadata': {...}}`
+	'''
+	if os.access(fetched_file, os.R_OK):
+		return(json_readf(fetched_file))
+	return({'coauths': {}, 'metadata': {}})
 
 
-# Step 1:  Retrieve coauthor pairs
-# Step 1a:  Coauthor pairs from generation 1
+def _save_fetched(kind, times):
+	'''
+	Add query times to the log in `fetched_file`
+	'''
+	fetched = _load_fetched()
+	fetched[kind].update(times)
+	json_writef(fetched, fetched_file)
 
-if status['1a']['start'] == False:
-	# Get the generation 1 SIDs manually retrieved from Scopus
-#	gen_1_sids = ['7006596737']
-	gen_1_sids = json_readf(sids_infile)
 
-	print(str(len(gen_1_sids)) + ' items in generation 1')
+def _batch_step(get_items, retrieve, outfile, kind, lines = False, 
+				include = None, folder = batch.BATCH_FOLDER):
+	'''
+	Run a batch of queries, setting up the batch first if necessary.  
+	
+	:param get_items: Function returning the list of items for a new batch
+	:param retrieve: The function used to retrieve the data
+	:param outfile: File to write the results to when the batch finishes
+	:param kind: Key in `fetched_file` to log the query times under
+	:param lines: Write `outfile` as json lines, rather than a json array
+	:param include: Function returning an iterable of results retrieved 
+		outside the batch, written to `outfile` ahead of the batch results
+	:param folder: The batch folder
+	
+	:return: True iff the batch finished and the results were written
+	'''
+	fetched = _load_fetched()
+	def logged_retrieve(sid):
+		new_data = retrieve(sid)
+		fetched[kind][sid] = time.time()
+		return(new_data)
+	
+	if not batch.exists_batch(folder) and not batch.finished_batch(folder):
+		items = get_items()
+		batch.set_batch(items, folder)
+	try:
+		if batch.exists_batch(folder):
+			batch.run_batch(logged_retrieve, workers = fetch_workers, 
+							folder = folder)
+	finally:
+		json_writef(fetched, fetched_file)
+	# If the batch finished on this run, or previously, exists_batch will return False
+	if batch.exists_batch(folder):
+		print('Finished the current batch run; batch not finished')
+		return False
+	print('Finished the batch; moving data and cleaning up')
+	# Retrieve the batch results and write them to a permanent file
+	with JsonArrayWriter(outfile, lines = lines) as writer:
+		if include is not None:
+			writer.write_all(include())
+		writer.write_all(batch.iter_batch(folder))
+	# Clean up the batch output
+	batch.clean_batch(folder)
+	return True
 
-	if not batch.exists_batch():
-		print('Setting coauthors batch for generation 1')
-		batch_response = batch.set_batch(gen_1_sids)
 
-	if batch_response == True:
-		status['1a']['start'] = True
-		json_writef(status, status_file)
-	else:	
-		raise Exception('Error setting batch')
+# Step 1:  Retrieve coauthor pairs
+# Step 1a:  Coauthor pairs from generation 1
 
-if status['1a']['finish'] == False:
-	if batch.exists_batch():
-		# Run the batch
-		print('Running coauthors batch for generation 1')
-		batch_response = batch.run_batch(get_coauths_by_sid)
+def step_1a():
+	'''
+	Query the coauthors of the generation 1 SIDs in `sids_infile`, saving the 
+	raw responses
+	'''
+	def get_items():
+		# Get the generation 1 SIDs manually retrieved from Scopus
+		gen_1_sids = json_readf(sids_infile)
+		print(str(len(gen_1_sids)) + ' items in generation 1')
+		print('Setting coauthors batch for generation 1')
+		return(gen_1_sids)
+	print('Running coauthors batch for generation 1')
+	return(_batch_step(get_items, parse.raw_fetcher(fetch_coauths_by_sid), 
+						raw_gen_1_coauth_file, 'coauths', lines = True))
 
-	# If the batch finished on this run, or previously, exists_batch will return False
-	if batch.exists_batch():
-		# Exit gracefully
-		print('Finished the current batch run; batch not finished')
-		sys.exit(0)
-	else:
-		print('Finished the batch; moving data and cleaning up')
-		# Retrieve the batch results
-		gen_1_coauth = batch.retrieve_batch()
-		# Write them to a permanent file
-		json_writef(gen_1_coauth, gen_1_coauth_outfile)
-		# Clean up the batch output
-		batch.clean_batch()
-		
-		# Finished with step 1a
-		status['1a']['finish'] = True
-		json_writef(status, status_file)
+def parse_1a():
+	'''
+	Parse the generation 1 coauthor pairs from the raw responses
+	'''
+	return(parse.parse_raw('coauths', raw_gen_1_coauth_file, 
+							gen_1_coauth_outfile))
 
 
 # Step 1b:  Coauthor pairs from generation 2
 
-if status['1b']['start'] == False:
-	# Load the generation 1 coauthor pairs
-	gen_1_coauth = json_readf(gen_1_coauth_outfile)
-	gen_1_sids = set([item[0] for item in gen_1_coauth])
-	gen_2_sids = set([item[1] for item in gen_1_coauth 
-								if item[1] not in gen_1_sids])
-	print(str(len(gen_2_sids)) + ' new authors in generation 2')
+def _certain_sids(max_dist):
+	'''
+	The authors known to be in the network from step 2a (or to be queried 
+	by step 2b anyway) once the generation 1 coauthor pairs are parsed, 
+	including the coauthors in the generation 2 responses retrieved so far
 	
-	if not batch.exists_batch():
+	:return: Set of SIDs
+	'''
+	certain = set(json_readf(sids_infile))
+	if max_dist >= 1:
+		for [auth1, auth2] in iter_json_array(gen_1_coauth_outfile):
+			certain.add(auth2)
+	if max_dist >= 2 and batch.exists_batch():
+		# Responses from earlier sessions of the step 1b batch
+		for record in batch.iter_batch():
+			certain.update(_response_coauths(record))
+	return(certain)
+
+def _response_coauths(record):
+	'''
+	The coauthors in a raw coauthor response; responses that don't parse are 
+	left for `parse_1b` to report
+	'''
+	try:
+		return([pair[1] for pair in 
+					parse_response('coauths', record['sid'], record['response'])])
+	except Exception:
+		return([])
+
+def step_1b(overlap = None):
+	'''
+	Query the coauthors of the generation 2 authors, ie, the coauthors of 
+	generation 1, saving the raw responses
+	
+	:param overlap: Retrieve the metadata for the authors certain to be in the 
+		network at the same time, into `prefetch_metadata_file`; by default, 
+		`overlap_metadata`
+	'''
+	if overlap is None:
+		overlap = overlap_metadata
+	def get_items():
+		# Stream through the generation 1 coauthor pairs
+		gen_1_sids = set()
+		coauths = set()
+		for item in iter_json_array(gen_1_coauth_outfile):
+			gen_1_sids.add(item[0])
+			coauths.add(item[1])
+		gen_2_sids = coauths - gen_1_sids
+		print(str(len(gen_2_sids)) + ' new authors in generation 2')
 		print('Setting coauthors batch for generation 2')
-		batch_response = batch.set_batch(list(gen_2_sids))
-		
-	if batch_response == True:
-		status['1b']['start'] = True
-		json_writef(status, status_file)
-	else:
-		raise Exception('Error setting batch')
-		
-if status['1b']['finish'] == False:
-	# Run the batch
+		return(list(gen_2_sids))
 	print('Retrieving coauthors for generation 2')
-	batch_response = batch.run_batch(get_coauths_by_sid)
-	if batch_response == False:
-		raise Exception('Error running batch')
-		
-	# If the batch finished on this run, exists_batch will return False
-	if batch.exists_batch():
-		# Exit gracefully
-		print('Finished the current batch run; batch not finished')
-		sys.exit(0)
-	else:
-		print('Finished the batch; moving data and cleaning up')
-		# Retrieve the batch results
-		gen_2_coauth = batch.retrieve_batch()
-		# Write them to a permanent file
-		json_writef(gen_2_coauth, gen_2_coauth_outfile)
-		# Clean up the batch output
-		batch.clean_batch()
-		
-		# Finished with step 1b
-		status['1b']['finish'] = True
-		json_writef(status, status_file)
+	retrieve = parse.raw_fetcher(fetch_coauths_by_sid)
+	if not overlap:
+		return(_batch_step(get_items, retrieve, raw_gen_2_coauth_file, 
+							'coauths', lines = True))
+	
+	print('Retrieving author metadata at the same time')
+	prefetcher = prefetch.Prefetcher(fetch_auth_data_by_sid, 
+										prefetch_metadata_file, 
+										workers = prefetch_workers)
+	prefetcher.add(_certain_sids(max_dist))
+	def retrieve_and_prefetch(sid):
+		records = retrieve(sid)
+		if max_dist >= 2:
+			for record in records:
+				prefetcher.add(_response_coauths(record))
+		return(records)
+	try:
+		finished = _batch_step(get_items, retrieve_and_prefetch, 
+								raw_gen_2_coauth_file, 'coauths', lines = True)
+	finally:
+		# Don't let the prefetch backlog hold up the end of the run, or an 
+		#  interrupt; step 2b retrieves whatever is left
+		prefetcher.cancel()
+		_save_fetched('metadata', prefetcher.close())
+	print(str(len(prefetch.prefetched_sids(prefetch_metadata_file))) + 
+			' authors with metadata retrieved ahead of step 2b')
+	return(finished)
+
+def parse_1b():
+	'''
+	Parse the generation 2 coauthor pairs from the raw responses
+	'''
+	return(parse.parse_raw('coauths', raw_gen_2_coauth_file, 
+							gen_2_coauth_outfile))
+
 
 ## Step 2: Build network
 ## Step 2a: Build network; filter based on distance from initial authors; 
 ##  extract list of authors
-			
-if status['2a']['start'] == False:
-	# Load files with coauthor pairings
-	print('Loading coauthor pairs')
-	gen_1_coauth = json_readf(gen_1_coauth_outfile)
-	gen_2_coauth = json_readf(gen_2_coauth_outfile)
-	# Combine them
-	coauth_pairs = gen_1_coauth + gen_2_coauth
-	print(str(len(coauth_pairs)) + ' pairs to process')
-	# Extract the SIDs from generation 1
-	gen_1_sids = set([auth1 for [auth1, auth2] in gen_1_coauth])
+
+def _build_network(max_dist):
+	'''
+	Build the network from the coauthor pairs in memory, and keep only the 
+	authors within `max_dist` of generation 1
+	'''
+	# graph-tool is imported by the steps that use it, so that the crawl 
+	#  steps start quickly
+	import graph_tool as gt
+	# Stream through the files with coauthor pairings, rather than loading 
+	#  and combining them; the SIDs from generation 1 are collected on the way
+	gen_1_sids = set()
+	def coauth_pairs():
+		for coauth_pair in iter_json_array(gen_1_coauth_outfile):
+			gen_1_sids.add(coauth_pair[0])
+			yield coauth_pair
+		for coauth_pair in iter_json_array(gen_2_coauth_outfile):
+			yield coauth_pair
 	
 	# Initialize network
 	net = gt.Graph(directed = False)
@@ -184,7 +318,9 @@ if status['2a']['start'] == False:
 
 	# Loop through the coauthor pairs, adding nodes and edges
 	print('Building network')
-	for coauth_pair in coauth_pairs:
+	n_pairs = 0
+	for coauth_pair in coauth_pairs():
+		n_pairs += 1
 		auth1 = coauth_pair[0]
 		auth2 = coauth_pair[1]
 		for auth in [auth1, auth2]:
@@ -196,6 +332,7 @@ if status['2a']['start'] == False:
 		# Add the edge if necessary
 		this_edge = net.edge(gt_from_sid[auth1], gt_from_sid[auth2], 
 								add_missing = True)
+	print(str(n_pairs) + ' pairs processed')
 	print('Unfiltered nodes: ' + str(net.num_vertices()))
 	print('Unfiltered edges: ' + str(net.num_edges()))
 	
@@ -208,106 +345,335 @@ if status['2a']['start'] == False:
 	net.purge_vertices()
 	print('Filtered nodes: ' + str(net.num_vertices()))
 	print('Filtered edges: ' + str(net.num_edges()))
+	return(net)
+
+def step_2a(max_dist = max_dist, out_of_core = out_of_core):
+	'''
+	Build the network from the coauthor pairs, and keep only the authors 
+	within `max_dist` of generation 1
+	
+	:param out_of_core: Build the network from sorted chunks of pairs on 
+		disk, rather than in memory
+	'''
+	if out_of_core:
+		if __name__ == '__main__':
+			import external_pairs
+		else:
+			import scrape.external_pairs as external_pairs
+		net = external_pairs.filtered_network(
+				[gen_1_coauth_outfile, gen_2_coauth_outfile], max_dist)
+	else:
+		net = _build_network(max_dist)
 	
 	# SIDs to retrieve metadata for
-	combined_sids = [net.vp['sid'][v] for v in net.vertices()]
-	json_writef(combined_sids, combined_sids_file)
-	# Save graph
-	net.save(net_outfile_pre + '.temp' + '.graphml')
+	with JsonArrayWriter(combined_sids_file) as writer:
+		writer.write_all(net.vp['sid'][v] for v in net.vertices())
+	# Save graph; only the gt file is read by the later steps
 	net.save(net_outfile_pre + '.temp' + '.gt')
-	print('Network files saved')
-	
-	# Finished with 2a
-	status['2a']['start'] = True
-	status['2a']['finish'] = True
-	json_writef(status, status_file)
+	print('Network file saved')
+	return True
+
 
 ## Step 2b: Retrieve metadata for each author
-		
-if status['2b']['start'] == False:
-	# Load SIDs to retrieve metadata for
-	#  This includes every node in the network, 
-	#  plus all of the manually identified SIDs
-	combined_sids = list(set(json_readf(combined_sids_file) + json_readf(sids_infile)))
-	
-	print(str(len(combined_sids)) + ' authors to retrieve')
-	if not batch.exists_batch():
+
+def step_2b():
+	'''
+	Query the metadata for every author in the network, saving the raw 
+	responses
+	'''
+	def wanted_sids():
+		# Load SIDs to retrieve metadata for
+		#  This includes every node in the network, 
+		#  plus all of the manually identified SIDs
+		return(set(json_readf(combined_sids_file) + json_readf(sids_infile)))
+	def get_items():
+		combined_sids = wanted_sids()
+		#  less any retrieved by step 1b, with `overlap_metadata`
+		prefetched = prefetch.prefetched_sids(prefetch_metadata_file)
+		if prefetched:
+			print(str(len(combined_sids & prefetched)) + 
+					' authors already retrieved during step 1b')
+		combined_sids = list(combined_sids - prefetched)
+		print(str(len(combined_sids)) + ' authors to retrieve')
 		print('Setting author metadata batch')
-		batch_response = batch.set_batch(combined_sids)
-	if batch_response == True:
-		status['2b']['start'] = True
-		json_writef(status, status_file)
-	else:
-		raise Exception('Error setting batch')
-		
-if status['2b']['finish'] == False:
-	if batch.exists_batch():
-		# Run the batch
-		print('Running author metadata batch')
-		batch_response = batch.run_batch(get_auth_data_by_sid)
-		
-	# If the batch finished on this run, or previously, exists_batch will return False
-	if batch.exists_batch():
-		# Exit gracefully
-		print('Finished the current batch run; batch not finished')
-	else:
-		print('Finished the batch; moving data and cleaning up')
-		# Retrieve the batch results
-		author_data = batch.retrieve_batch()
-		# Write them to a permanent file
-		json_writef(author_data, author_data_file)
-		# Clean up the batch output
-		batch.clean_batch()
-		
-		# Finished with step 2b
-		status['2b']['finish'] = True
-		json_writef(status, status_file)
+		return(combined_sids)
+	def prefetched_records():
+		if not os.access(prefetch_metadata_file, os.R_OK):
+			return([])
+		wanted = wanted_sids()
+		return(record for record in iter_jsonl(prefetch_metadata_file) 
+					if record['sid'] in wanted)
+	print('Running author metadata batch')
+	finished = _batch_step(get_items, parse.raw_fetcher(fetch_auth_data_by_sid), 
+							raw_author_data_file, 'metadata', lines = True, 
+							include = prefetched_records)
+	if finished and os.access(prefetch_metadata_file, os.R_OK):
+		os.remove(prefetch_metadata_file)
+	return(finished)
+
+def parse_2b():
+	'''
+	Parse the author metadata from the raw responses
+	'''
+	return(parse.parse_raw('metadata', raw_author_data_file, author_data_file))
+
 
 ## Step 3: Write author metadata into graph
 
-if status['3']['start'] == False:
-	# Load the author data and temporary graph file
-	author_data = json_readf(author_data_file)
+def step_3():
+	'''
+	Write the author metadata into the network
+	'''
+	import graph_tool as gt
+	import numpy as np
+	import metadata_store
+	# Load the temporary graph file, and the author data as columns
 	net = gt.load_graph(net_outfile_pre + '.temp' + '.gt')
-	# Build the dict to link Scopus IDs to net vertices
-	gt_from_sids = {net.vp['sid'][v]: v for v in net.vertices()}
+	store = metadata_store.MetadataStore.load(author_data_file)
+	# Join the authors to the net vertices by SID
+	rows = store.rows([net.vp['sid'][v] for v in net.vertices()])
+	# Authors with metadata but not in the network (eg, generation 1 authors 
+	#  without coauthors) get new vertices
+	extra = np.setdiff1d(np.arange(len(store)), rows)
+	if len(extra) > 0:
+		first = net.num_vertices()
+		net.add_vertex(len(extra))
+		for v, sid in zip(range(first, net.num_vertices()), 
+							store.column('sid', extra)):
+			net.vp['sid'][v] = sid
+		rows = np.concatenate([rows, extra])
+	
 	# Define the pmaps for the author data
-	net.vp['surname'] = net.new_vp('string')
-	net.vp['given'] = net.new_vp('string')
-	net.vp['docs'] = net.new_vp('int')
-	net.vp['areas'] = net.new_vp('object')
-	net.vp['affiliation'] = net.new_vp('string')
-	net.vp['country'] = net.new_vp('string')
+	net.vp['surname'] = net.new_vp('string', vals = store.column('surname', rows))
+	net.vp['given'] = net.new_vp('string', vals = store.column('given', rows))
+	net.vp['docs'] = net.new_vp('int', vals = store.column('docs', rows))
+	net.vp['areas'] = net.new_vp('object', vals = store.area_lists(rows))
+	net.vp['affiliation'] = net.new_vp('string', 
+								vals = store.column('affiliation', rows))
+	net.vp['country'] = net.new_vp('string', vals = store.column('country', rows))
 	
-	# Loop through the authors, writing data from author file to graph
-	for author in author_data:
-		if author['sid'] in gt_from_sids:
-			author_node = gt_from_sids[author['sid']]
-		else:
-			author_node = net.add_vertex()
-			net.vp['sid'][author_node] = author['sid']
-			gt_from_sids[author['sid']] = author_node
-		net.vp['surname'][author_node] = author['name']['surname']
-		net.vp['given'][author_node] = author['name']['given']
-		net.vp['docs'][author_node] = author['docs']
-		try:
-			net.vp['areas'][author_node] = [area['#text'] for area in author['areas']]
-		except TypeError:
-			net.vp['areas'][author_node] = [author['areas']['#text']]
-		net.vp['affiliation'][author_node] = author['affiliation']
-		net.vp['country'][author_node] = author['country']
+	# Save as a gt file; duplicates are collapsed and the network is saved 
+	#  in its final formats by `collapse_duplicates` and `sanitize`
+	net.save(net_outfile)
+	return True
+
+
+## Refresh: re-query only stale or new authors, and patch the outputs
+
+def _filter_sids(coauth_pairs, gen_1_sids, max_dist):
+	'''
+	The authors within `max_dist` of generation 1, as in step 2a, computed 
+	without building the network
+	
+	:return: Set of SIDs
+	'''
+	neighbors = {}
+	for [auth1, auth2] in coauth_pairs:
+		neighbors.setdefault(auth1, set()).add(auth2)
+		neighbors.setdefault(auth2, set()).add(auth1)
+	keep = set(sid for sid in gen_1_sids if sid in neighbors)
+	frontier = keep
+	for i in range(max_dist):
+		frontier = set(nbr for sid in frontier for nbr in neighbors[sid]) - keep
+		keep |= frontier
+	return(keep)
+
+
+def _queried_sids(raw_file):
+	'''
+	The authors with responses in a raw response file
+	'''
+	return(set(record['sid'] for record in iter_jsonl(raw_file)))
+
+
+def _query_times(kind, queried, fallback_file):
+	'''
+	Time each author was last queried.  Authors queried before the query 
+	times were logged get the modification time of `fallback_file`.  
+	'''
+	fetched = _load_fetched()[kind]
+	if os.access(fallback_file, os.R_OK):
+		fallback = os.path.getmtime(fallback_file)
+	else:
+		fallback = 0
+	times = {sid: fallback for sid in queried}
+	times.update(fetched)
+	return(times)
+
+
+def _replace_responses(raw_file, keep_sids, refreshed_sids, refreshed_file):
+	'''
+	Replace the raw responses for the refreshed authors with those in 
+	`refreshed_file`, and drop the responses for authors no longer in 
+	`keep_sids`.  Running this again with the same files changes nothing.  
+	'''
+	with JsonArrayWriter(raw_file, lines = True) as writer:
+		writer.write_all(record for record in iter_jsonl(raw_file) 
+							if record['sid'] in keep_sids and 
+								record['sid'] not in refreshed_sids)
+		writer.write_all(iter_jsonl(refreshed_file))
+	return True
+
+
+def _report_pairs(old_pairs, new_pairs):
+	'''
+	Print the number of coauthor pairs a refresh added and removed
+	'''
+	old_set = set(map(tuple, old_pairs))
+	new_set = set(map(tuple, new_pairs))
+	print('\t' + str(len(new_set - old_set)) + ' coauthor pairs added, ' + 
+			str(len(old_set - new_set)) + ' removed')
+
+
+def _patch_network(keep_sids, coauth_pairs):
+	'''
+	Apply the vertex and edge delta between the saved network from step 2a 
+	and `coauth_pairs`, filtered to `keep_sids`
+	'''
+	import graph_tool as gt
+	net = gt.load_graph(net_outfile_pre + '.temp' + '.gt')
+	sids = [net.vp['sid'][v] for v in net.vertices()]
+	old_edges = set(tuple(sorted([sids[s], sids[t]])) 
+						for s, t in net.get_edges()[:, :2])
+	new_edges = set(tuple(sorted(pair)) for pair in coauth_pairs 
+						if pair[0] in keep_sids and pair[1] in keep_sids)
+	removed_sids = set(sids) - keep_sids
+	added_sids = keep_sids - set(sids)
+	print('Patching network: ' + 
+			str(len(added_sids)) + ' authors added, ' + 
+			str(len(removed_sids)) + ' removed; ' + 
+			str(len(new_edges - old_edges)) + ' coauthor pairs added, ' + 
+			str(len(old_edges - new_edges)) + ' removed')
 	
-	# Save as a gt file	
-	net.save(net_outfile_pre + '.gt')
+	gt_from_sid = {sid: net.vertex(i) for i, sid in enumerate(sids)}
+	# Edges between remaining authors first; removing the vertices takes 
+	#  care of the rest
+	for (auth1, auth2) in old_edges - new_edges:
+		if auth1 in removed_sids or auth2 in removed_sids:
+			continue
+		net.remove_edge(net.edge(gt_from_sid[auth1], gt_from_sid[auth2]))
+	net.remove_vertex([gt_from_sid[sid] for sid in removed_sids], fast = False)
+	gt_from_sid = {net.vp['sid'][v]: v for v in net.vertices()}
+	for sid in added_sids:
+		new_v = net.add_vertex()
+		net.vp['sid'][new_v] = sid
+		gt_from_sid[sid] = new_v
+	for (auth1, auth2) in new_edges - old_edges:
+		net.add_edge(gt_from_sid[auth1], gt_from_sid[auth2])
+	
+	combined_sids = [net.vp['sid'][v] for v in net.vertices()]
+	json_writef(combined_sids, combined_sids_file)
+	net.save(net_outfile_pre + '.temp' + '.gt')
+	return True
+
+
+def refresh(max_age = max_age, max_dist = max_dist):
+	'''
+	Update a finished scrape, re-querying only the authors that were last 
+	queried more than `max_age` days ago, or that are new to `sids_infile`.  
+	The new responses replace the old ones in the raw response files, which 
+	are then parsed again, so the parsed outputs always match the raw files; 
+	the network from step 2a and `combined_sids_file` are patched in place.  
+	Like the batch steps, a refresh can run over several sessions; its 
+	batches are kept in `refresh_batch_folder`.  
 	
-	# Save as a graphml file
-	net.save(net_outfile_pre + '.graphml')
+	:param max_age: Age, in days, after which an author is stale
+	:param max_dist: Maximum distance from generation 1, as in step 2a
 	
-	status['3']['start'] = True
-	status['3']['finish'] = True
-	json_writef(status, status_file)
+	:return: True iff the refresh finished
+	'''
+	if os.access(refresh_status_file, os.R_OK):
+		status = json_readf(refresh_status_file)
+	else:
+		status = {'phase': 'gen_1', 'cutoff': time.time() - max_age*24*60*60}
+		json_writef(status, refresh_status_file)
+	cutoff = status['cutoff']
+	gen_1_sids = json_readf(sids_infile)
+	def refresh_batch(kind, candidates, fallback_file, fetch, outfile, label):
+		# The responses are kept until the raw file is updated, so an 
+		#  interrupted update is finished without querying again
+		if os.access(outfile, os.R_OK):
+			return True
+		queried = _query_times(kind, _queried_sids(fallback_file), 
+								fallback_file)
+		def get_items():
+			to_query = [sid for sid in candidates 
+							if queried.get(sid, 0) < cutoff]
+			print(str(len(to_query)) + ' new or stale authors ' + label)
+			status['requeried'] = to_query
+			json_writef(status, refresh_status_file)
+			return(to_query)
+		return(_batch_step(get_items, parse.raw_fetcher(fetch), outfile, kind, 
+							lines = True, folder = refresh_batch_folder))
+	def next_phase(phase, refreshed_file):
+		status['phase'] = phase
+		json_writef(status, refresh_status_file)
+		os.remove(refreshed_file)
+	
+	if status['phase'] == 'gen_1':
+		if not refresh_batch('coauths', gen_1_sids, raw_gen_1_coauth_file, 
+								fetch_coauths_by_sid, refresh_coauth_1_file, 
+								'in generation 1'):
+			return False
+		print('Updating generation 1 coauthor pairs')
+		old_pairs = json_readf(gen_1_coauth_outfile)
+		_replace_responses(raw_gen_1_coauth_file, set(gen_1_sids), 
+							set(status['requeried']), refresh_coauth_1_file)
+		parse_1a()
+		_report_pairs(old_pairs, json_readf(gen_1_coauth_outfile))
+		next_phase('gen_2', refresh_coauth_1_file)
+	
+	if status['phase'] == 'gen_2':
+		gen_1_coauth = json_readf(gen_1_coauth_outfile)
+		gen_1_set = set(gen_1_sids)
+		gen_2_sids = set(pair[1] for pair in gen_1_coauth 
+								if pair[1] not in gen_1_set)
+		if not refresh_batch('coauths', gen_2_sids, raw_gen_2_coauth_file, 
+								fetch_coauths_by_sid, refresh_coauth_2_file, 
+								'in generation 2'):
+			return False
+		print('Updating generation 2 coauthor pairs')
+		old_pairs = json_readf(gen_2_coauth_outfile)
+		_replace_responses(raw_gen_2_coauth_file, gen_2_sids, 
+							set(status['requeried']), refresh_coauth_2_file)
+		parse_1b()
+		gen_2_coauth = json_readf(gen_2_coauth_outfile)
+		_report_pairs(old_pairs, gen_2_coauth)
+		
+		keep_sids = _filter_sids(gen_1_coauth + gen_2_coauth, 
+									set(pair[0] for pair in gen_1_coauth), 
+									max_dist)
+		_patch_network(keep_sids, gen_1_coauth + gen_2_coauth)
+		next_phase('metadata', refresh_coauth_2_file)
+	
+	if status['phase'] == 'metadata':
+		wanted = set(json_readf(combined_sids_file) + gen_1_sids)
+		if not refresh_batch('metadata', wanted, raw_author_data_file, 
+								fetch_auth_data_by_sid, refresh_metadata_file, 
+								'to retrieve'):
+			return False
+		print('Updating author metadata: ' + 
+				str(len(_queried_sids(refresh_metadata_file))) + 
+				' authors retrieved')
+		_replace_responses(raw_author_data_file, wanted, 
+							set(status['requeried']), refresh_metadata_file)
+		parse_2b()
+		os.remove(refresh_metadata_file)
+	
+	os.remove(refresh_status_file)
+	print('Finished refresh')
+	return True
 
-if status['3']['finish'] == False:
-	print('Not yet finished with all steps')
-else:
-	print('Finished with all steps')
\ No newline at end of file
+
+if __name__ == '__main__':
+	print('Run started at ' + time.strftime('%c', time.localtime()))
+	for step in [step_1a, parse_1a, step_1b, parse_1b, step_2a, 
+					step_2b, parse_2b, step_3]:
+		with metrics.stage(step.__name__):
+			finished = step()
+		metrics.write()
+		if not finished:
+			print('Not yet finished with all steps')
+			break
+	else:
+		print('Finished with all steps')
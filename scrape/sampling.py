@@ -0,0 +1,553 @@
+# -*- coding: utf-8 -*-
+'''
+This module estimates some metrics of the coauthor network from a crawl of
+a random sample of generation 1, rather than all of `sids.json`:
+
+	- `mean_degree`, and the distribution of degree, of generation 1
+	- country mixing of the coauthor pairs of generation 1:  the share of
+		pairs within a country (`same_country`), Newman's assortativity
+		coefficient by country (`country_assortativity`), and the mixing
+		matrix.  Authors without a country are left out.
+	- `giant_share`, the share of the authors in the network's largest
+		connected component
+
+Run it with
+
+	python build_network.py sample --precision 0.02 --strata Department
+
+The sample is stratified by a column of `Scopus IDs.csv` (`--strata`), if
+given, with each stratum sampled in proportion to its size.  The sampled
+authors are generation 1 of a crawl like `run_scrape`'s:  their coauthors
+are queried, and for `max_dist` >= 1, the coauthors of their coauthors,
+and the network is filtered to `max_dist` as in step 2a.  Author metadata
+are queried for generation 1 and their coauthors.
+
+The sample starts with `initial_share` of generation 1 (at least
+`MIN_SEEDS` authors), and grows by `growth` each round until every metric
+in `PRECISION_METRICS` is precise enough, or `max_share` of generation 1 is
+sampled.  A metric is precise enough when the half-width of its 90%
+confidence band, and its change since the last round, are both at most
+`precision` (for `mean_degree`, `precision` times the estimate).  The bands
+come from a stratified bootstrap of the sampled authors, narrowed by the
+finite population correction as the sample nears the whole of generation 1.  Each sample
+includes the last one, and the responses are kept in the `sample` folder,
+so each round only queries the new authors, and an interrupted run (eg,
+when the quota runs out) picks up where it left off.
+
+`giant_share` is measured on the network of the sampled authors, which is
+less connected than the full network; it rises as the sample grows, which
+the check on the change between rounds allows for.  The other metrics are
+estimates for the whole of generation 1.  The rounds are written to
+`sample/estimates.json`, along with the requests they took and an estimate
+of the requests for the full crawl, from the coauthors found so far (see
+`distinct_estimate`).
+'''
+
+import math
+import os
+import random
+from json_rw import *
+import metrics
+import scrape.prefetch as prefetch
+import scrape.run_scrape as run_scrape
+from scrape.scrape import (fetch_auth_data_by_sid, fetch_coauths_by_sid,
+							parse_response)
+
+SAMPLE_FOLDER = 'sample'
+coauths_file = os.path.join(SAMPLE_FOLDER, 'raw_coauths.jsonl')
+metadata_file = os.path.join(SAMPLE_FOLDER, 'raw_metadata.jsonl')
+estimates_file = os.path.join(SAMPLE_FOLDER, 'estimates.json')
+
+INITIAL_SHARE = 0.05	# Share of generation 1 in the first sample
+MIN_SEEDS = 30			# Authors in the first sample, at least
+GROWTH = 1.5			# Factor to grow the sample by each round
+MAX_SHARE = 0.5			# Share of generation 1 to stop at, at most
+PRECISION = 0.02		# Target half-width of the confidence bands
+BOOTSTRAP_SAMPLES = 500
+BAND = [0.05, 0.95]		# Quantiles of the bootstrap for the confidence band
+PRECISION_METRICS = ['mean_degree', 'same_country', 'giant_share']
+# Lower ends of the bins for the degree distribution
+DEGREE_BINS = [0, 1, 2, 5, 10, 20, 50, 100, 200]
+
+
+## ----------
+## Drawing the sample
+
+def allocate(sizes, n):
+	'''
+	Split a sample of `n` between strata in proportion to their sizes, by
+	largest remainder, with at least one from each stratum if `n` allows
+
+	:param sizes: List of the sizes of the strata
+	:return: List of the number to sample from each stratum
+	'''
+	total = sum(sizes)
+	n = min(n, total)
+	shares = [n * size / total for size in sizes]
+	counts = [min(size, max(1 if n >= len(sizes) else 0, math.floor(share)))
+				for size, share in zip(sizes, shares)]
+	# Hand out the rest by the largest remainder, where there's room
+	by_remainder = sorted(range(len(sizes)),
+							key = lambda h: counts[h] - shares[h])
+	while sum(counts) < n:
+		for h in by_remainder:
+			if sum(counts) < n and counts[h] < sizes[h]:
+				counts[h] += 1
+	while sum(counts) > n:
+		for h in reversed(by_remainder):
+			if sum(counts) > n and counts[h] > 1:
+				counts[h] -= 1
+	return(counts)
+
+
+def sample_orders(strata, seed = 0):
+	'''
+	Shuffle each stratum once, so that each sample is the start of each
+	stratum's order, and includes every smaller sample
+
+	:param strata: Dict mapping each SID to its stratum
+	:return: Dict mapping each stratum to its shuffled list of SIDs
+	'''
+	rng = random.Random(seed)
+	orders = {}
+	for sid in sorted(strata):
+		orders.setdefault(strata[sid], []).append(sid)
+	for stratum in sorted(orders):
+		rng.shuffle(orders[stratum])
+	return(orders)
+
+
+def draw(orders, n):
+	'''
+	:return: List of the sampled SIDs, and a matching list of their strata
+	'''
+	strata = sorted(orders)
+	counts = allocate([len(orders[stratum]) for stratum in strata], n)
+	seeds = []
+	seed_strata = []
+	for stratum, count in zip(strata, counts):
+		seeds += orders[stratum][:count]
+		seed_strata += [stratum] * count
+	return(seeds, seed_strata)
+
+
+## ----------
+## Crawling the sample
+
+def _read_cache(filename, kind, parsed):
+	'''
+	Parse the responses in a cache file that aren't in `parsed` yet,
+	adding them to `parsed`, a dict by SID
+	'''
+	if not os.access(filename, os.R_OK):
+		return(parsed)
+	for record in iter_jsonl(filename):
+		if record['sid'] in parsed:
+			continue
+		try:
+			items = parse_response(kind, record['sid'], record['response'])
+		except Exception:
+			# Left out, like the responses `parse_raw` can't parse
+			items = []
+		if kind == 'coauths':
+			parsed[record['sid']] = sorted(set(pair[1] for pair in items) -
+											{record['sid']})
+		else:
+			parsed[record['sid']] = (items[0]['country'] or '') if items else ''
+	return(parsed)
+
+
+def crawl(seeds, max_dist, coauths, countries, workers = None):
+	'''
+	Query the coauthors and metadata needed for a sample, skipping the
+	authors already in the cache files
+
+	:param seeds: The sampled SIDs
+	:param coauths: Dict of the coauthors of each queried SID, updated
+	:param countries: Dict of the country of each SID with metadata, updated
+	:return: True iff every query was sent
+	'''
+	if workers is None:
+		workers = run_scrape.fetch_workers
+	os.makedirs(SAMPLE_FOLDER, exist_ok = True)
+	# Metadata for generation 1 start at once, alongside the coauthors
+	metadata = prefetch.Prefetcher(fetch_auth_data_by_sid, metadata_file,
+									workers = workers)
+	metadata.add(seeds)
+	gen_1 = prefetch.Prefetcher(fetch_coauths_by_sid, coauths_file,
+								workers = workers)
+	gen_1.add(seeds)
+	gen_1.close()
+	errors = [gen_1.error]
+	_read_cache(coauths_file, 'coauths', coauths)
+	coauthors = set(coauth for sid in seeds for coauth in coauths.get(sid, []))
+	metadata.add(coauthors)
+	if max_dist >= 1:
+		gen_2 = prefetch.Prefetcher(fetch_coauths_by_sid, coauths_file,
+									workers = workers)
+		gen_2.add(coauthors - set(seeds))
+		gen_2.close()
+		errors.append(gen_2.error)
+	metadata.close()
+	errors.append(metadata.error)
+	_read_cache(coauths_file, 'coauths', coauths)
+	_read_cache(metadata_file, 'metadata', countries)
+	return(all(error is None for error in errors))
+
+
+## ----------
+## Estimates
+
+class SampleData:
+	'''
+	The sampled network, as arrays, for the estimates and their bootstrap
+
+	:param seeds: The sampled SIDs
+	:param seed_strata: The stratum of each sampled SID
+	:param stratum_sizes: Dict of the number of SIDs in each stratum
+	:param coauths: Dict of the coauthors of each queried SID
+	:param countries: Dict of the country of each SID with metadata
+	:param max_dist: Maximum distance from generation 1, as in step 2a
+	'''
+	def __init__(self, seeds, seed_strata, stratum_sizes, coauths, countries,
+					max_dist):
+		import numpy as np
+		self.max_dist = max_dist
+		sids = sorted(set(seeds) | set(coauths) |
+						set(coauth for sid in coauths for coauth in coauths[sid]))
+		index = {sid: i for i, sid in enumerate(sids)}
+		self.n_ids = len(sids)
+		self.seed_ix = np.array([index[sid] for sid in seeds], dtype = np.int64)
+		pairs = [(index[sid], index[coauth]) for sid in coauths
+					for coauth in coauths[sid]]
+		pairs = np.array(pairs, dtype = np.int64).reshape(-1, 2)
+		self.src = pairs[:, 0]
+		self.dst = pairs[:, 1]
+
+		# Each sampled author stands for the authors of its stratum
+		n_sampled = {}
+		for stratum in seed_strata:
+			n_sampled[stratum] = n_sampled.get(stratum, 0) + 1
+		self.weights = np.array([stratum_sizes[stratum] / n_sampled[stratum]
+									for stratum in seed_strata])
+		self.groups = [np.flatnonzero(np.array(seed_strata, dtype = object) ==
+										stratum) for stratum in sorted(n_sampled)]
+
+		self.degree = np.array([len(coauths.get(sid, [])) for sid in seeds])
+		self.degree_bin = np.searchsorted(DEGREE_BINS, self.degree,
+											side = 'right') - 1
+		# Coauthor pairs of each sampled author, by pair of countries
+		self.countries = sorted(set(country for country in countries.values()
+										if country != ''))
+		codes = {country: c for c, country in enumerate(self.countries)}
+		pair_seed = []
+		pair_code = []
+		for i, sid in enumerate(seeds):
+			if countries.get(sid, '') == '':
+				continue
+			for coauth in coauths.get(sid, []):
+				if countries.get(coauth, '') != '':
+					pair_seed.append(i)
+					pair_code.append(codes[countries[sid]] * len(codes) +
+										codes[countries[coauth]])
+		self.pair_seed = np.array(pair_seed, dtype = np.int64)
+		self.pair_code = np.array(pair_code, dtype = np.int64)
+
+	def giant_share(self, chosen):
+		'''
+		Share of the authors in the largest component of the network from
+		the sampled authors in `chosen`, built as in step 2a
+
+		:param chosen: Boolean array over the sampled authors
+		'''
+		import numpy as np
+		from components import component_labels
+		gen_1 = np.zeros(self.n_ids, dtype = bool)
+		gen_1[self.seed_ix[chosen]] = True
+		queried = gen_1.copy()
+		if self.max_dist >= 1:
+			queried[self.dst[gen_1[self.src]]] = True
+		usable = queried[self.src]
+		src, dst = self.src[usable], self.dst[usable]
+		has_pair = np.zeros(self.n_ids, dtype = bool)
+		has_pair[src] = True
+		has_pair[dst] = True
+		keep = gen_1 & has_pair
+		frontier = keep
+		for step in range(self.max_dist):
+			reached = np.zeros(self.n_ids, dtype = bool)
+			reached[dst[frontier[src]]] = True
+			reached[src[frontier[dst]]] = True
+			frontier = reached & ~keep
+			keep |= frontier
+		kept = np.flatnonzero(keep)
+		if len(kept) == 0:
+			return(0.0)
+		local = np.full(self.n_ids, -1, dtype = np.int64)
+		local[kept] = np.arange(len(kept))
+		inside = keep[src] & keep[dst]
+		labels = component_labels(len(kept), np.column_stack(
+										[local[src[inside]], local[dst[inside]]]))
+		return(float(np.bincount(labels).max() / len(kept)))
+
+	def statistics(self, counts):
+		'''
+		The metrics for a sample with each sampled author counted `counts`
+		times, as in a bootstrap resample
+
+		:return: Dict of the metrics, the degree distribution (by bin), and
+			the country mixing matrix
+		'''
+		import numpy as np
+		weights = counts * self.weights
+		total = weights.sum()
+		n_countries = len(self.countries)
+		mixing = np.bincount(self.pair_code, weights = weights[self.pair_seed],
+								minlength = n_countries**2)
+		mixing = mixing.reshape(n_countries, n_countries)
+		# Count each pair from both ends
+		mixing = mixing + mixing.T
+		if mixing.sum() > 0:
+			mixing = mixing / mixing.sum()
+		same = float(np.trace(mixing))
+		expected = float(np.sum(mixing.sum(axis = 1)**2))
+		return({'metrics': {
+					'mean_degree': float(np.sum(weights * self.degree) / total),
+					'same_country': same,
+					'country_assortativity': (same - expected) / (1 - expected)
+												if expected < 1 else 0.0,
+					'giant_share': self.giant_share(counts > 0)},
+				'degree': np.bincount(self.degree_bin, weights = weights,
+										minlength = len(DEGREE_BINS)) / total,
+				'mixing': mixing})
+
+	def bootstrap(self, rng, samples = BOOTSTRAP_SAMPLES):
+		'''
+		Resample the sampled authors with replacement, within each stratum
+
+		:return: List of `statistics` for each resample
+		'''
+		import numpy as np
+		resamples = []
+		for i in range(samples):
+			picks = np.concatenate([rng.choice(group, len(group))
+									for group in self.groups])
+			resamples.append(self.statistics(
+					np.bincount(picks, minlength = len(self.weights))))
+		return(resamples)
+
+
+def _band(values, point, correction = 1):
+	'''
+	Bootstrap confidence band, with the spread around the point estimate
+	scaled by `correction`
+	'''
+	import numpy as np
+	return([float(point + correction * (bound - point))
+				for bound in np.quantile(values, BAND)])
+
+
+def _bin_names():
+	names = []
+	for low, high in zip(DEGREE_BINS, DEGREE_BINS[1:] + [None]):
+		if high is None:
+			names.append(str(low) + '+')
+		elif high == low + 1:
+			names.append(str(low))
+		else:
+			names.append(str(low) + '-' + str(high - 1))
+	return(names)
+
+
+def estimate(data, rng):
+	'''
+	Point estimates and bootstrap confidence bands for the sampled network
+
+	:param data: `SampleData`
+	:param rng: numpy random generator, for the bootstrap
+	:return: Dict of the `metrics`, the `degree` distribution, and the
+		country `mixing` matrix (as a dict of dicts, without bands)
+	'''
+	import numpy as np
+	point = data.statistics(np.ones(len(data.weights)))
+	resamples = data.bootstrap(rng)
+	# Finite population correction:  the bootstrap treats generation 1 as
+	#  unlimited, but a large sample of it leaves little to vary.  It
+	#  doesn't apply to `giant_share`, which isn't a mean over the sample.
+	correction = math.sqrt(max(0, 1 - len(data.weights) / data.weights.sum()))
+	report = {'metrics': {}, 'degree': {}, 'mixing': {}}
+	for name, value in point['metrics'].items():
+		report['metrics'][name] = {'estimate': value, 'band': _band(
+							[resample['metrics'][name] for resample in resamples],
+							value, 1 if name == 'giant_share' else correction)}
+	degree = np.array([resample['degree'] for resample in resamples])
+	for b, name in enumerate(_bin_names()):
+		report['degree'][name] = {'estimate': float(point['degree'][b]),
+									'band': _band(degree[:, b], point['degree'][b],
+													correction)}
+	for a, country_a in enumerate(data.countries):
+		report['mixing'][country_a] = {country_b: float(point['mixing'][a, b])
+								for b, country_b in enumerate(data.countries)
+								if point['mixing'][a, b] > 0}
+	return(report)
+
+
+def precise(report, last, precision):
+	'''
+	:return: True iff each of `PRECISION_METRICS` has a confidence band of
+		half-width at most `precision`, and changed by at most `precision`
+		since the `last` round's report
+	'''
+	if last is None:
+		return(False)
+	for name in PRECISION_METRICS:
+		value = report['metrics'][name]
+		target = precision
+		if name == 'mean_degree':
+			target = precision * value['estimate']
+		half_width = (value['band'][1] - value['band'][0]) / 2
+		change = abs(value['estimate'] - last['metrics'][name]['estimate'])
+		if half_width > target or change > target:
+			return(False)
+	return(True)
+
+
+def distinct_estimate(counts, n_queried, share):
+	'''
+	Estimate the number of distinct authors that a full crawl would find,
+	from the number of queried authors in a sample who found each of them.
+	This is the lower bound of Chao and Lin (2012) for sampling without
+	replacement, from the authors found once (`q1`) and twice (`q2`):
+
+		found + q1**2 / (2 * q2 * n / (n - 1) + q1 * share / (1 - share))
+
+	:param counts: Number of queried authors who found each author
+	:param n_queried: Number of queried authors in the sample
+	:param share: Share of all the queried authors in the sample
+	'''
+	counts = list(counts)
+	if share >= 1 or n_queried < 2:
+		return(len(counts))
+	q1 = counts.count(1)
+	q2 = counts.count(2)
+	denominator = 2 * q2 * n_queried / (n_queried - 1) + \
+					q1 * share / (1 - share)
+	return(len(counts) + (q1**2 / denominator if denominator > 0 else 0))
+
+
+def _full_requests(seeds, gen_1, coauths, max_dist):
+	'''
+	Estimate the requests for the full crawl, step by step as `run_scrape`
+	sends them:  step 1a queries the coauthors of generation 1; step 1b the
+	coauthors of generation 2 (the coauthors of generation 1 who aren't in
+	it), whatever `max_dist`; and step 2b the metadata of generation 1 and
+	of every author within `max_dist`
+	'''
+	def found(queried, exclude):
+		counts = {}
+		for sid in queried:
+			for coauth in coauths.get(sid, []):
+				if coauth not in exclude:
+					counts[coauth] = counts.get(coauth, 0) + 1
+		return(counts)
+	share = len(seeds) / len(gen_1)
+	found_2 = found(seeds, gen_1)
+	n_gen_2 = distinct_estimate(found_2.values(), len(seeds), share)
+	step_1a = len(gen_1)
+	step_1b = n_gen_2
+	step_2b = len(gen_1)
+	if max_dist >= 1:
+		step_2b += n_gen_2
+	if max_dist >= 2 and n_gen_2 > 0:
+		found_3 = found(found_2, gen_1 | found_2.keys())
+		step_2b += distinct_estimate(found_3.values(), len(found_2),
+										min(1, len(found_2) / n_gen_2))
+	return(round(step_1a + step_1b + step_2b))
+
+
+def print_round(report):
+	'''
+	Print the estimates of one round of `sample`
+	'''
+	print('Round {round}:  {seeds:,} authors sampled ({seed_share:.1%} of '
+			'generation 1); {requests:,} requests, about {request_share:.1%} '
+			'of the full crawl'.format(**report))
+	for name, value in report['metrics'].items():
+		print('\t{:24} {:10.3f}   90% band {:.3f} - {:.3f}'.format(name,
+				value['estimate'], *value['band']))
+
+
+def sample(precision = PRECISION, initial_share = INITIAL_SHARE,
+			growth = GROWTH, max_share = MAX_SHARE, strata_col_name = None,
+			max_dist = run_scrape.max_dist, seed = 0):
+	'''
+	Crawl a growing, stratified sample of generation 1 until the metrics are
+	precise enough
+
+	:param precision: Target half-width of the confidence bands
+	:param initial_share: Share of generation 1 in the first sample
+	:param growth: Factor to grow the sample by each round
+	:param max_share: Share of generation 1 to stop at
+	:param strata_col_name: Column of `get_sids.infile` to stratify by;
+		None for a simple random sample
+	:param max_dist: Maximum distance from generation 1, as in step 2a
+	:param seed: Seed for the sample and the bootstrap
+
+	:return: True iff the sampling finished, rather than stopping early
+		because of errors (eg, the quota ran out); run again to continue
+	'''
+	import numpy as np
+	import get_sids
+	gen_1 = json_readf(run_scrape.sids_infile)
+	strata = dict.fromkeys(gen_1, '')
+	if strata_col_name is not None:
+		known = get_sids.get_strata(strata_col_name)
+		strata = {sid: known.get(sid, '') for sid in gen_1}
+	orders = sample_orders(strata, seed)
+	stratum_sizes = {stratum: len(sids) for stratum, sids in orders.items()}
+	print(str(len(gen_1)) + ' authors in generation 1, in ' +
+			str(len(orders)) + ' strata')
+	rng = np.random.default_rng(seed)
+
+	coauths = _read_cache(coauths_file, 'coauths', {})
+	countries = _read_cache(metadata_file, 'metadata', {})
+	n_seeds = min(len(gen_1), max(MIN_SEEDS,
+									math.ceil(initial_share * len(gen_1))))
+	n_max = max(n_seeds, math.floor(max_share * len(gen_1)))
+	rounds = []
+	last = None
+	while True:
+		seeds, seed_strata = draw(orders, n_seeds)
+		print('Round ' + str(len(rounds) + 1) + ':  crawling ' +
+				str(len(seeds)) + ' authors')
+		finished = crawl(seeds, max_dist, coauths, countries)
+		if not finished:
+			print('Queries stopped early; run again to continue')
+			return False
+		with metrics.timer('sample_estimate_seconds'):
+			report = estimate(SampleData(seeds, seed_strata, stratum_sizes,
+											coauths, countries, max_dist), rng)
+		coauthors = set(coauth for sid in seeds for coauth in coauths.get(sid, []))
+		queried = set(seeds) | (coauthors if max_dist >= 1 else set())
+		requests = len(queried) + len(set(seeds) | coauthors)
+		full = _full_requests(seeds, set(gen_1), coauths, max_dist)
+		report.update({'round': len(rounds) + 1, 'seeds': len(seeds),
+						'seed_share': len(seeds) / len(gen_1),
+						'requests': requests, 'full_requests': full,
+						'request_share': requests / max(full, 1)})
+		report['precise'] = precise(report, last, precision)
+		rounds.append(report)
+		json_writef({'precision': precision, 'strata': strata_col_name,
+						'max_dist': max_dist, 'rounds': rounds},
+					estimates_file, indent = 4)
+		print_round(report)
+		if report['precise']:
+			print('Precise to ' + str(precision) + '; estimates in ' +
+					estimates_file)
+			return True
+		if n_seeds >= n_max:
+			print('Reached ' + str(n_seeds) + ' authors without the target ' +
+					'precision; estimates in ' + estimates_file)
+			return True
+		last = report
+		n_seeds = min(n_max, math.ceil(n_seeds * growth))
@@ -5,16 +5,46 @@ primarily from Scopus but also from PubMed.
 
 Note that these functions need a Scopus API key defined in `api_key.py`.
 A new Scopus API key can be generated by registering for free [on the Scopus API page](http://dev.elsevier.com/index.html). 
+To spread the queries across several keys, define a list `MY_API_KEYS` in 
+`api_key.py` instead of (or as well as) `MY_API_KEY`.  Each request goes to 
+the key with the most remaining quota; see `credentials.py`.  
+
+The API root can be changed with the environment variable `SCOPUS_API_ROOT`, 
+eg, to run against the local stand-in server in `fake_scopus.py`.  
+
+The number of requests in flight at once is set by `limiter`, which adapts 
+it to the rate limits, timeouts, and latencies seen from Scopus, up to 
+`MAX_CONCURRENCY`; see `concurrency.py`.  
 '''
 
 #from collections import OrderedDict
 import requests
 import json
 #from math import ceil
+import os
 import time # Used to pause after receiving a timeout error
 import xmltodict
 
-from api_key import MY_API_KEY
+if __name__ == '__main__':
+	# Find the modules in the repository root when run as a script
+	import sys
+	sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+if __package__:
+	from . import concurrency
+	from .credentials import CredentialPool
+else:
+	import concurrency
+	from credentials import CredentialPool
+
+try:
+	from api_key import MY_API_KEYS
+except ImportError:
+	from api_key import MY_API_KEY
+	MY_API_KEYS = [MY_API_KEY]
+
+API_ROOT = os.environ.get('SCOPUS_API_ROOT', 'http://api.elsevier.com/content/')
+credentials = CredentialPool(MY_API_KEYS)
 
 class ParseError(Exception):
 	pass
@@ -121,47 +151,145 @@ def _parse_auth_data(response_raw):
 			'country': country}
 	return meta
 			
-def _get_query(query):
+# Timeout for HTTP requests
+TIMEOUT = 2*60
+# Delay, in seconds, after receiving a timeout or server error, once the 
+#  concurrency limit is as low as it goes
+DELAY = 2*60
+# Delay before retrying while the concurrency limit can still be lowered
+RETRY_DELAY = 1
+# Maximum number of requests in flight at once
+MAX_CONCURRENCY = 8
+limiter = concurrency.AimdLimiter(maximum = MAX_CONCURRENCY)
+# Maximum number of attempts to make before throwing an error
+MAX_ATTEMPTS = 2
+# Maximum number of rate-limited (`429`) responses to wait out for one query
+MAX_THROTTLED = 20
+
+def _cooldown():
+	'''
+	Delay before retrying after a timeout or server error.  Lowering the 
+	concurrency limit is the first response to congestion; the long delay is 
+	only needed once the limit can't go lower.  
 	'''
-	Get an HTTP query, with some wrapping to handle timeouts.
+	if limiter.at_minimum():
+		return(DELAY)
+	return(min(DELAY, RETRY_DELAY))
+
+def _get_query(query, endpoint = 'other'):
+	'''
+	Get an HTTP query, with some wrapping to handle timeouts, server errors, 
+	and rate limits.  The API key is chosen from `credentials` and sent in the 
+	`X-ELS-APIKey` header.  The request waits for a slot from `limiter`, and 
+	its outcome is reported back to it.  Latencies and outcomes are recorded 
+	in `metrics`, labelled with `endpoint`.  
 	:param query: The HTTP query string
+	:param endpoint: Label for the metrics
 	:return: The requests.get response
 	'''
-	# Timeout for HTTP requests
-	TIMEOUT = 2*60
-	# Delay, in seconds, after receiving a timeout
-	DELAY = 2*60
-	# Maximum number of attempts to make before throwing an error
-	MAX_ATTEMPTS = 2
-	
 	attempts = 0
+	throttled = 0
 	while (attempts < MAX_ATTEMPTS):
-		attempts += 1
+		ticket = limiter.acquire()
+		outcome = concurrency.ERROR
+		start = time.perf_counter()
 		try:
-			response_raw = requests.get(query, 
-							#headers = {'X-ELS-APIKey': MY_API_KEY}, 
-							timeout = TIMEOUT)
-			return(response_raw.text)
+			# Raises CredentialError if every key is exhausted
+			key = credentials.choose()
+			with metrics.timer('scrape_request_seconds', endpoint = endpoint):
+				response_raw = requests.get(query, 
+								headers = {'X-ELS-APIKey': key}, 
+								timeout = TIMEOUT)
+			if response_raw.status_code == 429 and 'QUOTA_EXCEEDED' not in \
+					response_raw.headers.get('X-ELS-Status', ''):
+				outcome = concurrency.THROTTLED
+			elif response_raw.status_code < 400:
+				outcome = concurrency.OK
 		except requests.exceptions.Timeout:
-			print('Request timed out.  Cooldown for ' + str(DELAY) + ' seconds.')
-			time.sleep(DELAY)
+			outcome = concurrency.TIMEOUT
+		finally:
+			limiter.release(ticket, outcome, time.perf_counter() - start)
+		if outcome == concurrency.TIMEOUT:
+			metrics.inc('scrape_retries_total', endpoint = endpoint, 
+						reason = 'timeout')
+			attempts += 1
+			delay = _cooldown()
+			print('Request timed out.  Cooldown for ' + str(delay) + ' seconds.')
+			time.sleep(delay)
+			continue
+		credentials.update(key, response_raw.headers, 
+							response_raw.status_code)
+		metrics.inc('scrape_requests_total', endpoint = endpoint, 
+					status = response_raw.status_code)
+		if response_raw.status_code == 429:
+			# Either this key's quota is exceeded, and it's now parked, or 
+			#  we're over the rate limit and should wait a moment
+			metrics.inc('scrape_retries_total', endpoint = endpoint, 
+						reason = 'throttled')
+			throttled += 1
+			if throttled > MAX_THROTTLED:
+				attempts += 1
+				throttled = 0
+			if 'QUOTA_EXCEEDED' not in response_raw.headers.get('X-ELS-Status', ''):
+				time.sleep(float(response_raw.headers.get('Retry-After', 1)))
+			continue
+		if response_raw.status_code >= 500:
+			metrics.inc('scrape_retries_total', endpoint = endpoint, 
+						reason = 'server_error')
+			attempts += 1
+			delay = _cooldown()
+			print('Server error ' + str(response_raw.status_code) + 
+					'.  Cooldown for ' + str(delay) + ' seconds.')
+			time.sleep(delay)
+			continue
+		return(response_raw.text)
 	else:
 		#raise requests.exceptions.Timeout('Maximum number of requests')
 		print('Maximum number of attempts for this URL')
+		metrics.inc('scrape_failures_total', endpoint = endpoint)
 		return json.dumps('')
 
 
+def fetch_coauths_by_sid(sid):
+	'''
+	Query Scopus for the coauthors of an author.  Returns the raw response, 
+	to be parsed by `parse_response`.  
+	'''
+	# Build the http query, and send it using `_get_query`
+	base_query = API_ROOT + 'search/author?'
+	query = base_query + 'co-author=' + sid + '&count=200'
+	return(_get_query(query, endpoint = 'coauthors'))
+
+def fetch_auth_data_by_sid(sid):
+	'''
+	Query Scopus for an author's data.  Returns the raw response, to be 
+	parsed by `parse_response`.  
+	'''
+	base_query = API_ROOT + 'author/author_id/'
+	query = base_query + sid
+	return(_get_query(query, endpoint = 'author'))
+
+def parse_response(kind, sid, response_raw):
+	'''
+	Parse a raw response from `fetch_coauths_by_sid` (`kind = 'coauths'`) or 
+	`fetch_auth_data_by_sid` (`kind = 'metadata'`).  
+	:return: List of coauthor pairs, or a list containing the dict of author 
+		data; empty if the author wasn't found
+	'''
+	if kind == 'coauths':
+		return(_parse_coauth_data(sid, response_raw))
+	meta = _parse_auth_data(response_raw)
+	if meta == []:
+		return([])
+	return([meta])
+
 def get_coauths_by_sid(sid):
 	'''
 	Use Scopus to identify coauthors.  Returns a list of pairs of SIDs.  
 	'''
-	# Build the http query, and send it using `_get_query`
-	base_query = 'http://api.elsevier.com/content/search/author?'
-	query = base_query + 'co-author=' + sid + \
-		'&count=200' + '&apiKey=' + MY_API_KEY
-	print('\t' + query)
-	response_raw = _get_query(query)
-	meta = _parse_coauth_data(sid, response_raw)
+	response_raw = fetch_coauths_by_sid(sid)
+	with metrics.timer('scrape_parse_seconds', endpoint = 'coauthors'):
+		meta = parse_response('coauths', sid, response_raw)
 	return meta
 	
 def get_auth_data_by_sid(sid):
@@ -169,12 +297,10 @@ def get_auth_data_by_sid(sid):
 	Use Scopus to retrieve author data.  Returns a list containing the dict 
 	of author data.  
 	'''
-	base_query = 'http://api.elsevier.com/content/author/author_id/'
-	query = base_query + sid + '?' + 'apiKey=' + MY_API_KEY
-	print('\t' + query)
-	response_raw = _get_query(query)
-	meta = _parse_auth_data(response_raw)
-	return [meta]
+	response_raw = fetch_auth_data_by_sid(sid)
+	with metrics.timer('scrape_parse_seconds', endpoint = 'author'):
+		meta = parse_response('metadata', sid, response_raw)
+	return meta
 
 
 if __name__ == '__main__':
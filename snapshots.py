@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+'''
+This module keeps a history of the coauthor network across runs of the
+pipeline.  Each time the collapsed network changes, `record` saves it as a
+new version in the `snapshots` folder.  Only the changes from the previous
+version are stored:  authors added and removed, changed author metadata,
+and coauthor pairs added and removed.  Every `FULL_EVERY` versions, the
+whole network is stored as well, so that rebuilding any version means
+reading one full snapshot and at most `FULL_EVERY - 1` deltas.
+
+Authors are identified by their SIDs, so the snapshots are taken from
+`coauth_net.collapsed.gt`, before the SIDs are replaced by `sanitize`.  Like
+`pii.csv`, the snapshots contain PII and shouldn't be shared.
+
+`diff` compares two versions using only the deltas between them, without
+rebuilding either network:
+
+	python snapshots.py list
+	python snapshots.py diff 3 7
+
+`check` confirms that recording the same network twice records no new
+version, even with a collapsed author's lists in another order.
+
+Both the full snapshots and the deltas are gzipped json files.  A delta
+looks like
+
+	{'authors_added': {sid: metadata, ...},
+	 'authors_removed': {sid: metadata, ...},
+	 'authors_changed': {sid: {field: [old, new], ...}, ...},
+	 'edges_added': [[sid, sid], ...],
+	 'edges_removed': [[sid, sid], ...]}
+
+where the removed authors keep their metadata, so that deltas can be
+reversed.
+'''
+
+import ast
+import os
+import time
+from json_rw import *
+
+SNAPSHOT_FOLDER = 'snapshots'
+INDEX_FILE = os.path.join(SNAPSHOT_FOLDER, 'index.json')
+FULL_EVERY = 10			# Store the full network every this many versions
+net_infile = 'coauth_net.collapsed.gt'
+# Vertex properties stored for each author
+FIELDS = ['surname', 'given', 'docs', 'areas', 'affiliation', 'country']
+
+
+class SnapshotError(Exception):
+	pass
+
+
+def _sorted_field(value):
+	'''
+	Put a list-valued field of a collapsed author in a fixed order.  
+	`collapse_duplicates` stores lists, or their `str` in the string 
+	properties; in networks collapsed before it sorted them, their order 
+	came from hashing, which changes between runs.  
+	'''
+	if isinstance(value, str) and value.startswith('[') and value.endswith(']'):
+		try:
+			parsed = ast.literal_eval(value)
+		except (ValueError, SyntaxError):
+			return(value)
+		if isinstance(parsed, list):
+			return(str(sorted(parsed)))
+		return(value)
+	if isinstance(value, list):
+		return(sorted(value))
+	return(value)
+
+
+def _load_net(net_file):
+	'''
+	Read the authors and coauthor pairs from a network file
+
+	:return: Dict of author metadata, keyed by SID, and set of SID pairs
+	'''
+	import graph_tool as gt
+
+	net = gt.load_graph(net_file)
+	sids = [net.vp['sid'][v] for v in net.vertices()]
+	fields = [field for field in FIELDS if field in net.vp]
+	authors = {sid: {field: _sorted_field(net.vp[field][v]) for field in fields}
+				for sid, v in zip(sids, net.vertices())}
+	edges = set(tuple(sorted([sids[s], sids[t]]))
+					for s, t in net.get_edges()[:, :2])
+	return(authors, edges)
+
+
+def _delta(old_authors, old_edges, authors, edges):
+	'''
+	The changes from one version to the next
+	'''
+	changed = {}
+	for sid in authors.keys() & old_authors.keys():
+		fields = {field: [old_authors[sid].get(field), value]
+					for field, value in authors[sid].items()
+					if old_authors[sid].get(field) != value}
+		if fields != {}:
+			changed[sid] = fields
+	return({'authors_added': {sid: authors[sid]
+								for sid in authors.keys() - old_authors.keys()},
+			'authors_removed': {sid: old_authors[sid]
+								for sid in old_authors.keys() - authors.keys()},
+			'authors_changed': changed,
+			'edges_added': sorted(map(list, edges - old_edges)),
+			'edges_removed': sorted(map(list, old_edges - edges))})
+
+
+def _is_empty(delta):
+	return(all(len(changes) == 0 for changes in delta.values()))
+
+
+def _apply(authors, edges, delta):
+	'''
+	Apply a delta to a network, in place
+	'''
+	for sid in delta['authors_removed']:
+		del authors[sid]
+	authors.update(delta['authors_added'])
+	for sid, fields in delta['authors_changed'].items():
+		for field, (old, new) in fields.items():
+			authors[sid][field] = new
+	edges.difference_update(map(tuple, delta['edges_removed']))
+	edges.update(map(tuple, delta['edges_added']))
+
+
+def _version_file(version, kind):
+	return(os.path.join(SNAPSHOT_FOLDER, str(version) + '.' + kind + '.json.gz'))
+
+
+def _read_index():
+	if os.access(INDEX_FILE, os.R_OK):
+		return(json_readf(INDEX_FILE))
+	return({'versions': []})
+
+
+def versions():
+	'''
+	:return: List of dicts describing the recorded versions
+	'''
+	return(_read_index()['versions'])
+
+
+def _entry(version):
+	for entry in versions():
+		if entry['version'] == version:
+			return(entry)
+	raise SnapshotError('No snapshot version ' + str(version))
+
+
+def reconstruct(version = None):
+	'''
+	Rebuild a version of the network from the nearest full snapshot and the
+	deltas after it
+
+	:param version: Version number; by default, the latest version
+	:return: Dict of author metadata, keyed by SID, and set of SID pairs
+	'''
+	recorded = versions()
+	if recorded == []:
+		raise SnapshotError('No snapshots recorded')
+	if version is None:
+		version = recorded[-1]['version']
+	_entry(version)
+	base = max(entry['version'] for entry in recorded
+				if entry['full'] and entry['version'] <= version)
+	full = json_readf(_version_file(base, 'full'))
+	authors = full['authors']
+	edges = set(map(tuple, full['edges']))
+	for entry in recorded:
+		if base < entry['version'] <= version:
+			_apply(authors, edges, json_readf(_version_file(entry['version'],
+																'delta')))
+	return(authors, edges)
+
+
+def record(net_file = net_infile, label = ''):
+	'''
+	Record the network in `net_file` as a new version, if it differs from
+	the latest one
+
+	:param label: Optional description of the version
+	:return: True
+	'''
+	authors, edges = _load_net(net_file)
+	index = _read_index()
+	if index['versions'] == []:
+		version = 1
+		delta = None
+	else:
+		old_authors, old_edges = reconstruct()
+		delta = _delta(old_authors, old_edges, authors, edges)
+		if _is_empty(delta):
+			print('Network unchanged since snapshot ' +
+					str(index['versions'][-1]['version']))
+			return True
+		version = index['versions'][-1]['version'] + 1
+	if not os.access(SNAPSHOT_FOLDER, os.F_OK):
+		os.mkdir(SNAPSHOT_FOLDER)
+
+	full = delta is None or version % FULL_EVERY == 0
+	entry = {'version': version, 'time': time.time(), 'label': label,
+				'source': net_file, 'authors': len(authors),
+				'edges': len(edges), 'full': full}
+	if delta is not None:
+		json_writef(delta, _version_file(version, 'delta'))
+		entry['changes'] = {key: len(changes) for key, changes in delta.items()}
+	if full:
+		json_writef({'authors': authors, 'edges': sorted(map(list, edges))},
+					_version_file(version, 'full'))
+	index['versions'].append(entry)
+	# The index is written last, so an interrupted record leaves no version
+	json_writef(index, INDEX_FILE, indent = 2)
+	print('Recorded snapshot ' + str(version) + ': ' + str(len(authors)) +
+			' authors, ' + str(len(edges)) + ' coauthor pairs')
+	return True
+
+
+def _invert(delta):
+	return({'authors_added': delta['authors_removed'],
+			'authors_removed': delta['authors_added'],
+			'authors_changed': {sid: {field: [new, old]
+										for field, (old, new) in fields.items()}
+								for sid, fields in delta['authors_changed'].items()},
+			'edges_added': delta['edges_removed'],
+			'edges_removed': delta['edges_added']})
+
+
+def diff(old_version, new_version):
+	'''
+	The changes between two versions, combined from the deltas between them.
+	Only the authors and pairs that changed are held in memory.
+
+	:return: A delta, in the format described above
+	'''
+	if old_version > new_version:
+		return(_invert(diff(new_version, old_version)))
+	_entry(old_version)
+	_entry(new_version)
+	# Metadata of each changed author in `old_version` (None if absent) and
+	#  `new_version`; and the net change in each pair
+	before = {}
+	after = {}
+	edges = {}
+	for entry in versions():
+		if not old_version < entry['version'] <= new_version:
+			continue
+		delta = json_readf(_version_file(entry['version'], 'delta'))
+		for sid, author in delta['authors_removed'].items():
+			if before.get(sid) is not None:
+				# Changed earlier in the range:  fill in the unchanged fields
+				before[sid] = dict(author, **before[sid])
+			before.setdefault(sid, author)
+			after[sid] = None
+		for sid, author in delta['authors_added'].items():
+			before.setdefault(sid, None)
+			after[sid] = dict(author)
+		for sid, fields in delta['authors_changed'].items():
+			if sid not in before:
+				before[sid] = {field: old for field, (old, new) in fields.items()}
+				after[sid] = {}
+			elif before[sid] is not None and after[sid] is not None:
+				for field, (old, new) in fields.items():
+					before[sid].setdefault(field, old)
+			for field, (old, new) in fields.items():
+				after[sid][field] = new
+		for pair in delta['edges_removed']:
+			edges[tuple(pair)] = edges.get(tuple(pair), 0) - 1
+		for pair in delta['edges_added']:
+			edges[tuple(pair)] = edges.get(tuple(pair), 0) + 1
+
+	combined = {'authors_added': {}, 'authors_removed': {},
+				'authors_changed': {},
+				'edges_added': sorted(list(pair) for pair, change
+										in edges.items() if change > 0),
+				'edges_removed': sorted(list(pair) for pair, change
+										in edges.items() if change < 0)}
+	for sid in before:
+		if before[sid] is None and after[sid] is not None:
+			combined['authors_added'][sid] = after[sid]
+		elif before[sid] is not None and after[sid] is None:
+			combined['authors_removed'][sid] = before[sid]
+		elif before[sid] is not None:
+			# Only the fields seen changing are recorded for authors present
+			#  throughout; for authors removed and re-added, compare them all
+			fields = {field: [before[sid].get(field), after[sid].get(field)]
+						for field in before[sid].keys() | after[sid].keys()
+						if before[sid].get(field) != after[sid].get(field)}
+			if fields != {}:
+				combined['authors_changed'][sid] = fields
+	return(combined)
+
+
+def new_authors(old_version, new_version):
+	'''
+	:return: Dict of metadata for the authors added between two versions
+	'''
+	return(diff(old_version, new_version)['authors_added'])
+
+
+def new_collaborations(old_version, new_version):
+	'''
+	:return: List of the coauthor pairs added between two versions
+	'''
+	return(diff(old_version, new_version)['edges_added'])
+
+
+def changed_affiliations(old_version, new_version):
+	'''
+	:return: Dict mapping the SIDs of authors whose affiliation changed
+		between two versions to their `[old, new]` affiliations
+	'''
+	return({sid: fields['affiliation'] for sid, fields
+				in diff(old_version, new_version)['authors_changed'].items()
+				if 'affiliation' in fields})
+
+
+def check():
+	'''
+	Check that recording the same network twice, with the lists of a 
+	collapsed author in another order, records no new version.  Runs in a 
+	temporary folder.  
+
+	:return: True iff the second `record` found the network unchanged
+	'''
+	import contextlib
+	import io
+	import tempfile
+	import graph_tool as gt
+	def save(order, net_file):
+		net = gt.Graph(directed = False)
+		net.add_vertex(3)
+		net.add_edge_list([(0, 1), (1, 2)])
+		net.vp['sid'] = net.new_vp('string', vals = ['1', "['2', '3']", '4'])
+		net.vp['areas'] = net.new_vp('object', 
+								vals = [['BIOC'], order(['MEDI', 'BIOC']), []])
+		net.vp['country'] = net.new_vp('string', 
+								vals = ['US', str(order(['US', 'CA'])), 'CA'])
+		net.vp['affiliation'] = net.new_vp('string', 
+								vals = ['A', str(order(['B', 'A'])), 'B'])
+		net.save(net_file)
+	original_wd = os.getcwd()
+	with tempfile.TemporaryDirectory() as folder:
+		os.chdir(folder)
+		try:
+			save(list, 'first.gt')
+			record('first.gt')
+			save(lambda values: values[::-1], 'second.gt')
+			output = io.StringIO()
+			with contextlib.redirect_stdout(output):
+				record('second.gt')
+		finally:
+			os.chdir(original_wd)
+	print(output.getvalue().strip())
+	return(output.getvalue().startswith('Network unchanged'))
+
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description = 'Network snapshots')
+	subparsers = parser.add_subparsers(dest = 'command', required = True)
+	record_parser = subparsers.add_parser('record',
+							help = 'Record the collapsed network as a version')
+	record_parser.add_argument('--net', default = net_infile)
+	record_parser.add_argument('--label', default = '')
+	subparsers.add_parser('list', help = 'List the recorded versions')
+	diff_parser = subparsers.add_parser('diff',
+							help = 'Summarize the changes between two versions')
+	diff_parser.add_argument('old', type = int)
+	diff_parser.add_argument('new', type = int)
+	diff_parser.add_argument('--output', help = 'Write the full diff as json')
+	subparsers.add_parser('check', 
+							help = 'Check that an unchanged network records no version')
+	args = parser.parse_args()
+
+	if args.command == 'record':
+		record(args.net, label = args.label)
+	elif args.command == 'list':
+		for entry in versions():
+			print('{version:4}  {when}  {authors:8} authors  {edges:9} pairs  '
+					'{label}'.format(when = time.strftime('%Y-%m-%d %H:%M',
+											time.localtime(entry['time'])),
+									**entry))
+	elif args.command == 'diff':
+		changes = diff(args.old, args.new)
+		print(str(len(changes['authors_added'])) + ' new authors, ' +
+				str(len(changes['authors_removed'])) + ' authors removed')
+		print(str(len(changes['edges_added'])) + ' new collaborations, ' +
+				str(len(changes['edges_removed'])) + ' collaborations removed')
+		print(str(len([sid for sid, fields in changes['authors_changed'].items()
+						if 'affiliation' in fields])) + ' changed affiliations')
+		if args.output:
+			json_writef(changes, args.output, indent = 2)
+	elif args.command == 'check':
+		if not check():
+			raise SnapshotError('Recording the same network twice changed it')